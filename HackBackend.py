@@ -0,0 +1,283 @@
+import argparse
+import os
+import sys
+from collections import Counter
+
+from VMBytecode import parse_vm, read_bytecode
+
+POINTERS = {'local': 'LCL', 'argument': 'ARG', 'this': 'THIS', 'that': 'THAT'}
+BINARY = {'add': 'M=D+M', 'sub': 'M=M-D', 'and': 'M=D&M', 'or': 'M=D|M'}
+UNARY = {'neg': 'M=-M', 'not': 'M=!M'}
+COMPARE = {'eq': 'JEQ', 'gt': 'JGT', 'lt': 'JLT'}
+NEGATED = {'JEQ': 'JNE', 'JGT': 'JLE', 'JLT': 'JGE'}
+TEMP_BASE = 5
+# beyond this many A=A+1 steps an address is computed through R13 instead
+MAX_ADDRESS_STEPS = 7
+
+PUSH_D = ['@SP', 'AM=M+1', 'A=A-1', 'M=D']
+POP_D = ['@SP', 'AM=M-1', 'D=M']
+
+
+def read_vm_files(paths):
+    programs = []
+    for path in paths:
+        name, extension = os.path.splitext(os.path.basename(path))
+        if extension == '.vmb':
+            programs.append((name, read_bytecode(path).commands()))
+        else:
+            with open(path) as f:
+                programs.append((name, parse_vm(f.read())))
+    return programs
+
+
+# the .vm and .vmb files in directory, taking the newer file when a class has both
+def vm_files(directory):
+    newest = {}
+    for file in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file)
+        if extension in ('.vm', '.vmb'):
+            path = os.path.join(directory, file)
+            if name not in newest or os.path.getmtime(path) > os.path.getmtime(newest[name]):
+                newest[name] = path
+    return [newest[name] for name in sorted(newest)]
+
+
+# lowers VM commands, given as (op, arg1, arg2) tuples, straight to Hack assembly; calls and returns go
+# through shared trampolines, and common command sequences are fused into single assembly sequences
+class AsmWriter:
+    def __init__(self):
+        self.lines = []
+        self.arities = set()
+        self.compares = False
+        self.labels = 0
+        self.fused = Counter()
+        self.file = None
+        self.function = None
+
+    def unique(self, kind):
+        self.labels += 1
+        return f"${kind}{self.labels}"
+
+    def write_bootstrap(self, entry):
+        self.lines.extend(['@256', 'D=A', '@SP', 'M=D'])
+        self.write_call(entry, 0)
+        self.lines.extend(['($HALT)', '@$HALT', '0;JMP'])
+
+    def write_file(self, name, commands):
+        self.file = name
+        i = 0
+        while i < len(commands):
+            i += self.write_fused(commands, i) or self.write_command(commands[i])
+
+    def write_trampolines(self):
+        for arguments in sorted(self.arities):
+            # D holds the return address and R13 the callee
+            self.lines.extend([f'($CALL{arguments})', '@SP', 'A=M', 'M=D'])
+            for pointer in ('LCL', 'ARG', 'THIS', 'THAT'):
+                self.lines.extend([f'@{pointer}', 'D=M', '@SP', 'AM=M+1', 'M=D'])
+            self.lines.extend(['@SP', 'MD=M+1', '@LCL', 'M=D', f'@{arguments + 5}', 'D=D-A', '@ARG', 'M=D',
+                               '@R13', 'A=M', '0;JMP'])
+        self.lines.extend(['($RETURN)', '@LCL', 'D=M', '@R14', 'M=D', '@5', 'A=D-A', 'D=M', '@R15', 'M=D'])
+        self.lines.extend(POP_D + ['@ARG', 'A=M', 'M=D', '@ARG', 'D=M+1', '@SP', 'M=D'])
+        for pointer in ('THAT', 'THIS', 'ARG', 'LCL'):
+            self.lines.extend(['@R14', 'AM=M-1', 'D=M', f'@{pointer}', 'M=D'])
+        self.lines.extend(['@R15', 'A=M', '0;JMP'])
+        if self.compares:
+            # R13 holds y and R14 the return address; x - y can overflow when the signs of x and y differ,
+            # so it is only computed when they match, and otherwise D gets 1 or -1 after the sign of x
+            self.lines.extend(['($COMPARE)', '@SP', 'A=M-1', 'D=M', '@$COMPARE_NEGATIVE', 'D;JLT',
+                               '@R13', 'D=M', '@$COMPARE_SUBTRACT', 'D;JGE', 'D=1', '@R14', 'A=M', '0;JMP',
+                               '($COMPARE_NEGATIVE)', '@R13', 'D=M', '@$COMPARE_SUBTRACT', 'D;JLT', 'D=-1', '@R14',
+                               'A=M', '0;JMP',
+                               '($COMPARE_SUBTRACT)', '@SP', 'A=M-1', 'D=M-D', '@R14', 'A=M', '0;JMP'])
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+    def instructions(self):
+        return sum(1 for line in self.lines if not line.startswith('('))
+
+    def label(self, name):
+        return f"{self.function}${name}"
+
+    # assembly that leaves the value of a push source in D
+    def load(self, segment, index):
+        if segment == 'constant':
+            return ['D=1'] if index == 1 else ['D=0'] if index == 0 else [f'@{index}', 'D=A']
+        if segment in POINTERS:
+            if index <= 1:
+                return [f'@{POINTERS[segment]}', 'A=M+1' if index else 'A=M', 'D=M']
+            return [f'@{index}', 'D=A', f'@{POINTERS[segment]}', 'A=D+M', 'D=M']
+        return [f'@{self.address(segment, index)}', 'D=M']
+
+    def address(self, segment, index):
+        if segment == 'temp':
+            return f'R{TEMP_BASE + index}'
+        if segment == 'pointer':
+            return 'THAT' if index else 'THIS'
+        if segment == 'static':
+            return f'{self.file}.{index}'
+        raise ValueError(f"{segment} is not a fixed segment")
+
+    # assembly that stores D to a pop destination
+    def store(self, segment, index):
+        if segment not in POINTERS:
+            return [f'@{self.address(segment, index)}', 'M=D']
+        if index <= MAX_ADDRESS_STEPS:
+            steps = ['A=M+1'] + ['A=A+1'] * (index - 1) if index else ['A=M']
+            return [f'@{POINTERS[segment]}'] + steps + ['M=D']
+        return ['@R13', 'M=D', f'@{index}', 'D=A', f'@{POINTERS[segment]}', 'D=D+M', '@R14', 'M=D',
+                '@R13', 'D=M', '@R14', 'A=M', 'M=D']
+
+    def write_call(self, name, arguments):
+        self.arities.add(arguments)
+        back = self.unique('RET')
+        self.lines.extend([f'@{name}', 'D=A', '@R13', 'M=D', f'@{back}', 'D=A', f'@$CALL{arguments}', '0;JMP',
+                           f'({back})'])
+
+    # with y in D and A addressing x on top of the stack, leaves a value with the sign of x - y in D and
+    # A addressing x again; gt and lt go through $COMPARE
+    def write_difference(self, op):
+        if op == 'eq':
+            self.lines.append('D=M-D')
+            return
+        self.compares = True
+        back = self.unique('CMP')
+        self.lines.extend(['@R13', 'M=D', f'@{back}', 'D=A', '@R14', 'M=D', '@$COMPARE', '0;JMP', f'({back})',
+                           '@SP', 'A=M-1'])
+
+    def write_compare(self, jump):
+        true = self.unique('TRUE')
+        self.lines.extend(['M=-1', f'@{true}', f'D;{jump}', '@SP', 'A=M-1', 'M=0', f'({true})'])
+
+    def write_command(self, command):
+        op, arg1, arg2 = command
+        lines = self.lines
+        if op == 'push':
+            if arg1 == 'constant' and arg2 in (0, 1):
+                lines.extend(['@SP', 'AM=M+1', 'A=A-1', f'M={arg2}'])
+            else:
+                lines.extend(self.load(arg1, arg2) + PUSH_D)
+        elif op == 'pop':
+            lines.extend(POP_D + self.store(arg1, arg2))
+        elif op in BINARY:
+            lines.extend(POP_D + ['A=A-1', BINARY[op]])
+        elif op in UNARY:
+            lines.extend(['@SP', 'A=M-1', UNARY[op]])
+        elif op in COMPARE:
+            lines.extend(POP_D + ['A=A-1'])
+            self.write_difference(op)
+            self.write_compare(COMPARE[op])
+        elif op == 'label':
+            lines.append(f'({self.label(arg1)})')
+        elif op == 'goto':
+            lines.extend([f'@{self.label(arg1)}', '0;JMP'])
+        elif op == 'if-goto':
+            lines.extend(POP_D + [f'@{self.label(arg1)}', 'D;JNE'])
+        elif op == 'function':
+            self.function = arg1
+            lines.append(f'({arg1})')
+            if arg2:
+                lines.extend(['@SP', 'A=M', 'M=0'] + ['A=A+1', 'M=0'] * (arg2 - 1) + ['D=A+1', '@SP', 'M=D'])
+        elif op == 'call':
+            self.write_call(arg1, arg2)
+        elif op == 'return':
+            lines.extend(['@$RETURN', '0;JMP'])
+        else:
+            raise ValueError(f"unknown VM command {op}")
+        return 1
+
+    # writes the sequence starting at commands[i] as one unit and returns how many commands it covered,
+    # or returns 0 when no fused form applies
+    def write_fused(self, commands, i):
+        op, arg1, arg2 = commands[i]
+        following = [command[0] for command in commands[i + 1:i + 4]]
+        lines = self.lines
+
+        if op == 'push' and following:
+            next_op, next_arg1, next_arg2 = commands[i + 1]
+            if next_op in BINARY:
+                self.fused['push-binary'] += 1
+                if arg1 == 'constant' and arg2 == 1 and next_op in ('add', 'sub'):
+                    lines.extend(['@SP', 'A=M-1', 'M=M+1' if next_op == 'add' else 'M=M-1'])
+                else:
+                    lines.extend(self.load(arg1, arg2) + ['@SP', 'A=M-1', BINARY[next_op]])
+                return 2
+            if next_op in COMPARE:
+                self.fused['push-compare'] += 1
+                lines.extend(self.load(arg1, arg2) + ['@SP', 'A=M-1'])
+                self.write_difference(next_op)
+                return 2 + self.write_compare_result(commands, i + 1)
+            if next_op == 'pop':
+                self.fused['push-pop'] += 1
+                lines.extend(self.load(arg1, arg2) + self.store(next_arg1, next_arg2))
+                return 2
+
+        if op in COMPARE and (following[:1] == ['if-goto'] or following[:2] == ['not', 'if-goto']):
+            self.fused['compare-branch'] += 1
+            lines.extend(POP_D + ['A=A-1'])
+            self.write_difference(op)
+            return 1 + self.write_compare_result(commands, i)
+
+        # not x is nonzero exactly when x != -1
+        if op == 'not' and following[:1] == ['if-goto']:
+            self.fused['not-branch'] += 1
+            lines.extend(['@SP', 'AM=M-1', 'D=M+1', f'@{self.label(commands[i + 1][1])}', 'D;JNE'])
+            return 2
+
+        if commands[i] == ('pop', 'pointer', 1) and following and tuple(commands[i + 1]) == ('push', 'that', 0):
+            self.fused['array-read'] += 1
+            lines.extend(['@SP', 'A=M-1', 'D=M', '@THAT', 'M=D', 'A=D', 'D=M', '@SP', 'A=M-1', 'M=D'])
+            return 2
+        return 0
+
+    # with the sign of x - y in D and x on top of the stack, finishes the comparison commands[i]: a following
+    # [not;] if-goto branches on D directly, anything else replaces x with the boolean result
+    def write_compare_result(self, commands, i):
+        jump = COMPARE[commands[i][0]]
+        j = i + 1
+        if j < len(commands) and commands[j][0] == 'not' and j + 1 < len(commands) \
+                and commands[j + 1][0] == 'if-goto':
+            jump = NEGATED[jump]
+            j += 1
+        if j < len(commands) and commands[j][0] == 'if-goto':
+            self.lines.extend(['@SP', 'M=M-1', f'@{self.label(commands[j][1])}', f'D;{jump}'])
+            return j - i
+        self.write_compare(jump)
+        return 0
+
+    def __str__(self):
+        return f"asm: {self.instructions()} instructions, fused " + \
+            ', '.join(f"{name} {count}" for name, count in self.fused.most_common())
+
+
+# programs: (name, commands) per class; returns the AsmWriter holding the bootstrapped program
+def translate(programs):
+    defined = {command[1] for _, commands in programs for command in commands if command[0] == 'function'}
+    asm = AsmWriter()
+    asm.write_bootstrap('Sys.init' if 'Sys.init' in defined else 'Main.main')
+    for name, commands in programs:
+        asm.write_file(name, commands)
+    asm.write_trampolines()
+    return asm
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Translate .vm or .vmb files to a bootstrapped Hack .asm program.')
+    parser.add_argument('source', help='a .vm or .vmb file, or a directory of them')
+    args = parser.parse_args()
+    if os.path.isdir(args.source):
+        files = vm_files(args.source)
+        output = os.path.join(args.source, os.path.basename(os.path.abspath(args.source)) + '.asm')
+    else:
+        files = [args.source]
+        output = os.path.splitext(args.source)[0] + '.asm'
+    asm = translate(read_vm_files(files))
+    with open(output, 'w') as f:
+        f.write(asm.text())
+    print(asm)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
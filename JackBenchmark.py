@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from JackCompiler import Tokenizer, VMWriter, VM_agent
+
+
+class CorpusGenerator:
+    OPERATIONS = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
+
+    def __init__(self, seed, classes=8, fields=40, subroutines=30, statements=25, depth=4, string_length=60):
+        self.random = random.Random(seed)
+        self.classes = classes
+        self.fields = fields
+        self.subroutines = subroutines
+        self.statements = statements
+        self.depth = depth
+        self.string_length = string_length
+
+    def corpus(self):
+        return {f"Bench{i}": self.jack_class(i) for i in range(self.classes)}
+
+    def jack_class(self, number):
+        self.class_name = f"Bench{number}"
+        self.other_class = f"Bench{(number + 1) % self.classes}"
+        self.field_names = [f"f{i}" for i in range(self.fields)]
+        self.static_names = [f"s{i}" for i in range(self.fields // 2)]
+        lines = [f"class {self.class_name} {{"]
+        for i in range(0, len(self.field_names), 5):
+            lines.append(f"    field int {', '.join(self.field_names[i:i + 5])};")
+        for i in range(0, len(self.static_names), 5):
+            lines.append(f"    static int {', '.join(self.static_names[i:i + 5])};")
+        lines.append("")
+        lines.extend(self.constructor())
+        for i in range(self.subroutines):
+            lines.extend(self.subroutine(i))
+        lines.append("}")
+        return '\n'.join(lines) + '\n'
+
+    def constructor(self):
+        lines = [f"    constructor {self.class_name} new() {{"]
+        for name in self.field_names:
+            lines.append(f"        let {name} = {self.random.randint(0, 32767)};")
+        lines.append("        return this;")
+        lines.append("    }")
+        lines.append("")
+        return lines
+
+    def subroutine(self, number):
+        kind = 'method' if number % 2 else 'function'
+        self.locals = [f"v{i}" for i in range(self.random.randint(2, 8))]
+        self.args = [f"a{i}" for i in range(1 if number == 0 else self.random.randint(1, 3))]
+        self.variables = self.locals + self.args + self.static_names
+        if kind == 'method':
+            self.variables = self.variables + self.field_names
+        params = ', '.join(f"int {name}" for name in self.args)
+        lines = [f"    {kind} int m{number}({params}) {{",
+                 f"        var int {', '.join(self.locals)};",
+                 "        var Array arr;",
+                 "        let arr = Array.new(16);"]
+        lines.extend(self.statement_block(self.statements, 2, 0))
+        lines.append(f"        return {self.expression(self.depth)};")
+        lines.append("    }")
+        lines.append("")
+        return lines
+
+    def statement_block(self, count, indent, nesting):
+        lines = []
+        for _ in range(count):
+            lines.extend(self.statement(indent, nesting))
+        return lines
+
+    def statement(self, indent, nesting):
+        pad = '    ' * indent
+        choice = self.random.random()
+        if choice < 0.15 and nesting < 3:
+            lines = [f"{pad}if ({self.expression(2)}) {{"]
+            lines.extend(self.statement_block(3, indent + 1, nesting + 1))
+            lines.append(f"{pad}}} else {{")
+            lines.extend(self.statement_block(2, indent + 1, nesting + 1))
+            lines.append(f"{pad}}}")
+            return lines
+        if choice < 0.25 and nesting < 3:
+            lines = [f"{pad}while ({self.expression(2)}) {{"]
+            lines.extend(self.statement_block(3, indent + 1, nesting + 1))
+            lines.append(f"{pad}}}")
+            return lines
+        if choice < 0.35:
+            return [f'{pad}do Output.printString("{self.string()}");']
+        if choice < 0.5:
+            return [f"{pad}do {self.other_class}.m0({self.expression(2)});"]
+        if choice < 0.6:
+            return [f"{pad}let arr[{self.expression(1)}] = {self.expression(self.depth)};"]
+        return [f"{pad}let {self.random.choice(self.locals)} = {self.expression(self.depth)};"]
+
+    def expression(self, depth):
+        terms = [self.term(depth) for _ in range(self.random.randint(1, 3))]
+        expression = terms[0]
+        for term in terms[1:]:
+            expression += f" {self.random.choice(self.OPERATIONS)} {term}"
+        return expression
+
+    def term(self, depth):
+        choice = self.random.random()
+        if depth > 0 and choice < 0.35:
+            return f"({self.expression(depth - 1)})"
+        if depth > 0 and choice < 0.45:
+            return f"{self.random.choice(['-', '~'])}{self.term(depth - 1)}"
+        if depth > 0 and choice < 0.55:
+            return f"{self.other_class}.m0({self.expression(depth - 1)})"
+        if choice < 0.6:
+            return f"arr[{self.random.choice(self.variables)}]"
+        if choice < 0.75:
+            return str(self.random.randint(0, 32767))
+        return self.random.choice(self.variables)
+
+    def string(self):
+        alphabet = 'abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+        return ''.join(self.random.choice(alphabet) for _ in range(self.string_length))
+
+
+class Benchmark:
+    STAGES = ('tokenize', 'compile', 'output')
+
+    def __init__(self, corpus, repeat=5):
+        self.corpus = corpus
+        self.repeat = repeat
+        self.directory = tempfile.mkdtemp(prefix='jack-bench-')
+
+    def run_once(self):
+        timings = dict.fromkeys(self.STAGES, 0.0)
+        tokens = 0
+        instructions = 0
+        for name, source in self.corpus.items():
+            start = time.perf_counter()
+            scanned = Tokenizer.scan(source)
+            timings['tokenize'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            vm_writer = VMWriter(os.path.join(self.directory, name + '.jack'))
+            VM_agent(scanned, vm_writer).compile_class()
+            timings['compile'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            vm_writer.close()
+            timings['output'] += time.perf_counter() - start
+
+            tokens += len(scanned)
+            instructions += len(vm_writer.commands)
+        return timings, tokens, instructions
+
+    def peak_memory(self):
+        tracemalloc.start()
+        self.run_once()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    def run(self):
+        try:
+            runs = [self.run_once() for _ in range(self.repeat)]
+            peak = self.peak_memory()
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        tokens, instructions = runs[0][1], runs[0][2]
+        lines = sum(source.count('\n') for source in self.corpus.values())
+        stages = {}
+        for stage in self.STAGES:
+            seconds = min(timings[stage] for timings, _, _ in runs)
+            stages[stage] = {
+                'seconds': seconds,
+                'tokens_per_sec': tokens / seconds if seconds else None,
+                'lines_per_sec': lines / seconds if seconds else None,
+            }
+        total = sum(stage['seconds'] for stage in stages.values())
+        return {
+            'python': platform.python_version(),
+            'classes': len(self.corpus),
+            'lines': lines,
+            'tokens': tokens,
+            'instructions': instructions,
+            'repeat': self.repeat,
+            'stages': stages,
+            'total': {'seconds': total, 'tokens_per_sec': tokens / total, 'lines_per_sec': lines / total},
+            'peak_memory_bytes': peak,
+        }
+
+
+def regressions(result, baseline, tolerance):
+    found = []
+    for stage, timing in result['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if before and timing['seconds'] > before['seconds'] * (1 + tolerance):
+            found.append(f"{stage}: {before['seconds']:.4f}s -> {timing['seconds']:.4f}s")
+    before = baseline.get('peak_memory_bytes')
+    if before and result['peak_memory_bytes'] > before * (1 + tolerance):
+        found.append(f"peak memory: {before} -> {result['peak_memory_bytes']} bytes")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Jack compiler on a synthetic corpus.')
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--classes', type=int, default=8)
+    parser.add_argument('--subroutines', type=int, default=30, help='subroutines per class')
+    parser.add_argument('--statements', type=int, default=25, help='top-level statements per subroutine')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs; the fastest is reported')
+    parser.add_argument('--output', help='write the JSON result to this file instead of stdout')
+    parser.add_argument('--emit', help='also write the generated .jack classes to this directory')
+    parser.add_argument('--compare', help='a previous JSON result to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed slowdown against --compare before failing (default: 0.10)')
+    args = parser.parse_args()
+
+    generator = CorpusGenerator(args.seed, classes=args.classes, subroutines=args.subroutines,
+                                statements=args.statements)
+    corpus = generator.corpus()
+    if args.emit:
+        os.makedirs(args.emit, exist_ok=True)
+        for name, source in corpus.items():
+            with open(os.path.join(args.emit, name + '.jack'), 'w') as f:
+                f.write(source)
+
+    result = Benchmark(corpus, args.repeat).run()
+    result['seed'] = args.seed
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"regression: {regression}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,110 +1,184 @@
+import argparse
+import hashlib
+import json
+import marshal
 import re
+import socketserver
 import sys
+import threading
+import time
 import os
+import zlib
+from array import array
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from HackBackend import read_vm_files, translate, vm_files
+from VMBytecode import encode
+from VMEmulator import VMEmulator, VMError, print_run
 
 #sys.argv.append('D:/Year2/Systems/nand2tetris/projects/11/Average')
 
 
+Symbol = namedtuple('Symbol', ['type', 'kind', 'index'])
+
+
 class SymbolTable:
 
     def __init__(self):
-        self.static_counter = 0
-        self.field_counter = 0
-        self.arg_counter = 0
-        self.var_counter = 0
-        self.vars = []
+        self.counters = {'STATIC': 0, 'FIELD': 0, 'ARG': 0, 'VAR': 0}
+        self.vars = {}
 
     def reset(self):
-        self.static_counter = 0
-        self.field_counter = 0
-        self.arg_counter = 0
-        self.var_counter = 0
-        self.vars = []
+        self.counters = {'STATIC': 0, 'FIELD': 0, 'ARG': 0, 'VAR': 0}
+        self.vars = {}
 
     def define(self, name, typ, kind):
-        if kind == "STATIC":
-            self.vars.append((name, typ, "STATIC", self.static_counter))
-            self.static_counter += 1
-        elif kind == "FIELD":
-            self.vars.append((name, typ, "FIELD", self.field_counter))
-            self.field_counter += 1
-        elif kind == "ARG":
-            self.vars.append((name, typ, "ARG", self.arg_counter))
-            self.arg_counter += 1
-        elif kind == "VAR":
-            self.vars.append((name, typ, "VAR", self.var_counter))
-            self.var_counter += 1
+        if kind in self.counters:
+            index = self.counters[kind]
+            self.vars[name] = Symbol(typ, kind, index)
+            self.counters[kind] = index + 1
 
     def var_count(self, kind):
-        if kind == "STATIC":
-            return self.static_counter
-        elif kind == "FIELD":
-            return self.field_counter
-        elif kind == "ARG":
-            return self.arg_counter
-        elif kind == "VAR":
-            return self.var_counter
+        return self.counters.get(kind)
 
+    def get(self, name):
+        return self.vars.get(name)
 
     def kind_of(self, name):
-        for tup in self.vars:
-            if tup[0] == name:
-                return tup[2]
-        return None
+        symbol = self.vars.get(name)
+        return symbol.kind if symbol is not None else None
 
     def type_of(self, name):
-        for tup in self.vars:
-            if tup[0] == name:
-                return tup[1]
-        return None
+        symbol = self.vars.get(name)
+        return symbol.type if symbol is not None else None
 
     def index_of(self, name):
-        for tup in self.vars:
-            if tup[0] == name:
-                return tup[3]
-        return None
+        symbol = self.vars.get(name)
+        return symbol.index if symbol is not None else None
 
     def __str__(self):
         return str(self.vars)
 
 
+# an error in the Jack source, such as an undefined variable
+class CompileError(Exception):
+    pass
+
+
+VMCommand = namedtuple('VMCommand', ['op', 'arg1', 'arg2'], defaults=[None, None])
+
+
+# a VMCommand that remembers the Jack line it was generated from; it still compares equal to the plain command
+class LocatedCommand(VMCommand):
+    def __new__(cls, command, line):
+        self = tuple.__new__(cls, command)
+        self.line = line
+        return self
+
+    def __getnewargs__(self):
+        return tuple(self), self.line
+
+
+# marks: (command index, line) wherever the source line changes; lines: command index -> line, for
+# the commands whose line is known outright
+def locate_commands(commands, marks, lines=None):
+    located = []
+    marks = deque(marks)
+    lines = lines or {}
+    line = None
+    for i, command in enumerate(commands):
+        while marks and marks[0][0] <= i:
+            line = marks.popleft()[1]
+        located.append(LocatedCommand(command, lines.get(i, line)))
+    return located
+
+
+# the Jack line of each command; commands a pass created itself take the line of the command before them
+def command_lines(commands):
+    lines = []
+    line = None
+    for command in commands:
+        line = getattr(command, 'line', line)
+        lines.append(line)
+    return lines
+
+
+def format_command(command):
+    if command.arg2 is not None:
+        return f"{command.op} {command.arg1} {command.arg2}"
+    if command.arg1 is not None:
+        return f"{command.op} {command.arg1}"
+    return command.op
+
+
 class VMWriter:
-    def __init__(self, file):
-        self.out = open(file.replace('.jack', '.vm'), 'w+')
+    SEGMENTS = {
+        'ARG': 'argument'
+    }
+
+    def __init__(self, file=None, binary=False):
+        self.binary = binary
+        self.path = file.replace('.jack', '.vmb' if binary else '.vm') if file is not None else None
+        self.commands = []
+
+    def segment(self, segment):
+        return self.SEGMENTS.get(segment) or segment.lower()
 
     def write_push(self, segment, index):
-        if segment == 'ARG':
-            segment = 'argument'
-        self.out.write(f"push {segment.lower()} {index}\n")
+        self.commands.append(VMCommand('push', self.segment(segment), int(index)))
 
     def write_pop(self, segment, index):
-        if segment == 'ARG':
-            segment = 'argument'
-        self.out.write(f"pop {segment.lower()} {index}\n")
+        self.commands.append(VMCommand('pop', self.segment(segment), int(index)))
 
     def write_arithmetic(self, command):
-        self.out.write(f"{command.lower()}\n")
+        self.commands.append(VMCommand(command.lower()))
 
     def write_label(self, label):
-        self.out.write(f"label {label}\n")
+        self.commands.append(VMCommand('label', label))
 
     def write_goto(self, label):
-        self.out.write(f"goto {label}\n")
+        self.commands.append(VMCommand('goto', label))
 
     def write_if(self, label):
-        self.out.write(f"if-goto {label}\n")
+        self.commands.append(VMCommand('if-goto', label))
 
     def write_call(self, name, nvars):
-        self.out.write(f"call {name} {nvars}\n")
+        self.commands.append(VMCommand('call', name, nvars))
 
     def write_function(self, name, nvars):
-        self.out.write(f"function {name} {nvars}\n")
+        self.commands.append(VMCommand('function', name, nvars))
 
     def write_return(self):
-        self.out.write("return\n")
+        self.commands.append(VMCommand('return'))
+
+    # push constant only takes 0..32767, negative values are pushed as ~value; not
+    def write_constant(self, value, position=None):
+        if value >= 0:
+            commands = [VMCommand('push', 'constant', value)]
+        else:
+            commands = [VMCommand('push', 'constant', ~value), VMCommand('not')]
+        if position is None:
+            position = len(self.commands)
+        self.commands[position:position] = commands
+
+    def text(self):
+        if not self.commands:
+            return ''
+        return '\n'.join(map(format_command, self.commands)) + '\n'
 
     def close(self):
-        self.out.close()
+        if self.binary:
+            with open(self.path, 'wb') as out:
+                out.write(encode(self.commands))
+            return
+        with open(self.path, 'w') as out:
+            out.write(self.text())
+
+
+# token kinds, stored as one byte per token
+KEYWORD, SYMBOL, INTEGER_CONSTANT, STRING_CONSTANT, IDENTIFIER = range(5)
+KIND_NAMES = ('keyword', 'symbol', 'integerConstant', 'stringConstant', 'identifier')
 
 
 class Tokenizer:
@@ -113,88 +187,246 @@ class Tokenizer:
                     'true', 'false', 'null', 'this', 'let', 'do', 'if', 'else', 'while', 'return']
     symbol_keys = ['{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~']
 
-    def __init__(self, source):
-        self.file = open(source)
-        self.file.read()
-        self.num_chars = self.file.tell()
-        self.file.seek(0)
+    ESCAPED_SYMBOLS = {
+        '<': '&lt;',
+        '>': '&gt;',
+        '"': '&quot;',
+        '&': '&amp;'
+    }
+
+    # whitespace and comments match without a named group and are skipped
+    TOKEN_RE = re.compile(r"""
+        \s+
+        | //[^\n]*
+        | /\*.*?(?:\*/|\Z)
+        | (?P<symbol>[{}()\[\].,;+\-*/&|<>=~])
+        | "(?P<stringConstant>[^"]*)"
+        | (?P<word>[^\s{}()\[\].,;+\-*/&|<>=~"]+)
+    """, re.DOTALL | re.VERBOSE)
+
+    def __init__(self, source, locate=False):
+        with open(source) as f:
+            text = f.read()
+        if locate:
+            self.tokens, self.positions = self.locate(text)
+        else:
+            self.tokens, self.positions = self.scan(text), None
+        self.position = 0
         self.token = None
+        self.kind = None
         self.endOfFile = False
 
+    # the kind and lexeme id of the token a match holds in group; scan and stream both classify through here
+    @staticmethod
+    def kind_of(group, token):
+        if group == 'symbol':
+            return SYMBOL, LEXEME_IDS[token]
+        if group == 'stringConstant':
+            return STRING_CONSTANT, NO_LEXEME
+        lexeme = LEXEME_IDS.get(token, NO_LEXEME)
+        if lexeme != NO_LEXEME:
+            return KEYWORD, lexeme
+        return (INTEGER_CONSTANT if token.isdecimal() else IDENTIFIER), NO_LEXEME
+
+    @classmethod
+    def classify(cls, matches):
+        for match in matches:
+            group = match.lastgroup
+            if group is None:
+                continue
+            token = match[group]
+            kind, lexeme = cls.kind_of(group, token)
+            yield kind, token if lexeme == NO_LEXEME else LEXEMES[lexeme]
+
+    @classmethod
+    def scan(cls, text):
+        tokens = TokenBuffer(text)
+        kinds, ids, starts, ends = tokens.kinds, tokens.ids, tokens.starts, tokens.ends
+        kind_of = cls.kind_of
+        for match in cls.TOKEN_RE.finditer(text):
+            group = match.lastgroup
+            if group is None:
+                continue
+            kind, lexeme = kind_of(group, match[group])
+            start, end = match.span(group)
+            kinds.append(kind)
+            ids.append(lexeme)
+            starts.append(start)
+            ends.append(end)
+        return tokens
+
+    # tokens plus a (line, column) pair for each, both counted from 1
+    @classmethod
+    def locate(cls, text):
+        tokens = cls.scan(text)
+        return tokens, tokens.positions()
+
+    # yields (kind, lexeme) pairs while reading file in chunks; a match that touches the end of the buffer may
+    # be cut off, so it is rescanned once more input has arrived
+    @classmethod
+    def stream(cls, file, chunk_size=1 << 16):
+        buffer = ''
+        eof = False
+        while not eof:
+            chunk = file.read(chunk_size)
+            eof = chunk == ''
+            buffer += chunk
+            position = 0
+            matches = []
+            for match in cls.TOKEN_RE.finditer(buffer):
+                # a gap means an unterminated string constant
+                if (match.start() != position or match.end() == len(buffer)) and not eof:
+                    break
+                matches.append(match)
+                position = match.end()
+            yield from cls.classify(matches)
+            buffer = buffer[position:]
+
     def has_more_tokens(self):
-        position = self.file.tell()
-        if position == self.num_chars:
-            return False
-        return True
+        return self.position < len(self.tokens)
 
     def advance(self):
-        word = ''
-        adv = True
-        while adv:
-            position = self.file.tell()
-            char = self.file.read(1)
-            if char == '/':
-                char = self.file.read(1)
-                if char == '/':
-                    self.file.readline()
-                elif char == '*':
-                    self.file.read(1)
-                    while self.file.read(2) != '*/':
-                        adv = True
-                        self.file.seek(self.file.tell() - 1)
-                    self.file.read(1)
-                else:
-                    self.file.seek(position)
-                    char = self.file.read(1)
-                    word += char
-
-            elif re.match(r"^\s+", char):
-                if word != '':
-                    self.token = word
-                    adv = False
-            elif char in self.symbol_keys:
-                adv = False
-                if word != '':
-                    self.token = word
-                    self.file.seek(position)
-                else:
-                    self.token = char
-            elif char == '"':
-                word = char
-                char = self.file.read(1)
-                while char != '"':
-                    word += char
-                    char = self.file.read(1)
-                word += char
-                self.token = word
-            else:
-                word += char
-            if not self.has_more_tokens():
-                adv = False
+        kind, self.token = self.tokens[self.position]
+        self.kind = KIND_NAMES[kind]
+        self.position += 1
+        if self.position == len(self.tokens):
+            self.endOfFile = True
 
     def token_type(self):
-        if self.token in self.symbol_keys:
-            if self.token == "<":
-                self.token = "&lt;"
-            elif self.token == ">":
-                self.token = "&gt;"
-            elif self.token == '"':
-                self.token = "&quot;"
-            elif self.token == "&":
-                self.token = "&amp;"
-            return "symbol"
-        elif self.token in self.keyword_keys:
-            return "keyword"
-        elif self.token.isdecimal():
-            return "integerConstant"
-        elif self.token.startswith('"') and self.token.endswith('"'):
-            self.token = self.token[1:-1]
-            return "stringConstant"
-        else:
-            return "identifier"
+        return self.kind
+
+
+# keywords and symbols are interned: a token stores the index of its lexeme here, and every other
+# token stores NO_LEXEME, which reads back as ''
+LEXEMES = tuple(Tokenizer.keyword_keys + Tokenizer.symbol_keys) + ('',)
+LEXEME_IDS = {lexeme: index for index, lexeme in enumerate(LEXEMES[:-1])}
+NO_LEXEME = len(LEXEMES) - 1
+
+
+def lexeme_ids(lexemes):
+    return frozenset(LEXEME_IDS[lexeme] for lexeme in lexemes)
+
+
+# the ids the parsers peek for; peeks return ids, so lookahead compares small integers, not strings
+VAR, ELSE = LEXEME_IDS['var'], LEXEME_IDS['else']
+LET, IF, WHILE, DO, RETURN = (LEXEME_IDS[keyword] for keyword in ('let', 'if', 'while', 'do', 'return'))
+LEFT_PAREN, RIGHT_PAREN, LEFT_BRACKET, DOT, SEMICOLON = (LEXEME_IDS[symbol] for symbol in '()[.;')
+CLASS_VAR_KINDS = lexeme_ids(('static', 'field'))
+SUBROUTINE_KINDS = lexeme_ids(('constructor', 'method', 'function'))
+STATEMENTS = frozenset((LET, IF, WHILE, DO, RETURN))
+
+
+# the tokens of one source text as parallel arrays of kind codes, interned lexeme ids and the span of
+# each lexeme in the text; identifiers and constants are only sliced out of the text when read
+class TokenBuffer:
+    def __init__(self, text=''):
+        self.text = text
+        self.kinds = array('B')
+        self.ids = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def lexeme(self, index):
+        return LEXEMES[self.ids[index]] or self.text[self.starts[index]:self.ends[index]]
+
+    def line(self, index):
+        return self.text.count('\n', 0, self.starts[index]) + 1
+
+    def __getitem__(self, index):
+        return self.kinds[index], self.lexeme(index)
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self.kinds)))
+
+    def positions(self):
+        text = self.text
+        positions = []
+        line = 1
+        line_start = 0
+        scanned = 0
+        for kind, start in zip(self.kinds, self.starts):
+            # a string constant starts at its opening quote
+            if kind == STRING_CONSTANT:
+                start -= 1
+            newlines = text.count('\n', scanned, start)
+            if newlines:
+                line += newlines
+                line_start = text.rindex('\n', scanned, start) + 1
+            scanned = start
+            positions.append((line, start - line_start + 1))
+        return positions
+
+
+# reads a TokenBuffer front to back, for the compiler and the parser
+class TokenCursor:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.kinds = tokens.kinds
+        self.ids = tokens.ids
+        self.token_count = len(tokens)
+        self.position = 0
+        self.current_token = ''
+
+    def get_token(self):
+        self.current_token = LEXEMES[self.ids[self.position]] or self.tokens.lexeme(self.position)
+        self.position += 1
+        return self.current_token
 
+    # the interned id of a keyword or symbol; any other token, and the end of the input, is NO_LEXEME
+    def peek_next_token(self, offset=0):
+        position = self.position + offset
+        if position >= self.token_count:
+            return NO_LEXEME
+        return self.ids[position]
 
-class VM_agent:
+    def peek_next_token_type(self):
+        if self.position >= self.token_count:
+            return None
+        return self.kinds[self.position]
+
+
+def to_int16(value):
+    return (value + 0x8000 & 0xFFFF) - 0x8000
+
+
+def fold_unary(operation, value):
+    value = to_int16(value)
+    if operation == '-':
+        return to_int16(-value)
+    return ~value
+
+
+# Jack 16-bit semantics, division truncates like Math.divide; returns None when the result must be left to runtime
+def fold_binary(operation, a, b):
+    a, b = to_int16(a), to_int16(b)
+    if operation == '+':
+        return to_int16(a + b)
+    elif operation == '-':
+        return to_int16(a - b)
+    elif operation == '*':
+        return to_int16(a * b)
+    elif operation == '/':
+        if b == 0:
+            return None
+        quotient = abs(a) // abs(b)
+        return to_int16(quotient if (a < 0) == (b < 0) else -quotient)
+    elif operation == '&':
+        return a & b
+    elif operation == '|':
+        return a | b
+    elif operation == '<':
+        return -1 if a < b else 0
+    elif operation == '>':
+        return -1 if a > b else 0
+    elif operation == '=':
+        return -1 if a == b else 0
+    return None
+
+
+class VM_agent(TokenCursor):
     CONVERT_KIND = {
         'ARG': 'ARG',
         'STATIC': 'STATIC',
@@ -206,9 +438,9 @@ class VM_agent:
         '+': 'ADD',
         '-': 'SUB',
         '=': 'EQ',
-        '&gt;': 'GT',
-        '&lt;': 'LT',
-        '&amp;': 'AND',
+        '>': 'GT',
+        '<': 'LT',
+        '&': 'AND',
         '|': 'OR'
     }
 
@@ -217,67 +449,63 @@ class VM_agent:
         '~': 'NOT'
     }
 
-    def __init__(self, token_file, vm_writer):
+    OPERATIONS = ('+', '-', '*', '/', '&', '|', '<', '>', '=')
+
+    UNARY_IDS = lexeme_ids(ARITHMETIC_UNARY)
+
+    OPERATION_IDS = lexeme_ids(OPERATIONS)
+
+    COMMUTATIVE = ('+', '*', '&', '|', '=')
+
+    MAX_MULTIPLY_SEQUENCE = 32
+
+    def __init__(self, tokens, vm_writer, fold=False, pool_strings=False):
+        super().__init__(tokens)
         self.class_name = ''
         self.vm_writer = vm_writer
-        self.token_file = token_file
-        self.current_token = ''
         self.while_index = -1
         self.if_index = -1
         self.class_symbol_table = SymbolTable()
         self.subroutine_symbol_table = SymbolTable()
         self.is_function = False
-
-    def ignore(self):
-        self.token_file.readline()
-
-    def get_token(self):
-        self.current_token = self.token_file.readline()
-        self.current_token = self.current_token.split()[1]
-        return self.current_token
-
-    def get_string_token(self):
-        position = self.token_file.tell()
-        string_to_return = self.token_file.readline()
-        self.token_file.seek(position)
-        start = len("<stringConstant> ")
-        end = string_to_return.find(" </stringConstant>")
-        string_to_return = string_to_return[start:end]
-        return string_to_return
-
-    def peek_next_token(self):
-        position = self.token_file.tell()
-        token_to_return = self.token_file.readline()
-        if 'tokens' in token_to_return or token_to_return == '':
-            return 'Done'
-        token_to_return = token_to_return.split()[1]
-        self.token_file.seek(position)
-        return token_to_return
-
-    def peek_next_token_type(self):
-        position = self.token_file.tell()
-        type_to_return = self.token_file.readline()
-        type_to_return = type_to_return.split()[0]
-        self.token_file.seek(position)
-        return type_to_return
+        self.fold = fold
+        self.pool_strings = pool_strings
+        self.string_index = -1
+        self.report = Counter()
+        # subroutine name -> (kind, parameter count), for the project index
+        self.signatures = {}
+
+    def resolve(self, var_name):
+        symbol = self.subroutine_symbol_table.get(var_name)
+        if symbol is None:
+            symbol = self.class_symbol_table.get(var_name)
+        return symbol
+
+    # a name the code reads or writes as a variable; an unknown name is a compile error
+    def variable(self, var_name):
+        symbol = self.resolve(var_name)
+        if symbol is None:
+            raise self.error(f"undefined variable '{var_name}'")
+        return symbol
+
+    # at the line of the last token read, when the tokens are held (not when streaming or generating from a tree)
+    def error(self, message):
+        position = self.position - 1
+        if 0 <= position < len(self.tokens):
+            return CompileError(f"line {self.tokens.line(position)}: {message}")
+        return CompileError(message)
 
     def get_var_type(self, var_name):
-        if self.class_symbol_table.kind_of(var_name) is not None:
-            return self.class_symbol_table.type_of(var_name)
-        else:
-            return self.subroutine_symbol_table.type_of(var_name)
+        symbol = self.resolve(var_name)
+        return symbol.type if symbol is not None else None
 
     def get_var_kind(self, var_name):
-        if self.class_symbol_table.kind_of(var_name) is not None:
-            return self.class_symbol_table.kind_of(var_name)
-        else:
-            return self.subroutine_symbol_table.kind_of(var_name)
+        symbol = self.resolve(var_name)
+        return symbol.kind if symbol is not None else None
 
     def get_var_index(self, var_name):
-        if self.class_symbol_table.kind_of(var_name) is not None:
-            return self.class_symbol_table.index_of(var_name)
-        else:
-            return self.subroutine_symbol_table.index_of(var_name)
+        symbol = self.resolve(var_name)
+        return symbol.index if symbol is not None else None
 
     def insert_to_table(self, name, typ, kind):
         if kind == 'field' or kind == 'static':
@@ -286,50 +514,37 @@ class VM_agent:
             self.subroutine_symbol_table.define(name, typ, kind.upper())
 
     def class_has_var_dec(self):
-        return 'static' in self.peek_next_token() or 'field' in self.peek_next_token()
+        return self.peek_next_token() in CLASS_VAR_KINDS
 
     def class_is_subroutine_dec(self):
-        return 'constructor' in self.peek_next_token() or 'method' in self.peek_next_token() or 'function' in self.peek_next_token()
+        return self.peek_next_token() in SUBROUTINE_KINDS
 
     def is_statement(self):
-        return 'let' in self.peek_next_token() or 'if' in self.peek_next_token() or 'while' in self.peek_next_token() \
-            or 'do' in self.peek_next_token() or 'return' in self.peek_next_token()
+        return self.peek_next_token() in STATEMENTS
 
     def is_function_call(self):
-        position = self.token_file.tell()
-        self.get_token()
-        next_token = self.get_token()
-        self.token_file.seek(position)
-        return next_token == '.'
-
+        return self.peek_next_token(1) == DOT
 
     def is_array(self):
-        position = self.token_file.tell()
-        self.get_token()
-        next_token = self.get_token()
-        self.token_file.seek(position)
-        return next_token == '['
+        return self.peek_next_token(1) == LEFT_BRACKET
 
     def is_keyword(self):
-        position = self.token_file.tell()
-        keyword = self.token_file.readline().split()[0]
-        self.token_file.seek(position)
-        return 'keyword' in keyword
+        return self.peek_next_token_type() == KEYWORD
 
     def is_unary_operation(self):
-        return '-' in self.peek_next_token() or '~' in self.peek_next_token()
+        return self.peek_next_token() in self.UNARY_IDS
 
     def is_operation(self):
-        return re.search(r'(\+|-|\*|/|&amp;|\||&lt;|&gt;|=|>|<|&)', self.peek_next_token())
+        return self.peek_next_token() in self.OPERATION_IDS
 
 
     def compile_param_list(self):
-        if ')' not in self.peek_next_token():
+        if self.peek_next_token() != RIGHT_PAREN:
             typ = self.get_token()  # type
             name = self.get_token()  # varName
             self.subroutine_symbol_table.define(name, typ, 'ARG')
 
-        while ')' not in self.peek_next_token():
+        while self.peek_next_token() != RIGHT_PAREN:
             self.get_token()  # ,
             typ = self.get_token()  # type
             name = self.get_token()  # varName
@@ -349,31 +564,37 @@ class VM_agent:
         return num_args
 
 
+    def constant(self, value):
+        if self.fold:
+            return value
+        self.vm_writer.write_constant(value)
+        return None
+
     def compile_term(self):
         if self.is_unary_operation():
-            unary_operation = self.ARITHMETIC_UNARY[self.get_token()]
-            self.compile_term()
-            self.vm_writer.write_arithmetic(unary_operation)
-        elif '(' in self.peek_next_token():
+            operation = self.get_token()
+            value = self.compile_term()
+            if value is not None:
+                self.report['fold constants: operations folded'] += 1
+                return self.constant(fold_unary(operation, value))
+            self.vm_writer.write_arithmetic(self.ARITHMETIC_UNARY[operation])
+        elif self.peek_next_token() == LEFT_PAREN:
             self.get_token()
-            self.compile_expression()
+            value = self.fold_expression()
             self.get_token()
+            return value
         else:
-            if self.peek_next_token().isnumeric():
-                self.vm_writer.write_push('constant', self.get_token())
-            elif 'string' in self.peek_next_token_type():
-                word = self.get_string_token()
-                self.get_token()
-                self.vm_writer.write_push('CONSTANT', len(word) + 1)
-                self.vm_writer.write_call('String.new', 1)
-                for char in word:
-                    self.vm_writer.write_push('constant', ord(char))
-                    self.vm_writer.write_call('String.appendChar', 2)
+            if self.peek_next_token_type() == INTEGER_CONSTANT:
+                return self.constant(int(self.get_token()))
+            elif self.peek_next_token_type() == STRING_CONSTANT:
+                word = self.get_token()
+                if self.pool_strings:
+                    self.compile_pooled_string(word)
+                else:
+                    self.compile_string(word)
             elif self.is_array():
-                arr_var = self.get_token()
-                arr_kind = self.CONVERT_KIND[self.get_var_kind(arr_var)]
-                arr_index = self.get_var_index(arr_var)
-                self.vm_writer.write_push(arr_kind, arr_index)
+                arr = self.variable(self.get_token())
+                self.vm_writer.write_push(self.CONVERT_KIND[arr.kind], arr.index)
                 self.get_token()  # [
                 self.compile_expression()
                 self.get_token()  # ]
@@ -385,42 +606,145 @@ class VM_agent:
                 if keyword == 'this':
                     self.vm_writer.write_push('POINTER', 0)
                 else:
-                    self.vm_writer.write_push('constant', 0)
-                    if keyword == 'true':
-                        self.vm_writer.write_arithmetic('NOT')
+                    return self.constant(-1 if keyword == 'true' else 0)
 
             elif self.is_function_call():
                 self.compile_do(False)
             else:
-                var_name = self.get_token()
-                var_kind = self.CONVERT_KIND[self.get_var_kind(var_name)]
-                var_index = self.get_var_index(var_name)
-                self.vm_writer.write_push(var_kind, var_index)
-
-
+                var = self.variable(self.get_token())
+                self.vm_writer.write_push(self.CONVERT_KIND[var.kind], var.index)
+        return None
 
+    def compile_string(self, word):
+        self.vm_writer.write_push('CONSTANT', len(word) + 1)
+        self.vm_writer.write_call('String.new', 1)
+        for char in word:
+            self.vm_writer.write_push('constant', ord(char))
+            self.vm_writer.write_call('String.appendChar', 2)
+
+    # each distinct literal lives in a hidden static ('"' cannot start an identifier) and is built on first use
+    def compile_pooled_string(self, word):
+        name = '"' + word
+        pooled = self.class_symbol_table.get(name)
+        if pooled is None:
+            self.class_symbol_table.define(name, 'String', 'STATIC')
+            pooled = self.class_symbol_table.get(name)
+            self.report['strings: literals pooled'] += 1
+        self.string_index += 1
+        ready = 'STRING_READY' + str(self.string_index)
+        self.vm_writer.write_push('STATIC', pooled.index)
+        self.vm_writer.write_if(ready)
+        self.compile_string(word)
+        self.vm_writer.write_pop('STATIC', pooled.index)
+        self.vm_writer.write_label(ready)
+        self.vm_writer.write_push('STATIC', pooled.index)
+        self.report['strings: allocations removed per repeated evaluation'] += 1
+        self.report['strings: calls removed per repeated evaluation'] += len(word) + 1
+
+    def write_operation(self, operation):
+        if operation in self.ARITHMETIC.keys():
+            self.vm_writer.write_arithmetic(self.ARITHMETIC[operation])
+        elif operation == '*':
+            self.vm_writer.write_call('Math.multiply', 2)
+        elif operation == '/':
+            self.vm_writer.write_call('Math.divide', 2)
+
+    # x is on the stack, the constant c has not been emitted
+    def reduce_right(self, operation, c):
+        if c == 0 and operation in ('+', '-', '|') or c == -1 and operation == '&' \
+                or c == 1 and operation in ('*', '/'):
+            return True
+        if c == -1 and operation in ('*', '/'):
+            self.vm_writer.write_arithmetic('NEG')
+            return True
+        if c == 0 and operation in ('*', '&') or c == -1 and operation == '|':
+            self.vm_writer.write_pop('TEMP', 1)
+            self.vm_writer.write_constant(c)
+            return True
+        if operation == '*':
+            return self.reduce_multiply(c)
+        return False
+
+    def reduce_left(self, operation, c):
+        if operation in self.COMMUTATIVE:
+            return self.reduce_right(operation, c)
+        if operation == '-' and c == 0:
+            self.vm_writer.write_arithmetic('NEG')
+            return True
+        return False
+
+    # shift-and-add: temp 1 holds x, temp 2 duplicates the running product
+    def reduce_multiply(self, c):
+        magnitude = abs(c)
+        if magnitude > 0x7FFF:
+            return False
+        bits = bin(magnitude)[3:]
+        ones = bits.count('1')
+        cost = 4 * len(bits) + 2 * ones + (2 if ones else 0) + (1 if c < 0 else 0)
+        if cost > self.MAX_MULTIPLY_SEQUENCE:
+            return False
+        if ones:
+            self.vm_writer.write_pop('TEMP', 1)
+            self.vm_writer.write_push('TEMP', 1)
+        for bit in bits:
+            self.vm_writer.write_pop('TEMP', 2)
+            self.vm_writer.write_push('TEMP', 2)
+            self.vm_writer.write_push('TEMP', 2)
+            self.vm_writer.write_arithmetic('ADD')
+            if bit == '1':
+                self.vm_writer.write_push('TEMP', 1)
+                self.vm_writer.write_arithmetic('ADD')
+        if c < 0:
+            self.vm_writer.write_arithmetic('NEG')
+        return True
 
-    def compile_expression(self):
-        self.compile_term()
+    # returns the expression's value if it is a compile-time constant, in which case nothing was emitted
+    # pushes a left constant held back while its right operand compiled, ahead of that operand's commands
+    def insert_constant(self, value, mark):
+        self.vm_writer.write_constant(value, mark)
+
+    # one `left operation right` step of an expression; value is the left constant still held back, or None
+    # when the left operand is on the stack, and right was compiled from command index mark on. Returns the
+    # constant to hold back for the next step, or None
+    def fold_operation(self, operation, value, right, mark):
+        if value is not None and right is not None:
+            folded = fold_binary(operation, value, right)
+            if folded is not None:
+                self.report['fold constants: operations folded'] += 1
+                return folded
+        if value is not None:
+            if right is None and self.reduce_left(operation, value):
+                self.report['fold strength: operations reduced'] += 1
+                return None
+            self.insert_constant(value, mark)
+        if right is not None:
+            if self.reduce_right(operation, right):
+                self.report['fold strength: operations reduced'] += 1
+                return None
+            self.vm_writer.write_constant(right)
+        self.write_operation(operation)
+        return None
 
+    def fold_expression(self):
+        value = self.compile_term()
         while self.is_operation():
             operation = self.get_token()
-            self.compile_term()
-            if operation in self.ARITHMETIC.keys():
-                self.vm_writer.write_arithmetic(self.ARITHMETIC[operation])
-            elif operation == '*':
-                self.vm_writer.write_call('Math.multiply', 2)
-            elif operation == '/':
-                self.vm_writer.write_call('Math.divide', 2)
+            mark = len(self.vm_writer.commands)
+            value = self.fold_operation(operation, value, self.compile_term(), mark)
+        return value
 
+    def compile_expression(self):
+        value = self.fold_expression()
+        if value is not None:
+            self.vm_writer.write_constant(value)
 
     def compile_expression_list(self):
         num_args = 0
-        if ')' not in self.peek_next_token():
+        if self.peek_next_token() != RIGHT_PAREN:
             num_args += 1
             self.compile_expression()
 
-        while ')' not in self.peek_next_token():
+        while self.peek_next_token() != RIGHT_PAREN:
             num_args += 1
             self.get_token()  # ,
             self.compile_expression()
@@ -428,12 +752,10 @@ class VM_agent:
 
     def compile_let(self):
         self.get_token()  # let
-        var_name = self.get_token()  # var name
-        var_kind = self.CONVERT_KIND[self.get_var_kind(var_name)]
-        var_index = self.get_var_index(var_name)
-        if var_kind is None and '.' not in self.peek_next_token():
-            var_kind = self.class_symbol_table.kind_of(var_name)
-        if '[' in self.peek_next_token():
+        var = self.variable(self.get_token())  # var name
+        var_kind = self.CONVERT_KIND[var.kind]
+        var_index = var.index
+        if self.peek_next_token() == LEFT_BRACKET:
             self.vm_writer.write_push(var_kind, var_index)
             self.get_token()  # [
             self.compile_expression()
@@ -466,7 +788,7 @@ class VM_agent:
         self.vm_writer.write_goto('IF_END' + str(if_index))
         self.get_token()
         self.vm_writer.write_label('IF_FALSE' + str(if_index))
-        if 'else' in self.peek_next_token():
+        if self.peek_next_token() == ELSE:
             self.get_token()  # else
             self.get_token()  # {
             self.compile_statements()
@@ -495,12 +817,13 @@ class VM_agent:
         if direct:
             self.get_token()
         subroutine_name = self.get_token()
-        if self.get_var_type(subroutine_name) is not None:
-            var_kind = self.get_var_kind(subroutine_name)
-            var_index = self.get_var_index(subroutine_name)
-            subroutine_name = self.get_var_type(subroutine_name)
+        var = self.resolve(subroutine_name)
+        if var is not None:
+            var_kind = var.kind
+            var_index = var.index
+            subroutine_name = var.type
             typ = True
-        if '.' in self.peek_next_token():
+        if self.peek_next_token() == DOT:
             if typ:
                 self.vm_writer.write_push(self.CONVERT_KIND[var_kind], var_index)
                 num_args += 1
@@ -528,7 +851,7 @@ class VM_agent:
 
     def compile_return(self):
         self.get_token()
-        if ';' not in self.peek_next_token():
+        if self.peek_next_token() != SEMICOLON:
             self.compile_expression()
         else:
             self.vm_writer.write_push('CONSTANT', 0)
@@ -537,17 +860,18 @@ class VM_agent:
 
     def compile_statements(self):
         while self.is_statement():
-            if 'let' in self.peek_next_token():
+            statement = self.peek_next_token()
+            if statement == LET:
                 self.compile_let()
                 self.get_token()
-            elif 'if' in self.peek_next_token():
+            elif statement == IF:
                 self.compile_if()
-            elif 'while' in self.peek_next_token():
+            elif statement == WHILE:
                 self.compile_while()
-            elif 'do' in self.peek_next_token():
+            elif statement == DO:
                 self.compile_do(True)
                 self.get_token()
-            elif 'return' in self.peek_next_token():
+            elif statement == RETURN:
                 self.compile_return()
 
 
@@ -558,17 +882,20 @@ class VM_agent:
         if subroutine_kind == 'function':
             self.is_function = True
         self.get_token()
-        subroutine_name = self.class_name + '.' + self.get_token()
+        name = self.get_token()
+        subroutine_name = self.class_name + '.' + name
 
         if subroutine_kind == 'method':
             self.insert_to_table('instance', self.class_name, 'ARG')
 
         self.get_token()  # (
         self.compile_param_list()
+        self.signatures[name] = (subroutine_kind,
+                                 self.subroutine_symbol_table.var_count('ARG') - (subroutine_kind == 'method'))
         self.get_token()  # )
         self.get_token()  # {
 
-        while 'var' in self.peek_next_token():
+        while self.peek_next_token() == VAR:
             num_args += self.compile_var_dec()
 
         self.vm_writer.write_function(subroutine_name, num_args)
@@ -586,7 +913,6 @@ class VM_agent:
         self.subroutine_symbol_table.reset()
 
     def compile_class(self):
-        self.ignore()  # <tokens>
         self.get_token()  # class
         self.class_name = self.get_token()
         self.get_token()  # {
@@ -599,57 +925,2103 @@ class VM_agent:
 
 
 
-def main():
-    if len(sys.argv) == 2 and os.path.isdir(sys.argv[1]):
-        for file in os.listdir(sys.argv[1]):
-            if file.endswith('.jack'):
-                root = sys.argv[1] + '/' + file
-                tokenizer = Tokenizer(root)
-                out = open(root.replace('.jack', 'T.xml'), 'w+')
-                out.write("<tokens>\n")
-                while tokenizer.has_more_tokens():
-                    tokenizer.advance()
-                    type_of_token = tokenizer.token_type()
-                    out.write(f"<{type_of_token}> {tokenizer.token} </{type_of_token}>\n")
-                out.seek(0, os.SEEK_END)
-                pos = out.tell() - 2
-                while pos > 0 and out.read(1) != "\n":
-                    pos -= 1
-                    out.seek(pos, os.SEEK_SET)
-                if pos > 0:
-                    out.seek(pos, os.SEEK_SET)
-                    out.truncate()
-                out.write("</tokens>\n")
-                out.close()
-                token_file = open(root.replace('.jack', 'T.xml'), 'r+')
-                vm_writer = VMWriter(root)
-                agent = VM_agent(token_file, vm_writer)
-                agent.compile_class()
+class Node:
+    __slots__ = ()
 
-    else:
-        root = sys.argv[1]
-        tokenizer = Tokenizer(root)
-        out = open(root.replace('.jack', 'T.xml'), 'w+')
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name)
+                                                 for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class ClassNode(Node):
+    __slots__ = ('name', 'class_vars', 'subroutines')
+
+    def __init__(self, name, class_vars, subroutines):
+        self.name = name
+        self.class_vars = class_vars
+        self.subroutines = subroutines
+
+
+class VarDec(Node):
+    __slots__ = ('kind', 'type', 'names')
+
+    def __init__(self, kind, type, names):
+        self.kind = kind
+        self.type = type
+        self.names = names
+
+
+class Subroutine(Node):
+    __slots__ = ('kind', 'return_type', 'name', 'params', 'locals', 'statements')
+
+    def __init__(self, kind, return_type, name, params, locals, statements):
+        self.kind = kind
+        self.return_type = return_type
+        self.name = name
+        self.params = params
+        self.locals = locals
+        self.statements = statements
+
+
+class LetStatement(Node):
+    __slots__ = ('name', 'index', 'value')
+
+    def __init__(self, name, index, value):
+        self.name = name
+        self.index = index
+        self.value = value
+
+
+class IfStatement(Node):
+    __slots__ = ('condition', 'statements', 'else_statements')
+
+    def __init__(self, condition, statements, else_statements):
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+
+
+class WhileStatement(Node):
+    __slots__ = ('condition', 'statements')
+
+    def __init__(self, condition, statements):
+        self.condition = condition
+        self.statements = statements
+
+
+class DoStatement(Node):
+    __slots__ = ('call',)
+
+    def __init__(self, call):
+        self.call = call
+
+
+class ReturnStatement(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Expression(Node):
+    __slots__ = ('terms', 'operators')
+
+    def __init__(self, terms, operators):
+        self.terms = terms
+        self.operators = operators
+
+
+class IntegerConstant(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class StringConstant(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class KeywordConstant(Node):
+    __slots__ = ('keyword',)
+
+    def __init__(self, keyword):
+        self.keyword = keyword
+
+
+class VarRef(Node):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class ArrayRef(Node):
+    __slots__ = ('name', 'index')
+
+    def __init__(self, name, index):
+        self.name = name
+        self.index = index
+
+
+class Call(Node):
+    __slots__ = ('receiver', 'name', 'args')
+
+    def __init__(self, receiver, name, args):
+        self.receiver = receiver
+        self.name = name
+        self.args = args
+
+
+class Unary(Node):
+    __slots__ = ('operation', 'term')
+
+    def __init__(self, operation, term):
+        self.operation = operation
+        self.term = term
+
+
+NODE_TYPES = [ClassNode, VarDec, Subroutine, LetStatement, IfStatement, WhileStatement, DoStatement,
+              ReturnStatement, Expression, IntegerConstant, StringConstant, KeywordConstant, VarRef, ArrayRef, Call,
+              Unary]
+
+NODE_CODES = {node_type: code for code, node_type in enumerate(NODE_TYPES)}
+
+
+# nodes become (code, *fields) tuples, so a whole class can be stored with marshal
+def encode_node(value):
+    if isinstance(value, Node):
+        return (NODE_CODES[type(value)],) + tuple(encode_node(getattr(value, name)) for name in value.__slots__)
+    if isinstance(value, list):
+        return [encode_node(item) for item in value]
+    return value
+
+
+def decode_node(value):
+    value_type = type(value)
+    if value_type is tuple:
+        return NODE_TYPES[value[0]](*[decode_node(item) for item in value[1:]])
+    if value_type is list:
+        return [decode_node(item) for item in value]
+    return value
+
+
+class JackParser(TokenCursor):
+    def parse_class(self):
+        self.get_token()  # class
+        name = self.get_token()
+        self.get_token()  # {
+        class_vars = []
+        while self.peek_next_token() in CLASS_VAR_KINDS:
+            class_vars.append(self.parse_var_dec())
+        subroutines = []
+        while self.peek_next_token() in SUBROUTINE_KINDS:
+            subroutines.append(self.parse_subroutine())
+        return ClassNode(name, class_vars, subroutines)
+
+    def parse_var_dec(self):
+        kind = self.get_token()
+        typ = self.get_token()
+        names = [self.get_token()]
+        while self.get_token() == ',':
+            names.append(self.get_token())
+        return VarDec(kind, typ, names)
+
+    def parse_subroutine(self):
+        kind = self.get_token()
+        return_type = self.get_token()
+        name = self.get_token()
+        self.get_token()  # (
+        params = []
+        while self.peek_next_token() != RIGHT_PAREN:
+            if params:
+                self.get_token()  # ,
+            typ = self.get_token()
+            params.append(VarDec('arg', typ, [self.get_token()]))
+        self.get_token()  # )
+        self.get_token()  # {
+        local_vars = []
+        while self.peek_next_token() == VAR:
+            local_vars.append(self.parse_var_dec())
+        statements = self.parse_statements()
+        self.get_token()  # }
+        return Subroutine(kind, return_type, name, params, local_vars, statements)
+
+    def parse_statements(self):
+        statements = []
+        while self.peek_next_token() in STATEMENTS:
+            statement = self.get_token()
+            if statement == 'let':
+                statements.append(self.parse_let())
+            elif statement == 'if':
+                statements.append(self.parse_if())
+            elif statement == 'while':
+                statements.append(self.parse_while())
+            elif statement == 'do':
+                statements.append(DoStatement(self.parse_call()))
+                self.get_token()  # ;
+            else:
+                value = None
+                if self.peek_next_token() != SEMICOLON:
+                    value = self.parse_expression()
+                self.get_token()  # ;
+                statements.append(ReturnStatement(value))
+        return statements
+
+    def parse_let(self):
+        name = self.get_token()
+        index = None
+        if self.peek_next_token() == LEFT_BRACKET:
+            self.get_token()  # [
+            index = self.parse_expression()
+            self.get_token()  # ]
+        self.get_token()  # =
+        value = self.parse_expression()
+        self.get_token()  # ;
+        return LetStatement(name, index, value)
+
+    def parse_block(self):
+        self.get_token()  # {
+        statements = self.parse_statements()
+        self.get_token()  # }
+        return statements
+
+    def parse_if(self):
+        self.get_token()  # (
+        condition = self.parse_expression()
+        self.get_token()  # )
+        statements = self.parse_block()
+        else_statements = None
+        if self.peek_next_token() == ELSE:
+            self.get_token()  # else
+            else_statements = self.parse_block()
+        return IfStatement(condition, statements, else_statements)
+
+    def parse_while(self):
+        self.get_token()  # (
+        condition = self.parse_expression()
+        self.get_token()  # )
+        return WhileStatement(condition, self.parse_block())
+
+    def parse_call(self):
+        receiver = None
+        name = self.get_token()
+        if self.peek_next_token() == DOT:
+            self.get_token()  # .
+            receiver = name
+            name = self.get_token()
+        self.get_token()  # (
+        args = []
+        while self.peek_next_token() != RIGHT_PAREN:
+            if args:
+                self.get_token()  # ,
+            args.append(self.parse_expression())
+        self.get_token()  # )
+        return Call(receiver, name, args)
+
+    def parse_expression(self):
+        terms = [self.parse_term()]
+        operators = []
+        while self.peek_next_token() in VM_agent.OPERATION_IDS:
+            operators.append(self.get_token())
+            terms.append(self.parse_term())
+        return Expression(terms, operators)
+
+    def parse_term(self):
+        token_type = self.peek_next_token_type()
+        token = self.peek_next_token()
+        if token in VM_agent.UNARY_IDS:
+            return Unary(self.get_token(), self.parse_term())
+        if token == LEFT_PAREN:
+            self.get_token()  # (
+            expression = self.parse_expression()
+            self.get_token()  # )
+            return expression
+        if token_type == INTEGER_CONSTANT:
+            return IntegerConstant(int(self.get_token()))
+        if token_type == STRING_CONSTANT:
+            return StringConstant(self.get_token())
+        if self.peek_next_token(1) == LEFT_BRACKET:
+            name = self.get_token()
+            self.get_token()  # [
+            index = self.parse_expression()
+            self.get_token()  # ]
+            return ArrayRef(name, index)
+        if token_type == KEYWORD:
+            return KeywordConstant(self.get_token())
+        if self.peek_next_token(1) in (DOT, LEFT_PAREN):
+            return self.parse_call()
+        return VarRef(self.get_token())
+
+
+# code generation over the AST; shares symbol tables, folding and string pooling with VM_agent
+class ASTCompiler(VM_agent):
+    def __init__(self, vm_writer, **kwargs):
+        super().__init__(TokenBuffer(), vm_writer, **kwargs)
+        self.statement_generators = {
+            LetStatement: self.generate_let,
+            IfStatement: self.generate_if,
+            WhileStatement: self.generate_while,
+            DoStatement: self.generate_do,
+            ReturnStatement: self.generate_return,
+        }
+
+    def generate_class(self, node):
+        self.class_name = node.name
+        for dec in node.class_vars:
+            for name in dec.names:
+                self.insert_to_table(name, dec.type, dec.kind)
+        for subroutine in node.subroutines:
+            self.generate_subroutine(subroutine)
+
+    def generate_subroutine(self, node):
+        if node.kind == 'method':
+            self.insert_to_table('instance', self.class_name, 'ARG')
+        for param in node.params:
+            self.subroutine_symbol_table.define(param.names[0], param.type, 'ARG')
+        self.signatures[node.name] = (node.kind, len(node.params))
+        num_locals = 0
+        for dec in node.locals:
+            for name in dec.names:
+                self.insert_to_table(name, dec.type, dec.kind)
+            num_locals += len(dec.names)
+
+        self.vm_writer.write_function(self.class_name + '.' + node.name, num_locals)
+        if node.kind == 'constructor':
+            self.vm_writer.write_push('constant', self.class_symbol_table.var_count('FIELD'))
+            self.vm_writer.write_call('Memory.alloc', 1)
+            self.vm_writer.write_pop('POINTER', 0)
+        elif node.kind == 'method':
+            self.vm_writer.write_push('ARG', 0)
+            self.vm_writer.write_pop('POINTER', 0)
+        self.generate_statements(node.statements)
+        self.subroutine_symbol_table.reset()
+
+    def generate_statements(self, statements):
+        for statement in statements:
+            self.statement_generators[type(statement)](statement)
+
+    def generate_let(self, node):
+        var = self.variable(node.name)
+        var_kind = self.CONVERT_KIND[var.kind]
+        if node.index is not None:
+            self.vm_writer.write_push(var_kind, var.index)
+            self.generate_expression(node.index)
+            self.vm_writer.write_arithmetic('ADD')
+            self.generate_expression(node.value)
+            self.vm_writer.write_pop('TEMP', 0)
+            self.vm_writer.write_pop('POINTER', 1)
+            self.vm_writer.write_push('TEMP', 0)
+            self.vm_writer.write_pop('THAT', 0)
+        else:
+            self.generate_expression(node.value)
+            self.vm_writer.write_pop(var_kind, var.index)
+
+    def generate_if(self, node):
+        self.if_index += 1
+        if_index = str(self.if_index)
+        self.generate_expression(node.condition)
+        self.vm_writer.write_if('IF_TRUE' + if_index)
+        self.vm_writer.write_goto('IF_FALSE' + if_index)
+        self.vm_writer.write_label('IF_TRUE' + if_index)
+        self.generate_statements(node.statements)
+        self.vm_writer.write_goto('IF_END' + if_index)
+        self.vm_writer.write_label('IF_FALSE' + if_index)
+        if node.else_statements is not None:
+            self.generate_statements(node.else_statements)
+        self.vm_writer.write_label('IF_END' + if_index)
+
+    def generate_while(self, node):
+        self.while_index += 1
+        while_index = str(self.while_index)
+        self.vm_writer.write_label('START' + while_index)
+        self.generate_expression(node.condition)
+        self.vm_writer.write_arithmetic('NOT')
+        self.vm_writer.write_if('END' + while_index)
+        self.generate_statements(node.statements)
+        self.vm_writer.write_goto('START' + while_index)
+        self.vm_writer.write_label('END' + while_index)
+
+    def generate_do(self, node):
+        self.generate_call(node.call)
+        self.vm_writer.write_pop('TEMP', 0)
+
+    def generate_return(self, node):
+        if node.value is not None:
+            self.generate_expression(node.value)
+        else:
+            self.vm_writer.write_push('CONSTANT', 0)
+        self.vm_writer.write_return()
+
+    def generate_call(self, node):
+        num_args = 0
+        if node.receiver is None:  # method of this class
+            num_args = 1
+            self.vm_writer.write_push('POINTER', 0)
+            subroutine_name = self.class_name + '.' + node.name
+        else:
+            var = self.resolve(node.receiver)
+            if var is not None:
+                self.vm_writer.write_push(self.CONVERT_KIND[var.kind], var.index)
+                num_args = 1
+                subroutine_name = var.type + '.' + node.name
+            else:
+                subroutine_name = node.receiver + '.' + node.name
+        for arg in node.args:
+            self.generate_expression(arg)
+        self.vm_writer.write_call(subroutine_name, num_args + len(node.args))
+
+    def generate_term(self, node):
+        node_type = type(node)
+        if node_type is Unary:
+            value = self.generate_term(node.term)
+            if value is not None:
+                self.report['fold constants: operations folded'] += 1
+                return self.constant(fold_unary(node.operation, value))
+            self.vm_writer.write_arithmetic(self.ARITHMETIC_UNARY[node.operation])
+        elif node_type is Expression:
+            return self.fold_node(node)
+        elif node_type is IntegerConstant:
+            return self.constant(node.value)
+        elif node_type is StringConstant:
+            if self.pool_strings:
+                self.compile_pooled_string(node.value)
+            else:
+                self.compile_string(node.value)
+        elif node_type is ArrayRef:
+            arr = self.variable(node.name)
+            self.vm_writer.write_push(self.CONVERT_KIND[arr.kind], arr.index)
+            self.generate_expression(node.index)
+            self.vm_writer.write_arithmetic('ADD')
+            self.vm_writer.write_pop('POINTER', 1)
+            self.vm_writer.write_push('THAT', 0)
+        elif node_type is KeywordConstant:
+            if node.keyword == 'this':
+                self.vm_writer.write_push('POINTER', 0)
+            else:
+                return self.constant(-1 if node.keyword == 'true' else 0)
+        elif node_type is Call:
+            self.generate_call(node)
+        else:
+            var = self.variable(node.name)
+            self.vm_writer.write_push(self.CONVERT_KIND[var.kind], var.index)
+        return None
+
+    # same contract as VM_agent.fold_expression
+    def fold_node(self, node):
+        value = self.generate_term(node.terms[0])
+        for operation, term in zip(node.operators, node.terms[1:]):
+            mark = len(self.vm_writer.commands)
+            value = self.fold_operation(operation, value, self.generate_term(term), mark)
+        return value
+
+    def generate_expression(self, node):
+        value = self.fold_node(node)
+        if value is not None:
+            self.vm_writer.write_constant(value)
+
+
+class ASTCache:
+    VERSION = 2
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, source):
+        digest = hashlib.sha256(f"{self.VERSION}\0{source}".encode()).hexdigest()
+        return os.path.join(self.directory, digest + '.ast')
+
+    def load(self, source):
+        try:
+            with open(self.path(source), 'rb') as f:
+                return decode_node(marshal.loads(zlib.decompress(f.read())))
+        except (OSError, EOFError, ValueError, TypeError, IndexError, zlib.error):
+            return None
+
+    def store(self, source, node):
+        path = self.path(source)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(zlib.compress(marshal.dumps(encode_node(node))))
+        os.replace(temporary, path)
+
+
+def parse_source(source, cache=None):
+    node = cache.load(source) if cache is not None else None
+    if node is None:
+        node = JackParser(Tokenizer.scan(source)).parse_class()
+        if cache is not None:
+            cache.store(source, node)
+    return node
+
+
+def split_functions(commands):
+    functions = []
+    for command in commands:
+        if command.op == 'function' or not functions:
+            functions.append([])
+        functions[-1].append(command)
+    return functions
+
+
+class PeepholeOptimizer:
+    JUMPS = ('goto', 'if-goto')
+
+    COMPARISONS = ('eq', 'gt', 'lt')
+
+    POP_TEMP = VMCommand('pop', 'temp', 0)
+
+    ARRAY_STORE = (POP_TEMP, VMCommand('pop', 'pointer', 1), VMCommand('push', 'temp', 0), VMCommand('pop', 'that', 0))
+
+    def __init__(self):
+        self.removed = Counter()
+        # (name, opcodes the rule's first command can have, rule)
+        self.rules = [
+            ('push-pop', ('push',), self.push_pop),
+            ('double-not', ('not', 'neg'), self.double_unary),
+            ('constant-branch', ('push',), self.constant_branch),
+            ('if-fallthrough', ('if-goto',), self.if_fallthrough),
+            ('goto-next', ('goto',), self.goto_next),
+            ('unused-label', ('label',), self.unused_label),
+            ('array-store', ('push',), self.array_store),
+            ('return-discard', ('pop',), self.return_discard),
+        ]
+        self.dispatch = {}
+        for name, ops, rule in self.rules:
+            for op in ops:
+                self.dispatch.setdefault(op, []).append((name, rule))
+
+    def optimize(self, commands):
+        optimized = []
+        for function in split_functions(commands):
+            optimized.extend(self.optimize_function(function))
+        return optimized
+
+    def optimize_function(self, commands):
+        changed = True
+        while changed:
+            changed = False
+            refs = Counter(command.arg1 for command in commands if command.op in self.JUMPS)
+            out = []
+            i = 0
+            while i < len(commands):
+                for name, rule in self.dispatch.get(commands[i].op, ()):
+                    match = rule(commands, i, refs)
+                    if match is not None:
+                        consumed, replacement = match
+                        self.removed[name] += consumed - len(replacement)
+                        out.extend(replacement)
+                        i += consumed
+                        changed = True
+                        break
+                else:
+                    out.append(commands[i])
+                    i += 1
+            commands = out
+        return commands
+
+    # push s i; pop s i
+    @staticmethod
+    def push_pop(commands, i, refs):
+        if i + 1 < len(commands):
+            first, second = commands[i], commands[i + 1]
+            if first.op == 'push' and second.op == 'pop' and first.arg1 == second.arg1 and first.arg2 == second.arg2:
+                return 2, []
+        return None
+
+    # not; not  /  neg; neg
+    @staticmethod
+    def double_unary(commands, i, refs):
+        if i + 1 < len(commands):
+            op = commands[i].op
+            if op in ('not', 'neg') and commands[i + 1].op == op:
+                return 2, []
+        return None
+
+    # push constant c; [not;] if-goto L  ->  goto L or nothing
+    @staticmethod
+    def constant_branch(commands, i, refs):
+        command = commands[i]
+        if command.op != 'push' or command.arg1 != 'constant':
+            return None
+        value = command.arg2
+        j = i + 1
+        if j < len(commands) and commands[j].op == 'not':
+            value = ~value
+            j += 1
+        if j < len(commands) and commands[j].op == 'if-goto':
+            if value == 0:
+                return j + 1 - i, []
+            return j + 1 - i, [VMCommand('goto', commands[j].arg1)]
+        return None
+
+    # if-goto A; goto B; label A  ->  not; if-goto B
+    # only after a comparison: any nonzero value is true, so 'not' negates only the results of eq, gt and lt
+    @classmethod
+    def if_fallthrough(cls, commands, i, refs):
+        if 0 < i and i + 2 < len(commands) and commands[i - 1].op in cls.COMPARISONS:
+            branch, jump, label = commands[i:i + 3]
+            if branch.op == 'if-goto' and jump.op == 'goto' and label.op == 'label' \
+                    and label.arg1 == branch.arg1 and refs[label.arg1] == 1:
+                return 3, [VMCommand('not'), VMCommand('if-goto', jump.arg1)]
+        return None
+
+    # goto L; label ...; label L
+    @staticmethod
+    def goto_next(commands, i, refs):
+        if commands[i].op != 'goto':
+            return None
+        j = i + 1
+        while j < len(commands) and commands[j].op == 'label':
+            if commands[j].arg1 == commands[i].arg1:
+                return 1, []
+            j += 1
+        return None
+
+    @staticmethod
+    def unused_label(commands, i, refs):
+        if commands[i].op == 'label' and refs[commands[i].arg1] == 0:
+            return 1, []
+        return None
+
+    # push x; pop temp 0; pop pointer 1; push temp 0; pop that 0  ->  pop pointer 1; push x; pop that 0
+    @staticmethod
+    def array_store(commands, i, refs):
+        if i + 4 < len(commands) and commands[i + 1] == PeepholeOptimizer.POP_TEMP:
+            value = commands[i]
+            if value.op == 'push' and value.arg1 not in ('that', 'pointer', 'temp') \
+                    and tuple(commands[i + 1:i + 5]) == PeepholeOptimizer.ARRAY_STORE:
+                return 5, [PeepholeOptimizer.ARRAY_STORE[1], value, PeepholeOptimizer.ARRAY_STORE[3]]
+        return None
+
+    # pop temp 0; push x; return  ->  push x; return
+    @staticmethod
+    def return_discard(commands, i, refs):
+        if i + 2 < len(commands):
+            discard, value, ret = commands[i:i + 3]
+            if discard == PeepholeOptimizer.POP_TEMP and value.op == 'push' and value.arg1 != 'temp' \
+                    and ret.op == 'return':
+                return 3, [value, ret]
+        return None
+
+
+class BasicBlock:
+    def __init__(self):
+        self.labels = []
+        self.body = []
+        # the goto, if-goto or return ending the block; None falls through to the next block
+        self.jump = None
+
+
+# rebuilds each function from its basic blocks: drops unreachable blocks, threads jumps to jumps, inverts
+# branches so that they fall through, and rotates while loops so that each iteration takes one
+# conditional branch instead of a not, an if-goto and a goto; a branch is only inverted when its condition
+# comes straight from a comparison, since adding or removing a not negates nothing but 0 and -1
+class FlowOptimizer:
+    JUMPS = ('goto', 'if-goto')
+    COMPARISONS = ('eq', 'gt', 'lt')
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def optimize(self, commands):
+        optimized = []
+        for function in split_functions(commands):
+            optimized.extend(self.optimize_function(function))
+        return optimized
+
+    @staticmethod
+    def blocks(commands):
+        blocks = [BasicBlock()]
+        for command in commands:
+            block = blocks[-1]
+            if block.jump is not None or command.op == 'label' and block.body:
+                block = BasicBlock()
+                blocks.append(block)
+            if command.op == 'label':
+                block.labels.append(command)
+            elif command.op in ('goto', 'if-goto', 'return'):
+                block.jump = command
+            else:
+                block.body.append(command)
+        return blocks
+
+    @staticmethod
+    def index(blocks):
+        return {label.arg1: i for i, block in enumerate(blocks) for label in block.labels}
+
+    @staticmethod
+    def refs(blocks):
+        return Counter(block.jump.arg1 for block in blocks if block.jump is not None and block.jump.op != 'return')
+
+    # negates the condition the block branches on and returns True, or returns False if it cannot
+    def negate(self, block):
+        body = block.body
+        if body and body[-1].op in self.COMPARISONS:
+            body.append(VMCommand('not'))
+            return True
+        if len(body) > 1 and body[-1].op == 'not' and body[-2].op in self.COMPARISONS:
+            body.pop()
+            return True
+        return False
+
+    def optimize_function(self, commands):
+        jumps = sum(command.op in self.JUMPS for command in commands)
+        blocks = self.blocks(commands)
+        changed = True
+        while changed:
+            changed = False
+            for step in (self.prune, self.thread, self.invert, self.fall_through, self.rotate):
+                changed |= step(blocks)
+        refs = self.refs(blocks)
+        optimized = []
+        for block in blocks:
+            optimized.extend(label for label in block.labels if refs[label.arg1])
+            optimized.extend(block.body)
+            if block.jump is not None:
+                optimized.append(block.jump)
+        self.counts['jumps removed'] += jumps - sum(command.op in self.JUMPS for command in optimized)
+        return optimized
+
+    # removes the blocks that cannot be reached from the function's entry, such as code after a return
+    def prune(self, blocks):
+        index = self.index(blocks)
+        reached = set()
+        pending = [0]
+        while pending:
+            i = pending.pop()
+            if i in reached or i >= len(blocks):
+                continue
+            reached.add(i)
+            jump = blocks[i].jump
+            if jump is None or jump.op == 'if-goto':
+                pending.append(i + 1)
+            if jump is not None and jump.op != 'return':
+                pending.append(index[jump.arg1])
+        if len(reached) == len(blocks):
+            return False
+        self.counts['blocks removed'] += len(blocks) - len(reached)
+        blocks[:] = [block for i, block in enumerate(blocks) if i in reached]
+        return True
+
+    # a jump to a block that only jumps on goes straight to the final target; a goto to a block that only
+    # returns becomes the return
+    def thread(self, blocks):
+        index = self.index(blocks)
+        changed = False
+        for block in blocks:
+            jump = block.jump
+            if jump is None or jump.op == 'return':
+                continue
+            target = jump.arg1
+            seen = {target}
+            following = blocks[index[target]]
+            while not following.body and following.jump is not None and following.jump.op == 'goto' \
+                    and following.jump.arg1 not in seen:
+                target = following.jump.arg1
+                seen.add(target)
+                following = blocks[index[target]]
+            if target != jump.arg1:
+                block.jump = VMCommand(jump.op, target)
+                self.counts['jumps threaded'] += 1
+                changed = True
+            if block.jump.op == 'goto' and not following.body and following.jump is not None \
+                    and following.jump.op == 'return':
+                block.jump = following.jump
+                self.counts['jumps threaded'] += 1
+                changed = True
+        return changed
+
+    # if-goto A; goto B; label A  ->  not; if-goto B, when nothing else jumps to the goto
+    def invert(self, blocks):
+        index = self.index(blocks)
+        refs = self.refs(blocks)
+        for i, block in enumerate(blocks[:-2]):
+            if block.jump is None or block.jump.op != 'if-goto' or index[block.jump.arg1] != i + 2:
+                continue
+            skip = blocks[i + 1]
+            if skip.body or skip.jump is None or skip.jump.op != 'goto' \
+                    or any(refs[label.arg1] for label in skip.labels) or not self.negate(block):
+                continue
+            block.jump = VMCommand('if-goto', skip.jump.arg1)
+            del blocks[i + 1]
+            self.counts['branches inverted'] += 1
+            self.counts['blocks removed'] += 1
+            return True
+        return False
+
+    def fall_through(self, blocks):
+        index = self.index(blocks)
+        changed = False
+        for i, block in enumerate(blocks):
+            if block.jump is not None and block.jump.op == 'goto' and index[block.jump.arg1] == i + 1:
+                block.jump = None
+                changed = True
+        return changed
+
+    # label H; cond; if-goto E; B...; goto H; label E  ->  goto H; label B; B...; label H; cond; not;
+    # if-goto B; label E, so that the loop test sits at the bottom and falls through on exit
+    def rotate(self, blocks):
+        index = self.index(blocks)
+        for x, block in enumerate(blocks):
+            if block.jump is None or block.jump.op != 'goto':
+                continue
+            h = index[block.jump.arg1]
+            header = blocks[h]
+            if not 0 < h < x or header.jump is None or header.jump.op != 'if-goto' \
+                    or index[header.jump.arg1] != x + 1 or not self.negate(header):
+                continue
+            body = blocks[h + 1]
+            if not body.labels:
+                name = header.labels[0].arg1 + '$BODY'
+                while name in index:
+                    name += '$'
+                body.labels.append(VMCommand('label', name))
+            header.jump = VMCommand('if-goto', body.labels[0].arg1)
+            block.jump = None
+            entry = []
+            if blocks[h - 1].jump is None or blocks[h - 1].jump.op == 'if-goto':
+                entry = [BasicBlock()]
+                entry[0].jump = VMCommand('goto', header.labels[0].arg1)
+            blocks[h:x + 1] = entry + blocks[h + 1:x + 1] + [header]
+            self.counts['loops rotated'] += 1
+            return True
+        return False
+
+
+class LocalPacker:
+    def __init__(self):
+        self.removed = 0
+        self.functions = 0
+
+    def optimize(self, commands):
+        packed = []
+        for function in split_functions(commands):
+            packed.extend(self.pack_function(function))
+        return packed
+
+    # live_out[i]: bitmask of the locals that may still be read after commands[i]
+    @staticmethod
+    def liveness(commands):
+        labels = {command.arg1: i for i, command in enumerate(commands) if command.op == 'label'}
+        successors = []
+        uses = []
+        defs = []
+        for i, command in enumerate(commands):
+            if command.op == 'goto':
+                successors.append((labels[command.arg1],))
+            elif command.op == 'if-goto':
+                successors.append((labels[command.arg1], i + 1))
+            elif command.op == 'return' or i + 1 == len(commands):
+                successors.append(())
+            else:
+                successors.append((i + 1,))
+            local = command.arg1 == 'local' and command.op in ('push', 'pop')
+            uses.append(1 << command.arg2 if local and command.op == 'push' else 0)
+            defs.append(1 << command.arg2 if local and command.op == 'pop' else 0)
+
+        live_in = [0] * len(commands)
+        live_out = [0] * len(commands)
+        changed = True
+        while changed:
+            changed = False
+            for i in reversed(range(len(commands))):
+                out = 0
+                for successor in successors[i]:
+                    out |= live_in[successor]
+                live = uses[i] | (out & ~defs[i])
+                if out != live_out[i] or live != live_in[i]:
+                    live_out[i] = out
+                    live_in[i] = live
+                    changed = True
+        return defs, live_out
+
+    # locals that are never live at the same time share a slot; a local read before it is written keeps
+    # its zero because every slot starts at zero and no other local is written into it while it is live
+    def pack_function(self, function):
+        header = function[0]
+        if header.op != 'function' or header.arg2 < 2:
+            return function
+        defs, live_out = self.liveness(function)
+        interference = [0] * header.arg2
+        used = 0
+        for command, defined, out in zip(function, defs, live_out):
+            if command.arg1 == 'local' and command.op in ('push', 'pop'):
+                used |= 1 << command.arg2
+            if defined:
+                local = defined.bit_length() - 1
+                interference[local] |= out & ~defined
+                for other in range(header.arg2):
+                    if out >> other & 1 and other != local:
+                        interference[other] |= defined
+
+        slots = {}
+        for local in range(header.arg2):
+            if used >> local & 1:
+                taken = {slots[other] for other in slots if interference[local] >> other & 1}
+                slots[local] = next(slot for slot in range(header.arg2) if slot not in taken)
+        count = max(slots.values(), default=-1) + 1
+        if count == header.arg2:
+            return function
+
+        self.removed += header.arg2 - count
+        self.functions += 1
+        packed = [VMCommand('function', header.arg1, count)]
+        for command in function[1:]:
+            if command.arg1 == 'local' and command.op in ('push', 'pop'):
+                command = VMCommand(command.op, 'local', slots[command.arg2])
+            packed.append(command)
+        return packed
+
+
+class DeadCodeEliminator:
+    # Main.main plus the entry points the OS calls itself, in case the program supplies its own OS classes
+    ROOTS = ('Main.main', 'Sys.init', 'Sys.error', 'Memory.init', 'Math.init', 'Screen.init', 'Output.init',
+             'Keyboard.init')
+    # without either, the classes are a library whose callers are not known, so nothing is removed
+    ENTRY_POINTS = ('Main.main', 'Sys.init')
+
+    def __init__(self, roots=ROOTS):
+        self.roots = roots
+        self.reachable = set()
+        self.removed = []
+        self.removed_instructions = 0
+        self.skipped = False
+
+    def eliminate(self, programs):
+        functions = {}
+        for commands in programs:
+            for function in split_functions(commands):
+                if function[0].op == 'function':
+                    functions[function[0].arg1] = function
+        if not any(entry in functions for entry in self.ENTRY_POINTS):
+            self.skipped = True
+            return programs
+
+        pending = [root for root in self.roots if root in functions]
+        self.reachable = set(pending)
+        while pending:
+            for command in functions[pending.pop()]:
+                if command.op == 'call' and command.arg1 in functions and command.arg1 not in self.reachable:
+                    self.reachable.add(command.arg1)
+                    pending.append(command.arg1)
+
+        eliminated = []
+        for commands in programs:
+            kept = []
+            for function in split_functions(commands):
+                if function[0].op == 'function' and function[0].arg1 not in self.reachable:
+                    self.removed.append(function[0].arg1)
+                    self.removed_instructions += len(function)
+                else:
+                    kept.extend(function)
+            eliminated.append(kept)
+        return eliminated
+
+    def __str__(self):
+        if self.skipped:
+            return 'whole-program: no Main.main or Sys.init, nothing removed'
+        lines = [f"whole-program: {len(self.reachable)} subroutines reachable, {len(self.removed)} removed "
+                 f"({self.removed_instructions} instructions)"]
+        lines.extend(f"  removed {name}" for name in self.removed)
+        return '\n'.join(lines)
+
+
+class Inliner:
+    # the code generator only uses temp 0-2, and never across a call, so an inlined body keeps its
+    # arguments and locals in the remaining temp slots
+    TEMP_BASE = 3
+    TEMP_SLOTS = 5
+
+    METHOD_PROLOGUE = (VMCommand('push', 'argument', 0), VMCommand('pop', 'pointer', 0))
+
+    def __init__(self, threshold=8):
+        self.threshold = threshold
+        self.sites = Counter()
+        self.labels = 0
+
+    # returns (locals, body, is_method) for a leaf subroutine small enough to inline, else None;
+    # a leaf makes no calls, so it cannot be recursive either
+    def candidate(self, function):
+        body = function[1:]
+        is_method = tuple(body[:2]) == self.METHOD_PROLOGUE
+        if is_method:
+            body = body[2:]
+        if not body or body[-1].op != 'return' or len(body) - 1 > self.threshold:
+            return None
+        for command in body:
+            if command.op in ('call', 'function'):
+                return None
+            if command.op in ('push', 'pop'):
+                if command.arg1 == 'temp' and command.arg2 >= self.TEMP_BASE:
+                    return None
+                if command.arg1 == 'this' and not is_method:
+                    return None
+                if command.arg1 == 'pointer' and command.arg2 == 0 and (command.op == 'pop' or not is_method):
+                    return None
+        return function[0].arg2, body, is_method
+
+    def expand(self, callee, arguments):
+        local_count, body, is_method = callee
+        base = self.TEMP_BASE
+        receiver = VMCommand('push', 'temp', base)
+        prefix = f"INLINE{self.labels}_"
+        self.labels += 1
+        out = [VMCommand('pop', 'temp', base + i) for i in reversed(range(arguments))]
+        for i in range(local_count):
+            out.extend([VMCommand('push', 'constant', 0), VMCommand('pop', 'temp', base + arguments + i)])
+        for command in body[:-1]:
+            if command.op in ('push', 'pop'):
+                if command.arg1 == 'argument':
+                    command = VMCommand(command.op, 'temp', base + command.arg2)
+                elif command.arg1 == 'local':
+                    command = VMCommand(command.op, 'temp', base + arguments + command.arg2)
+                elif command.arg1 == 'this':
+                    # fields are reached through that, leaving the caller's this pointer alone
+                    out.extend([receiver, VMCommand('pop', 'pointer', 1)])
+                    command = VMCommand(command.op, 'that', command.arg2)
+                elif command.arg1 == 'pointer' and command.arg2 == 0:
+                    command = receiver
+            elif command.op in ('label', 'goto', 'if-goto'):
+                command = VMCommand(command.op, prefix + command.arg1)
+            elif command.op == 'return':
+                command = VMCommand('goto', prefix + 'END')
+            out.append(command)
+        if any(command.op == 'return' for command in body[:-1]):
+            out.append(VMCommand('label', prefix + 'END'))
+        return out
+
+    def inlinable(self, caller, command, callee):
+        local_count, body, is_method = callee
+        if command.arg2 + local_count > self.TEMP_SLOTS:
+            return False
+        if any(c.arg1 == 'argument' and c.arg2 >= command.arg2 for c in body):
+            return False
+        # static segments belong to the file, so only a caller in the same class may see them
+        return caller.split('.')[0] == command.arg1.split('.')[0] or all(c.arg1 != 'static' for c in body)
+
+    def inline(self, programs):
+        callees = {}
+        for commands in programs:
+            for function in split_functions(commands):
+                if function[0].op == 'function':
+                    callee = self.candidate(function)
+                    if callee is not None:
+                        callees[function[0].arg1] = callee
+
+        inlined = []
+        for commands in programs:
+            out = []
+            for function in split_functions(commands):
+                caller = function[0].arg1
+                for command in function:
+                    callee = callees.get(command.arg1) if command.op == 'call' else None
+                    if callee is not None and self.inlinable(caller, command, callee):
+                        out.extend(self.expand(callee, command.arg2))
+                        self.sites[caller, command.arg1] += 1
+                    else:
+                        out.append(command)
+            inlined.append(out)
+        return inlined
+
+    def __str__(self):
+        lines = [f"inlining: {sum(self.sites.values())} call sites inlined "
+                 f"({len({callee for _, callee in self.sites})} subroutines)"]
+        lines.extend(f"  {caller} -> {callee}: {count}" for (caller, callee), count in sorted(self.sites.items()))
+        return '\n'.join(lines)
+
+
+def write_token_xml(tokens, path):
+    with open(path, 'w') as out:
         out.write("<tokens>\n")
-        while tokenizer.has_more_tokens():
-            tokenizer.advance()
-            type_of_token = tokenizer.token_type()
-            out.write(f"<{type_of_token}> {tokenizer.token} </{type_of_token}>\n")
-        out.seek(0, os.SEEK_END)
-        pos = out.tell() - 2
-        while pos > 0 and out.read(1) != "\n":
-            pos -= 1
-            out.seek(pos, os.SEEK_SET)
-        if pos > 0:
-            out.seek(pos, os.SEEK_SET)
-            out.truncate()
+        escaped = Tokenizer.ESCAPED_SYMBOLS
+        for kind, token in tokens:
+            if kind == SYMBOL:
+                token = escaped.get(token, token)
+            out.write(f"<{KIND_NAMES[kind]}> {token} </{KIND_NAMES[kind]}>\n")
         out.write("</tokens>\n")
-        out.close()
-        token_file = open(root.replace('.jack', 'T.xml'), 'r+')
-        vm_writer = VMWriter(root)
-        agent = VM_agent(token_file, vm_writer)
+
+
+CompileOptions = namedtuple('CompileOptions',
+                            ['xml', 'optimize', 'pool_strings', 'profile', 'ast', 'ast_cache', 'pack_locals',
+                             'source_map', 'cost_report', 'binary', 'cfg'],
+                            defaults=[False, False, False, False, False, None, False, False, False, False, False])
+
+CompileResult = namedtuple('CompileResult', ['error', 'report', 'commands', 'profile', 'costs', 'index'],
+                           defaults=[None, None])
+
+
+class ProfilingAgent(VM_agent):
+    def __init__(self, tokens, vm_writer, **kwargs):
+        super().__init__(tokens, vm_writer, **kwargs)
+        self.counters = Counter()
+
+    def get_token(self):
+        self.counters['token reads'] += 1
+        return super().get_token()
+
+    def peek_next_token(self, offset=0):
+        self.counters['peeks'] += 1
+        return super().peek_next_token(offset)
+
+    def peek_next_token_type(self):
+        self.counters['peeks'] += 1
+        return super().peek_next_token_type()
+
+    def resolve(self, var_name):
+        self.counters['symbol lookups'] += 1
+        return super().resolve(var_name)
+
+
+class MappingAgent(VM_agent):
+    def __init__(self, tokens, vm_writer, positions=(), **kwargs):
+        super().__init__(tokens, vm_writer, **kwargs)
+        self.positions = positions
+        self.marks = []
+        self.line = None
+        # the commands a declaration or statement emits before reading its first token or after its body
+        # belong to the line of the token it starts with, not to the last token read
+        self.lines = {}
+        self.body = None
+        # the line each expression being compiled starts on, innermost last
+        self.expression_lines = []
+
+    def get_token(self):
+        token = super().get_token()
+        line = self.positions[self.position - 1][0]
+        if line != self.line:
+            self.line = line
+            self.marks.append((len(self.vm_writer.commands), line))
+        return token
+
+    def next_line(self):
+        return self.positions[self.position][0]
+
+    # a constant held back is the folded start of the expression, so it gets that line; the marks
+    # recorded since move past it
+    def insert_constant(self, value, mark):
+        count = len(self.vm_writer.commands)
+        super().insert_constant(value, mark)
+        inserted = len(self.vm_writer.commands) - count
+        for k in range(len(self.marks) - 1, -1, -1):
+            index, line = self.marks[k]
+            if index < mark:
+                break
+            self.marks[k] = (index + inserted, line)
+        for i in range(mark, mark + inserted):
+            self.lines[i] = self.expression_lines[-1]
+
+    def fold_expression(self):
+        self.expression_lines.append(self.next_line())
+        value = super().fold_expression()
+        self.expression_lines.pop()
+        return value
+
+    # the function command and the prologue before the first statement
+    def compile_subroutine(self):
+        line = self.next_line()
+        start = len(self.vm_writer.commands)
+        self.body = None
+        super().compile_subroutine()
+        for i in range(start, self.body):
+            self.lines[i] = line
+
+    def compile_statements(self):
+        if self.body is None:
+            self.body = len(self.vm_writer.commands)
+        super().compile_statements()
+
+    # the labels and jumps of a statement, found by their names among the commands it emitted
+    def locate_labels(self, line, start, names):
+        for i in range(start, len(self.vm_writer.commands)):
+            command = self.vm_writer.commands[i]
+            if command.op in ('label', 'goto', 'if-goto') and command.arg1 in names:
+                self.lines[i] = line
+
+    def compile_if(self):
+        line = self.next_line()
+        start = len(self.vm_writer.commands)
+        names = {f"{label}{self.if_index + 1}" for label in ('IF_TRUE', 'IF_FALSE', 'IF_END')}
+        super().compile_if()
+        self.locate_labels(line, start, names)
+
+    def compile_while(self):
+        line = self.next_line()
+        start = len(self.vm_writer.commands)
+        names = {f"{label}{self.while_index + 1}" for label in ('START', 'END')}
+        super().compile_while()
+        self.locate_labels(line, start, names)
+
+
+class ProfilingMappingAgent(MappingAgent, ProfilingAgent):
+    pass
+
+
+class StreamingAgent(VM_agent):
+    def __init__(self, tokens, vm_writer, **kwargs):
+        super().__init__(TokenBuffer(), vm_writer, **kwargs)
+        self.stream = iter(tokens)
+        self.lookahead = deque()
+
+    def fill(self, count):
+        while len(self.lookahead) < count:
+            token = next(self.stream, None)
+            if token is None:
+                return False
+            self.lookahead.append(token)
+        return True
+
+    def get_token(self):
+        self.fill(1)
+        self.current_token = self.lookahead.popleft()[1]
+        return self.current_token
+
+    def peek_next_token(self, offset=0):
+        if not self.fill(offset + 1):
+            return NO_LEXEME
+        kind, lexeme = self.lookahead[offset]
+        return LEXEME_IDS[lexeme] if kind in (KEYWORD, SYMBOL) else NO_LEXEME
+
+    def peek_next_token_type(self):
+        if not self.fill(1):
+            return None
+        return self.lookahead[0][0]
+
+
+# writes each function as soon as the next one starts, so only one function's commands are held in memory
+class StreamingVMWriter(VMWriter):
+    def __init__(self, out, optimizers=()):
+        super().__init__()
+        self.out = out
+        self.optimizers = optimizers
+
+    def write_function(self, name, nvars):
+        self.flush()
+        super().write_function(name, nvars)
+
+    def flush(self):
+        for optimizer in self.optimizers:
+            self.commands = optimizer.optimize(self.commands)
+        self.out.write(self.text())
+        self.commands = []
+
+    def close(self):
+        self.flush()
+
+
+class Profile:
+    STAGES = ('tokenize', 'handoff', 'compile', 'optimize', 'output')
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = dict.fromkeys(self.STAGES, 0.0)
+        self.counters = Counter()
+        self.opcodes = Counter()
+        self.start = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] += now - self.start
+        self.start = now
+
+    def total(self):
+        return sum(self.stages.values())
+
+    def as_dict(self):
+        return {'file': self.name, 'seconds': dict(self.stages, total=self.total()),
+                'counters': dict(self.counters), 'opcodes': dict(self.opcodes)}
+
+
+def create_agent(tokens, vm_writer, options=CompileOptions(), positions=None):
+    if positions is not None:
+        agent_class = ProfilingMappingAgent if options.profile else MappingAgent
+        return agent_class(tokens, vm_writer, positions=positions, fold=options.optimize,
+                           pool_strings=options.pool_strings)
+    agent_class = ProfilingAgent if options.profile else VM_agent
+    return agent_class(tokens, vm_writer, fold=options.optimize, pool_strings=options.pool_strings)
+
+
+def generate_from_ast(source, vm_writer, options=CompileOptions()):
+    cache = ASTCache(options.ast_cache) if options.ast_cache is not None else None
+    agent = ASTCompiler(vm_writer, fold=options.optimize, pool_strings=options.pool_strings)
+    agent.generate_class(parse_source(source, cache))
+    return agent
+
+
+def optimize_commands(vm_writer, options, report):
+    if options.optimize:
+        optimizer = PeepholeOptimizer()
+        vm_writer.commands = optimizer.optimize(vm_writer.commands)
+        for rule, removed in optimizer.removed.items():
+            report[f"peephole {rule}: instructions removed"] += removed
+    if options.cfg:
+        flow = FlowOptimizer()
+        vm_writer.commands = flow.optimize(vm_writer.commands)
+        for name, count in flow.counts.items():
+            report[f"cfg: {name}"] += count
+    if options.pack_locals:
+        packer = LocalPacker()
+        vm_writer.commands = packer.optimize(vm_writer.commands)
+        report["pack locals: local slots removed"] += packer.removed
+        report["pack locals: functions shrunk"] += packer.functions
+
+
+def compile_text(source, options=CompileOptions()):
+    report = Counter()
+    vm_writer = VMWriter()
+    if options.ast:
+        agent = generate_from_ast(source, vm_writer, options)
+    else:
+        agent = create_agent(Tokenizer.scan(source), vm_writer, options)
         agent.compile_class()
+    report.update(agent.report)
+    optimize_commands(vm_writer, options, report)
+    return vm_writer, report
+
+
+def compile_source(source, options=CompileOptions()):
+    return compile_text(source, options)[0].text()
+
+
+# pairs of (name, source) -> list of (name, vm text), in the same order
+def compile_sources(sources, options=CompileOptions()):
+    return [(name, compile_source(source, options)) for name, source in sources]
+
+
+def compile_file(root, options=CompileOptions(), write=True):
+    report = Counter()
+    profile = Profile(root)
+    if options.ast:
+        with open(root) as f:
+            source = f.read()
+        if options.xml:
+            write_token_xml(Tokenizer.scan(source), root.replace('.jack', 'T.xml'))
+        vm_writer = VMWriter(root, options.binary)
+        agent = generate_from_ast(source, vm_writer, options)
+        report.update(agent.report)
+        profile.lap('compile')
+        if write:
+            optimize_commands(vm_writer, options, report)
+            profile.lap('optimize')
+            vm_writer.close()
+            profile.lap('output')
+        return vm_writer, report, profile, agent.signatures
+
+    tokenizer = Tokenizer(root, locate=options.source_map or options.cost_report)
+    profile.lap('tokenize')
+    if options.xml:
+        write_token_xml(tokenizer.tokens, root.replace('.jack', 'T.xml'))
+    vm_writer = VMWriter(root, options.binary)
+    agent = create_agent(tokenizer.tokens, vm_writer, options, tokenizer.positions)
+    profile.lap('handoff')
+    agent.compile_class()
+    if tokenizer.positions is not None:
+        vm_writer.commands = locate_commands(vm_writer.commands, agent.marks, agent.lines)
+    profile.lap('compile')
+    report.update(agent.report)
+    if options.profile:
+        profile.counters['tokens'] = len(tokenizer.tokens)
+        profile.counters.update(agent.counters)
+        profile.opcodes.update(command.op for command in vm_writer.commands)
+    # without write the whole-program passes run first and optimize afterwards
+    if write:
+        optimize_commands(vm_writer, options, report)
+        profile.lap('optimize')
+        vm_writer.close()
+        if options.source_map:
+            write_source_map(vm_writer, root)
+        profile.lap('output')
+    return vm_writer, report, profile, agent.signatures
+
+
+def try_compile_file(root, options=CompileOptions(), write=True):
+    try:
+        vm_writer, report, profile, signatures = compile_file(root, options, write)
+    except CompileError as e:
+        return CompileResult(f"{root}: {e}", Counter(), None, None)
+    except Exception as e:
+        return CompileResult(f"{root}: {type(e).__name__}: {e}", Counter(), None, None)
+    costs = None
+    if options.cost_report and write:
+        costs = CostReport()
+        costs.add(root, vm_writer.commands)
+    return CompileResult(None, report, None if write else vm_writer.commands,
+                         profile if options.profile else None, costs,
+                         ProjectIndex.entry(signatures, vm_writer.commands))
+
+
+def jack_files(directory):
+    return [directory + '/' + file for file in sorted(os.listdir(directory)) if file.endswith('.jack')]
+
+
+# .vm and .vmb files with no .jack source among files, such as the OS classes
+def library_files(directory, files):
+    compiled = {os.path.basename(file)[:-len('.jack')] for file in files}
+    return [file for file in vm_files(directory) if os.path.splitext(os.path.basename(file))[0] not in compiled]
+
+
+def compile_files(files, options=CompileOptions(), jobs=1, write=True):
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as pool:
+            return list(pool.map(try_compile_file, files, [options] * len(files), [write] * len(files)))
+    return [try_compile_file(file, options, write) for file in files]
+
+
+# runs the whole-program passes over every class and optimizes it, writes the .vm files unless write is
+# false, and returns (class name, commands) per class
+def write_whole_program(files, results, options, inliner=None, eliminator=None, write=True, costs=None):
+    programs = [result.commands for result in results]
+    if inliner is not None:
+        programs = inliner.inline(programs)
+    if eliminator is not None:
+        programs = eliminator.eliminate(programs)
+    linked = []
+    for file, result, commands in zip(files, results, programs):
+        start = time.perf_counter()
+        vm_writer = VMWriter(file, options.binary)
+        vm_writer.commands = commands
+        optimize_commands(vm_writer, options, result.report)
+        optimized = time.perf_counter()
+        if write:
+            vm_writer.close()
+            if options.source_map:
+                write_source_map(vm_writer, file)
+        if costs is not None:
+            costs.add(file, vm_writer.commands)
+        if result.profile is not None:
+            result.profile.stages['optimize'] += optimized - start
+            result.profile.stages['output'] += time.perf_counter() - optimized
+        linked.append((os.path.basename(file)[:-len('.jack')], vm_writer.commands))
+    return linked
+
+
+def print_profiles(profiles):
+    columns = Profile.STAGES + ('total',)
+    counters = ('tokens', 'token reads', 'peeks', 'symbol lookups')
+    width = max((len(profile.name) for profile in profiles), default=4)
+    print(f"{'file':<{width}}  " + '  '.join(f"{column + ' ms':>12}" for column in columns)
+          + '  ' + '  '.join(f"{counter:>14}" for counter in counters) + f"  {'instructions':>14}")
+    opcodes = Counter()
+    for profile in profiles:
+        seconds = dict(profile.stages, total=profile.total())
+        print(f"{profile.name:<{width}}  " + '  '.join(f"{seconds[column] * 1000:>12.2f}" for column in columns)
+              + '  ' + '  '.join(f"{profile.counters[counter]:>14}" for counter in counters)
+              + f"  {sum(profile.opcodes.values()):>14}")
+        opcodes.update(profile.opcodes)
+    print('emitted instructions by opcode: ' + ', '.join(f"{op} {count}" for op, count in opcodes.most_common()))
+
+
+def print_report(report):
+    width = max(map(len, report), default=0)
+    for key in sorted(report):
+        print(f"{key:<{width}}  {report[key]}")
+
+
+# Foo.vm.map: the Jack line each line of Foo.vm was generated from
+def write_source_map(vm_writer, root):
+    with open(vm_writer.path + '.map', 'w') as f:
+        json.dump({'version': 1, 'source': os.path.basename(root), 'vm': os.path.basename(vm_writer.path),
+                   'lines': command_lines(vm_writer.commands)}, f, separators=(',', ':'))
+        f.write('\n')
+
+
+class CostReport:
+    OS_CLASSES = frozenset(('Array', 'Keyboard', 'Math', 'Memory', 'Output', 'Screen', 'String', 'Sys'))
+    SOURCE_WIDTH = 60
+
+    def __init__(self):
+        # [VM instructions, OS calls] per (file, line) and per subroutine
+        self.lines = {}
+        self.subroutines = {}
+        self.sources = {}
+
+    def add(self, root, commands):
+        name = os.path.basename(root)
+        with open(root) as f:
+            source = f.read().splitlines()
+        subroutine = None
+        for command, line in zip(commands, command_lines(commands)):
+            if command.op == 'function':
+                subroutine = self.subroutines.setdefault(command.arg1, [0, 0])
+            if command.op == 'label':
+                continue
+            os_call = command.op == 'call' and command.arg1.split('.')[0] in self.OS_CLASSES
+            for cost in (self.lines.setdefault((name, line), [0, 0]), subroutine):
+                if cost is not None:
+                    cost[0] += 1
+                    cost[1] += os_call
+            if line is not None:
+                self.sources[name, line] = source[line - 1].strip()
+
+    def update(self, other):
+        for mine, theirs in ((self.lines, other.lines), (self.subroutines, other.subroutines)):
+            for key, (instructions, os_calls) in theirs.items():
+                cost = mine.setdefault(key, [0, 0])
+                cost[0] += instructions
+                cost[1] += os_calls
+        self.sources.update(other.sources)
+
+    @staticmethod
+    def table(title, costs, describe, top):
+        rows = sorted(costs.items(), key=lambda item: (-item[1][0], -item[1][1], str(item[0])))
+        lines = [f"{title}:", f"  {'instructions':>12}  {'OS calls':>8}"]
+        for key, (instructions, os_calls) in rows[:top]:
+            lines.append(f"  {instructions:>12}  {os_calls:>8}  {describe(key)}")
+        return lines
+
+    def describe_line(self, key):
+        name, line = key
+        source = self.sources.get(key, '')
+        if len(source) > self.SOURCE_WIDTH:
+            source = source[:self.SOURCE_WIDTH - 3] + '...'
+        return f"{name}:{line if line is not None else '?'}  {source}"
+
+    def format(self, top=20):
+        return '\n'.join(self.table('cost by line', self.lines, self.describe_line, top)
+                         + self.table('cost by subroutine', self.subroutines, str, top))
+
+
+# the modules the compiler imports from this project; editing any of them changes the output
+COMPILER_MODULES = ('HackBackend', 'VMBytecode', 'VMEmulator')
+
+
+def compiler_version():
+    digest = hashlib.sha256()
+    for path in [__file__] + [sys.modules[name].__file__ for name in COMPILER_MODULES]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    MANIFEST = '.jackbuild.json'
+
+    def __init__(self, directory, options='', extension='.vm'):
+        self.path = os.path.join(directory, self.MANIFEST)
+        self.extension = extension
+        self.compiler = compiler_version() + options
+        self.hits = 0
+        self.misses = 0
+        self.rechecked = 0
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def source_hash(root):
+        with open(root, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def is_fresh(self, root, digest):
+        entry = self.entries.get(os.path.basename(root))
+        fresh = entry is not None and entry['source'] == digest and entry['compiler'] == self.compiler \
+            and os.path.exists(root.replace('.jack', self.extension))
+        if fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return fresh
+
+    # fresh classes that were recompiled anyway because a subroutine they call changed its signature
+    def recheck(self, count):
+        self.hits -= count
+        self.rechecked += count
+
+    def record(self, root, digest):
+        self.entries[os.path.basename(root)] = {'source': digest, 'compiler': self.compiler}
+
+    def forget(self, root):
+        self.entries.pop(os.path.basename(root), None)
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+    def __str__(self):
+        return f"cache: {self.hits} hits, {self.misses} misses, {self.rechecked} rechecked"
+
+
+# per class, the signature (kind, parameter count) of each subroutine and the calls each subroutine
+# makes, kept between builds so that callers can be found without reparsing and the classes calling a
+# changed signature can be recompiled and rechecked
+class ProjectIndex:
+    INDEX = '.jackindex.json'
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.INDEX)
+        self.exists = os.path.exists(self.path)
+        self.changed = set()
+        self.rechecked = 0
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            self.classes = index['classes'] if index['version'] == self.VERSION else {}
+        except (OSError, ValueError, KeyError, TypeError):
+            self.classes = {}
+
+    @staticmethod
+    def entry(signatures, commands):
+        calls = {}
+        callees = None
+        for command in commands:
+            if command.op == 'function':
+                callees = calls.setdefault(command.arg1.split('.', 1)[1], set())
+            elif command.op == 'call' and callees is not None:
+                callees.add((command.arg1, command.arg2))
+        return {'subroutines': {name: list(signature) for name, signature in signatures.items()},
+                'calls': {caller: sorted(map(list, callees)) for caller, callees in calls.items()}}
+
+    # stores the entries of recompiled classes and drops the classes not in present; returns the
+    # Class.subroutine names whose signature changed, appeared or disappeared
+    def update(self, entries, present):
+        changed = set()
+        for class_name in set(self.classes) - set(present):
+            changed.update(f"{class_name}.{name}" for name in self.classes.pop(class_name)['subroutines'])
+        for class_name, entry in entries.items():
+            old = self.classes.get(class_name, {'subroutines': {}})['subroutines']
+            new = entry['subroutines']
+            changed.update(f"{class_name}.{name}" for name in old.keys() | new.keys() if old.get(name) != new.get(name))
+            self.classes[class_name] = entry
+        self.changed |= changed
+        return changed
+
+    # the classes that call any of the Class.subroutine names
+    def dependents(self, names):
+        return {class_name for class_name, entry in self.classes.items()
+                if any(callee in names for callees in entry['calls'].values() for callee, _ in callees)}
+
+    # (caller, callee, arguments) for every call to name, a class or Class.subroutine
+    def callers(self, name):
+        return [(f"{class_name}.{caller}", callee, arguments)
+                for class_name, entry in sorted(self.classes.items())
+                for caller, callees in sorted(entry['calls'].items())
+                for callee, arguments in callees if name in (callee, callee.split('.')[0])]
+
+    # (caller, callee, arguments) for every call made by name, a class or Class.subroutine
+    def callees(self, name):
+        class_name, _, subroutine = name.partition('.')
+        calls = self.classes.get(class_name, {'calls': {}})['calls']
+        return [(f"{class_name}.{caller}", callee, arguments)
+                for caller, callees in sorted(calls.items()) if subroutine in ('', caller)
+                for callee, arguments in callees]
+
+    # calls made by class_name that do not fit the signature of a subroutine in the project; calls
+    # into classes outside it, such as the OS, are not checked
+    def check(self, class_name):
+        problems = []
+        for caller, callee, arguments in self.callees(class_name):
+            callee_class, _, subroutine = callee.partition('.')
+            if callee_class not in self.classes:
+                continue
+            signature = self.classes[callee_class]['subroutines'].get(subroutine)
+            if signature is None:
+                problems.append(f"{caller} calls {callee}, which is not defined")
+                continue
+            kind, parameters = signature
+            expected = parameters + (kind == 'method')
+            if arguments != expected:
+                problems.append(f"{caller} calls {callee} with {arguments} arguments, but {kind} {callee} "
+                                f"takes {expected}" + (" counting this" if kind == 'method' else ''))
+        return problems
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({'version': self.VERSION, 'classes': self.classes}, f, indent=1, sort_keys=True)
+
+    def __str__(self):
+        return f"index: {len(self.changed)} signatures changed, {self.rechecked} dependents recompiled"
+
+
+def print_calls(calls):
+    for caller, callee, arguments in calls:
+        print(f"{caller} -> {callee} ({arguments} arguments)")
+
+
+def compile_stream(infile, outfile, options=CompileOptions()):
+    peephole = PeepholeOptimizer() if options.optimize else None
+    flow = FlowOptimizer() if options.cfg else None
+    packer = LocalPacker() if options.pack_locals else None
+    vm_writer = StreamingVMWriter(outfile, [optimizer for optimizer in (peephole, flow, packer)
+                                            if optimizer is not None])
+    agent = StreamingAgent(Tokenizer.stream(infile), vm_writer, fold=options.optimize,
+                           pool_strings=options.pool_strings)
+    agent.compile_class()
+    vm_writer.close()
+    report = Counter(agent.report)
+    if peephole is not None:
+        for rule, removed in peephole.removed.items():
+            report[f"peephole {rule}: instructions removed"] += removed
+    if flow is not None:
+        for name, count in flow.counts.items():
+            report[f"cfg: {name}"] += count
+    if packer is not None:
+        report["pack locals: local slots removed"] += packer.removed
+        report["pack locals: functions shrunk"] += packer.functions
+    return report
+
+
+# a request the server could not answer; kind is 'request' for a malformed request, 'io' when the file
+# cannot be read and 'compile' when the source does not compile
+class RequestError(Exception):
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+class CompileServer:
+    MAX_CACHED = 1024
+
+    def __init__(self, source, options=CompileOptions(), poll=1.0):
+        self.source = source
+        self.options = options
+        self.poll = poll
+        self.mtimes = {}
+        self.cached = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def log(self, message):
+        print(message, file=sys.stderr, flush=True)
+
+    def watched_files(self):
+        if os.path.isdir(self.source):
+            return jack_files(self.source)
+        return [self.source] if self.source.endswith('.jack') else []
+
+    # recompiles every watched class whose mtime changed since the last scan
+    def scan(self):
+        for file in self.watched_files():
+            try:
+                mtime = os.stat(file).st_mtime_ns
+            except OSError:
+                continue
+            if self.mtimes.get(file) == mtime:
+                continue
+            self.mtimes[file] = mtime
+            result = try_compile_file(file, self.options)
+            self.log(result.error if result.error is not None else f"compiled {file}")
+
+    def watch(self):
+        while not self.stopped.wait(self.poll):
+            self.scan()
+
+    def compile_cached(self, source):
+        with self.lock:
+            vm = self.cached.get(source)
+        if vm is None:
+            try:
+                vm = compile_source(source, self.options)
+            except CompileError as e:
+                raise RequestError('compile', str(e)) from None
+            except Exception as e:
+                raise RequestError('compile', f"{type(e).__name__}: {e}") from None
+            with self.lock:
+                if len(self.cached) >= self.MAX_CACHED:
+                    del self.cached[next(iter(self.cached))]
+                self.cached[source] = vm
+        return vm
+
+    # compiles in memory: a path request reads the file but never writes next to it
+    def compile_request(self, request):
+        if 'source' in request:
+            source = request['source']
+            if not isinstance(source, str):
+                raise RequestError('request', '"source" must be a string')
+        elif 'path' in request:
+            path = request['path']
+            if not isinstance(path, str) or not path.endswith('.jack'):
+                raise RequestError('request', '"path" must name a .jack file')
+            try:
+                with open(path) as f:
+                    source = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                raise RequestError('io', f"{path}: {e}") from None
+        else:
+            raise RequestError('request', 'a request needs "source" or "path"')
+        return self.compile_cached(source)
+
+    @staticmethod
+    def error(kind, message):
+        return {'ok': False, 'error': {'kind': kind, 'message': message}}
+
+    def handle(self, request):
+        response = {'id': request.get('id')}
+        try:
+            if request.get('command') == 'shutdown':
+                self.stopped.set()
+                response['ok'] = True
+            else:
+                response['vm'] = self.compile_request(request)
+                response['ok'] = True
+        except RequestError as e:
+            response.update(self.error(e.kind, str(e)))
+        except Exception as e:
+            response.update(self.error('internal', f"{type(e).__name__}: {e}"))
+        return response
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return dict(id=None, **self.error('request', f"invalid JSON: {e}"))
+        if not isinstance(request, dict):
+            return dict(id=None, **self.error('request', 'expected a JSON object'))
+        return self.handle(request)
+
+    def serve_stream(self, infile, outfile):
+        for line in infile:
+            if line.strip():
+                outfile.write(json.dumps(self.handle_line(line)) + '\n')
+                outfile.flush()
+            if self.stopped.is_set():
+                break
+
+    def serve_socket(self, path):
+        compile_server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if line.strip():
+                        self.wfile.write((json.dumps(compile_server.handle_line(line)) + '\n').encode())
+                    if compile_server.stopped.is_set():
+                        break
+
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.log(f"listening on {path}")
+            try:
+                self.stopped.wait()
+            except KeyboardInterrupt:
+                pass
+            server.shutdown()
+        os.unlink(path)
+
+    def serve(self, socket_path=None):
+        self.scan()
+        threading.Thread(target=self.watch, daemon=True).start()
+        try:
+            if socket_path is not None:
+                self.serve_socket(socket_path)
+            else:
+                self.serve_stream(sys.stdin, sys.stdout)
+        finally:
+            self.stopped.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile Jack source files to VM code.')
+    parser.add_argument('source', help="a .jack file, a directory of .jack files, or '-' to compile stdin to stdout")
+    parser.add_argument('--xml', action='store_true', help='also write the token stream to <name>T.xml')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of files to compile in parallel (default: number of cores)')
+    parser.add_argument('-O', '--optimize', action='store_true', help='fold constant expressions and run the peephole optimizer on the VM code')
+    parser.add_argument('--cfg', action='store_true',
+                        help='rebuild each function from basic blocks: invert branches to fall through, thread '
+                             'jumps to jumps, move loop tests to the bottom and drop unreachable code')
+    parser.add_argument('--pack-locals', action='store_true',
+                        help='let locals whose lifetimes do not overlap share a slot, shrinking each function frame')
+    parser.add_argument('--pool-strings', action='store_true',
+                        help='build each string literal once per class and reuse it (literals must not be mutated or disposed)')
+    parser.add_argument('--whole-program', action='store_true',
+                        help='drop subroutines that are unreachable from Main.main across all compiled classes')
+    parser.add_argument('--inline', action='store_true',
+                        help='replace calls to small leaf subroutines with their bodies across all compiled classes')
+    parser.add_argument('--inline-threshold', type=int, default=8, metavar='N',
+                        help='with --inline, the largest body to inline, in VM instructions (default: 8)')
+    parser.add_argument('--target', choices=('vm', 'asm'), default='vm',
+                        help="'asm' links every class, plus the other .vm files in the directory (such as the OS), "
+                             "into one bootstrapped Hack .asm program")
+    parser.add_argument('--run', action='store_true',
+                        help='run the compiled program (with the other .vm files in the directory) in the VM '
+                             'emulator and print its output and executed instruction counts')
+    parser.add_argument('--format', choices=('text', 'binary'), default='text',
+                        help="'binary' writes packed <name>.vmb bytecode instead of .vm text "
+                             "(see VMBytecode.py to convert between them)")
+    parser.add_argument('--ast', action='store_true',
+                        help='parse each class into an AST first and generate code from the tree')
+    parser.add_argument('--ast-cache', metavar='DIR',
+                        help='with --ast, reuse parsed classes stored in DIR, keyed by a hash of the source')
+    parser.add_argument('--report', action='store_true', help='print statistics from the optimization passes')
+    parser.add_argument('--source-map', action='store_true',
+                        help='also write <name>.vm.map, giving the Jack line each VM line came from')
+    parser.add_argument('--cost-report', action='store_true',
+                        help='list the Jack lines and subroutines that generate the most VM instructions and OS calls')
+    parser.add_argument('--cost-top', type=int, default=20, metavar='N',
+                        help='with --cost-report, the number of lines and subroutines to list (default: 20)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print per-file stage timings and hot-path counters')
+    parser.add_argument('--profile-json', metavar='FILE', help='write the --profile data as JSON to FILE')
+    parser.add_argument('--stream', action='store_true',
+                        help='tokenize and write a single file incrementally, in memory bounded by its largest subroutine')
+    parser.add_argument('--serve', action='store_true',
+                        help='stay running: recompile changed classes in source and answer JSON-line compile '
+                             'requests on stdin/stdout (or --socket)')
+    parser.add_argument('--socket', metavar='PATH', help='with --serve, listen on this Unix socket instead of stdin')
+    parser.add_argument('--poll', type=float, default=1.0, help='with --serve, seconds between mtime scans')
+    parser.add_argument('--force', action='store_true', help='recompile every file, ignoring the build cache')
+    parser.add_argument('--cache-stats', action='store_true',
+                        help='print build cache hits and misses and the dependents recompiled after signature changes')
+    parser.add_argument('--who-calls', metavar='NAME',
+                        help='list the calls to NAME (a class or Class.subroutine) from the project index and exit')
+    parser.add_argument('--calls', metavar='NAME',
+                        help='list the calls made by NAME (a class or Class.subroutine) from the project index and exit')
+    args = parser.parse_args()
+    profiling = args.profile or args.profile_json is not None
+    options = CompileOptions(xml=args.xml, optimize=args.optimize, pool_strings=args.pool_strings, profile=profiling,
+                             ast=args.ast or args.ast_cache is not None, ast_cache=args.ast_cache,
+                             pack_locals=args.pack_locals, source_map=args.source_map, cost_report=args.cost_report,
+                             binary=args.format == 'binary', cfg=args.cfg)
+
+    if (args.target == 'asm' or args.run) and (args.serve or args.stream or args.source == '-'):
+        parser.error('--target=asm and --run need a .jack file or a directory')
+    if options.binary and (args.stream or args.source == '-'):
+        parser.error('--format=binary needs a .jack file or a directory')
+    if (args.source_map or args.cost_report) and (options.ast or args.stream or args.source == '-'):
+        parser.error('--source-map and --cost-report need token positions, which --ast, --stream and stdin '
+                     'input do not keep')
+    if (profiling or args.whole_program or args.inline) and (args.stream or args.source == '-'):
+        parser.error('--profile, --whole-program and --inline need a .jack file or a directory')
+    if args.stream and os.path.isdir(args.source):
+        parser.error('--stream needs a .jack file')
+
+    if args.who_calls or args.calls:
+        if not os.path.isdir(args.source):
+            parser.error('--who-calls and --calls need a directory')
+        index = ProjectIndex(args.source)
+        if not index.exists:
+            print(f"{args.source}: no project index yet, compile the directory first", file=sys.stderr)
+            return 1
+        print_calls(index.callers(args.who_calls) if args.who_calls else index.callees(args.calls))
+        return 0
+
+    if args.serve:
+        CompileServer(args.source, options, args.poll).serve(args.socket)
+        return 0
+
+    if args.source == '-' or args.stream:
+        try:
+            if args.source == '-':
+                report = compile_stream(sys.stdin, sys.stdout, options)
+            else:
+                with open(args.source) as infile, open(args.source.replace('.jack', '.vm'), 'w') as outfile:
+                    report = compile_stream(infile, outfile, options)
+        except Exception as e:
+            print(f"{args.source}: {type(e).__name__}: {e}", file=sys.stderr)
+            return 1
+        if args.report:
+            print_report(report)
+        return 0
+
+    whole_program = args.whole_program or args.inline or args.target == 'asm' or args.run
+    cache = None
+    index = None
+    if os.path.isdir(args.source):
+        files = jack_files(args.source)
+        classes = {file: os.path.basename(file)[:-len('.jack')] for file in files}
+        index = ProjectIndex(args.source)
+    else:
+        files = [args.source]
+    if index is not None and not whole_program:
+        cache = BuildCache(args.source, repr(tuple(options)), '.vmb' if options.binary else '.vm')
+        digests = {file: cache.source_hash(file) for file in files}
+        # the cost report covers every class, so nothing can be skipped
+        if not args.force and not args.cost_report:
+            # a class missing from the index, as when the index was lost, is compiled again to fill it in
+            unindexed = {file for file in files if classes[file] not in index.classes}
+            cache.misses += len(unindexed)
+            files = [file for file in files if file in unindexed or not cache.is_fresh(file, digests[file])]
+        else:
+            cache.misses = len(files)
+
+    results = compile_files(files, options, args.jobs, write=not whole_program)
+
+    # classes calling a subroutine whose signature changed are recompiled so that their calls get rechecked
+    if index is not None:
+        changed = index.update({classes[file]: result.index for file, result in zip(files, results)
+                                if result.error is None}, classes.values())
+        affected = index.dependents(changed)
+        dependents = [file for file in classes if classes[file] in affected and file not in files]
+        if dependents:
+            rechecked = compile_files(dependents, options, args.jobs, write=not whole_program)
+            index.update({classes[file]: result.index for file, result in zip(dependents, rechecked)
+                          if result.error is None}, classes.values())
+            index.rechecked = len(dependents)
+            if cache is not None:
+                cache.recheck(len(dependents))
+            files += dependents
+            results += rechecked
+        # every indexed class is checked, not only the recompiled ones, so warnings persist until fixed;
+        # a class that failed to compile has already reported its error
+        failed = {file for file, result in zip(files, results) if result.error is not None}
+        for file in classes:
+            if file not in failed and classes[file] in index.classes:
+                for problem in index.check(classes[file]):
+                    print(f"{file}: warning: {problem}", file=sys.stderr)
+        index.save()
+    errors = [result.error for result in results if result.error is not None]
+
+    inliner = Inliner(args.inline_threshold) if args.inline else None
+    eliminator = DeadCodeEliminator() if args.whole_program else None
+    costs = CostReport() if args.cost_report else None
+    linked = None
+    if whole_program and not errors:
+        linked = write_whole_program(files, results, options, inliner, eliminator, write=args.target == 'vm',
+                                     costs=costs)
+        if eliminator is not None and eliminator.skipped:
+            print(f"{args.source}: warning: no Main.main or Sys.init to start from, "
+                  f"so --whole-program removed no subroutines", file=sys.stderr)
+        if os.path.isdir(args.source):
+            linked += read_vm_files(library_files(args.source, files))
+
+    asm = None
+    if linked is not None and args.target == 'asm':
+        asm = translate(linked)
+        if os.path.isdir(args.source):
+            asm_path = os.path.join(args.source, os.path.basename(os.path.abspath(args.source)) + '.asm')
+        else:
+            asm_path = args.source.replace('.jack', '.asm')
+        with open(asm_path, 'w') as f:
+            f.write(asm.text())
+
+    if linked is not None and args.run:
+        emulator = VMEmulator(linked)
+        start = time.perf_counter()
+        try:
+            emulator.run()
+        except VMError as e:
+            errors.append(f"{args.source}: run: {e}")
+        print_run(emulator, time.perf_counter() - start)
+
+    if cache is not None:
+        for file, result in zip(files, results):
+            if result.error is None:
+                cache.record(file, digests[file])
+            else:
+                cache.forget(file)
+        cache.save()
+        if args.cache_stats:
+            print(cache)
+            print(index)
+
+    if args.report:
+        print_report(sum((result.report for result in results), Counter()))
+        if inliner is not None and not errors:
+            print(inliner)
+        if eliminator is not None and not errors:
+            print(eliminator)
+        if asm is not None:
+            print(asm)
+
+    if costs is not None:
+        for result in results:
+            if result.costs is not None:
+                costs.update(result.costs)
+        print(costs.format(args.cost_top))
+
+    profiles = [result.profile for result in results if result.profile is not None]
+    if args.profile:
+        print_profiles(profiles)
+    if args.profile_json:
+        with open(args.profile_json, 'w') as f:
+            json.dump([profile.as_dict() for profile in profiles], f, indent=1)
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    return 1 if errors else 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
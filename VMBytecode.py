@@ -0,0 +1,160 @@
+import argparse
+import os
+import struct
+import sys
+from array import array
+
+# a .vmb file: the header, the string table (every function and label name, joined by newlines), then
+# one column per field of the instructions: opcodes as bytes, first operands (a segment or a string
+# table index) as 16-bit words, or 32-bit words once there are too many names, and second operands as
+# 16-bit words, all little-endian
+MAGIC = b'JVMB'
+VERSION = 1
+HEADER = struct.Struct('<4sHcII')
+
+OPCODES = ('push', 'pop', 'add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not',
+           'label', 'goto', 'if-goto', 'function', 'call', 'return')
+SEGMENTS = ('constant', 'argument', 'local', 'static', 'this', 'that', 'pointer', 'temp')
+OPCODE_IDS = {op: code for code, op in enumerate(OPCODES)}
+SEGMENT_IDS = {segment: code for code, segment in enumerate(SEGMENTS)}
+
+# per opcode: whether the first operand is a segment or a name, and whether there is a second operand
+SEGMENT_OPERAND = frozenset(('push', 'pop'))
+NAME_OPERAND = frozenset(('label', 'goto', 'if-goto', 'function', 'call'))
+COUNT_OPERAND = frozenset(('push', 'pop', 'function', 'call'))
+
+
+# (op, arg1, arg2) tuples, with None for missing operands
+def parse_vm(text):
+    commands = []
+    for line in text.splitlines():
+        words = line.split('//')[0].split()
+        if len(words) == 3:
+            words[2] = int(words[2])
+        if words:
+            commands.append(tuple(words) + (None,) * (3 - len(words)))
+    return commands
+
+
+def encode(commands):
+    strings = {}
+    ops = array('B')
+    first = array('I')
+    second = array('H')
+    for op, arg1, arg2 in commands:
+        if op not in OPCODE_IDS:
+            raise ValueError(f"unknown VM command {op}")
+        ops.append(OPCODE_IDS[op])
+        if op in SEGMENT_OPERAND:
+            first.append(SEGMENT_IDS[arg1])
+        elif op in NAME_OPERAND:
+            first.append(strings.setdefault(arg1, len(strings)))
+        else:
+            first.append(0)
+        second.append(arg2 if op in COUNT_OPERAND else 0)
+    if len(strings) <= 0x10000:
+        first = array('H', first)
+    if sys.byteorder == 'big':
+        first.byteswap()
+        second.byteswap()
+    table = '\n'.join(strings).encode()
+    header = HEADER.pack(MAGIC, VERSION, first.typecode.encode(), len(table), len(ops))
+    return header + table + ops.tobytes() + first.tobytes() + second.tobytes()
+
+
+# the columns of a .vmb file, loaded straight from its bytes
+class Bytecode:
+    def __init__(self, data):
+        if len(data) < HEADER.size:
+            raise ValueError('not a VM bytecode file')
+        magic, version, width, table_size, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or width not in (b'H', b'I'):
+            raise ValueError('not a VM bytecode file')
+        view = memoryview(data)
+        offset = HEADER.size
+        self.strings = bytes(view[offset:offset + table_size]).decode().split('\n') if table_size else []
+        offset += table_size
+        self.ops = array('B')
+        self.first = array(width.decode())
+        self.second = array('H')
+        for column in (self.ops, self.first, self.second):
+            size = count * column.itemsize
+            if offset + size > len(data):
+                raise ValueError('truncated VM bytecode file')
+            column.frombytes(view[offset:offset + size])
+            offset += size
+        if sys.byteorder == 'big':
+            self.first.byteswap()
+            self.second.byteswap()
+
+    def __len__(self):
+        return len(self.ops)
+
+    # (op, arg1, arg2) tuples, as parse_vm returns them
+    def commands(self):
+        strings = self.strings
+        commands = []
+        for code, first, second in zip(self.ops, self.first, self.second):
+            op = OPCODES[code]
+            if op in SEGMENT_OPERAND:
+                commands.append((op, SEGMENTS[first], second))
+            elif op in NAME_OPERAND:
+                commands.append((op, strings[first], second if op in COUNT_OPERAND else None))
+            else:
+                commands.append((op, None, None))
+        return commands
+
+
+def read_bytecode(path):
+    with open(path, 'rb') as f:
+        return Bytecode(f.read())
+
+
+def write_bytecode(path, commands):
+    with open(path, 'wb') as f:
+        f.write(encode(commands))
+
+
+def text(commands):
+    return ''.join(' '.join(str(word) for word in command if word is not None) + '\n' for command in commands)
+
+
+# converts path, a .vm or .vmb file, to the other format; returns the path written
+def convert(path):
+    root, extension = os.path.splitext(path)
+    if extension == '.vmb':
+        output = root + '.vm'
+        with open(output, 'w') as f:
+            f.write(text(read_bytecode(path).commands()))
+    else:
+        output = root + '.vmb'
+        with open(path) as f:
+            write_bytecode(output, parse_vm(f.read()))
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert between .vm text and .vmb bytecode.')
+    parser.add_argument('source', help='a .vm or .vmb file, or a directory')
+    parser.add_argument('--to', choices=('binary', 'text'), default='binary',
+                        help='with a directory, convert every .vm file to .vmb (binary) or every .vmb file '
+                             'to .vm (text); a file is always converted to the other format')
+    args = parser.parse_args()
+    if os.path.isdir(args.source):
+        extension = '.vm' if args.to == 'binary' else '.vmb'
+        files = [os.path.join(args.source, file) for file in sorted(os.listdir(args.source))
+                 if file.endswith(extension)]
+    else:
+        files = [args.source]
+    for file in files:
+        try:
+            output = convert(file)
+        except (OSError, ValueError, KeyError, OverflowError) as e:
+            print(f"{file}: {type(e).__name__}: {e}", file=sys.stderr)
+            return 1
+        print(f"{file} -> {output}: {os.path.getsize(file)} -> {os.path.getsize(output)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,567 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from HackBackend import read_vm_files, vm_files
+
+SP, LCL, ARG, THIS, THAT = range(5)
+TEMP_BASE = 5
+STATIC_BASE = 16
+STATIC_END = 256
+STACK_BASE = 256
+HEAP_BASE = 2048
+HEAP_END = 16384
+RAM_SIZE = 32768
+# return address of the bootstrap frame
+HALT = -1
+
+NEW_LINE = 128
+BACKSPACE = 129
+
+
+def to_word(value):
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+# native OS subroutines do not run as VM code, so their cost is not in the counts
+NATIVE_CALL_NOTE = 'each native OS call counts as one instruction, however much work it does'
+
+
+class VMError(Exception):
+    pass
+
+
+class Halt(Exception):
+    pass
+
+
+def check_address(address):
+    if not 0 <= address < RAM_SIZE:
+        raise VMError(f"address {address} out of range")
+    return address
+
+
+# executes VM code, given as (name, commands) per class; every command is turned into a closure with its
+# operands already resolved, so running is a loop of handlers[pc](pc) calls, each returning the next pc
+class VMEmulator:
+    BINARY = {
+        'add': lambda x, y: to_word(x + y),
+        'sub': lambda x, y: to_word(x - y),
+        'and': lambda x, y: x & y,
+        'or': lambda x, y: x | y,
+        'eq': lambda x, y: -(x == y),
+        'gt': lambda x, y: -(x > y),
+        'lt': lambda x, y: -(x < y),
+    }
+
+    POINTERS = {'local': LCL, 'argument': ARG, 'this': THIS, 'that': THAT}
+
+    # OS subroutines run natively unless the program supplies its own
+    NATIVES = {
+        'Math.multiply': 'math_multiply',
+        'Math.divide': 'math_divide',
+        'Math.abs': 'math_abs',
+        'Math.min': 'math_min',
+        'Math.max': 'math_max',
+        'Math.sqrt': 'math_sqrt',
+        'Memory.alloc': 'memory_alloc',
+        'Memory.deAlloc': 'ignore',
+        'Memory.peek': 'memory_peek',
+        'Memory.poke': 'memory_poke',
+        'Array.new': 'memory_alloc',
+        'Array.dispose': 'ignore',
+        'String.new': 'string_new',
+        'String.dispose': 'ignore',
+        'String.length': 'string_length',
+        'String.charAt': 'string_char_at',
+        'String.setCharAt': 'string_set_char_at',
+        'String.appendChar': 'string_append_char',
+        'String.eraseLastChar': 'string_erase_last_char',
+        'String.newLine': 'string_new_line',
+        'String.backSpace': 'string_backspace',
+        'String.doubleQuote': 'string_double_quote',
+        'Output.printString': 'output_print_string',
+        'Output.printInt': 'output_print_int',
+        'Output.printChar': 'output_print_char',
+        'Output.println': 'output_println',
+        'Output.backSpace': 'output_backspace',
+        'Output.moveCursor': 'ignore',
+        'Sys.halt': 'sys_halt',
+        'Sys.error': 'sys_error',
+        'Sys.wait': 'ignore',
+    }
+
+    def __init__(self, programs):
+        self.ram = [0] * RAM_SIZE
+        self.handlers = []
+        self.opcodes = []
+        self.function_starts = []
+        self.functions = {}
+        self.labels = {}
+        self.statics = {}
+        self.heap = HEAP_BASE
+        self.output = []
+        self.natives = Counter()
+        self.executed = 0
+        self.file = None
+        self.function = None
+        self.builders = {
+            'push': self.build_push,
+            'pop': self.build_pop,
+            'neg': self.build_unary,
+            'not': self.build_unary,
+            'goto': self.build_goto,
+            'if-goto': self.build_if_goto,
+            'function': self.build_function,
+            'call': self.build_call,
+            'return': self.build_return,
+        }
+        for op in self.BINARY:
+            self.builders[op] = self.build_binary
+        self.load(programs)
+        self.counts = [0] * len(self.handlers)
+
+    def load(self, programs):
+        # labels are resolved to the command that follows them and are not executed
+        pc = 0
+        for name, commands in programs:
+            function = None
+            for op, arg1, arg2 in commands:
+                if op == 'function':
+                    function = arg1
+                    self.functions[arg1] = pc
+                    self.function_starts.append((pc, arg1))
+                if op == 'label':
+                    self.labels[function, arg1] = pc
+                else:
+                    pc += 1
+        for name, commands in programs:
+            self.file = name
+            self.function = None
+            for command in commands:
+                if command[0] == 'function':
+                    self.function = command[1]
+                if command[0] == 'label':
+                    continue
+                builder = self.builders.get(command[0])
+                if builder is None:
+                    raise VMError(f"unknown VM command {command[0]}")
+                self.handlers.append(builder(*command))
+                self.opcodes.append(command[0])
+
+    def static_address(self, index):
+        key = (self.file, index)
+        if key not in self.statics:
+            address = STATIC_BASE + len(self.statics)
+            if address >= STATIC_END:
+                raise VMError('too many static variables')
+            self.statics[key] = address
+        return self.statics[key]
+
+    def fixed_address(self, segment, index):
+        if segment == 'temp':
+            return TEMP_BASE + index
+        if segment == 'pointer':
+            return THIS + index
+        if segment == 'static':
+            return self.static_address(index)
+        raise VMError(f"unknown segment {segment}")
+
+    def label(self, name):
+        try:
+            return self.labels[self.function, name]
+        except KeyError:
+            raise VMError(f"{self.function}: undefined label {name}") from None
+
+    def build_push(self, op, segment, index):
+        ram = self.ram
+        if segment == 'constant':
+            def push_constant(pc):
+                sp = ram[SP]
+                ram[sp] = index
+                ram[SP] = sp + 1
+                return pc + 1
+            return push_constant
+        if segment in self.POINTERS:
+            base = self.POINTERS[segment]
+
+            def push_segment(pc):
+                address = ram[base] + index
+                if not 0 <= address < RAM_SIZE:
+                    raise VMError(f"address {address} out of range")
+                sp = ram[SP]
+                ram[sp] = ram[address]
+                ram[SP] = sp + 1
+                return pc + 1
+            return push_segment
+        address = self.fixed_address(segment, index)
+
+        def push_fixed(pc):
+            sp = ram[SP]
+            ram[sp] = ram[address]
+            ram[SP] = sp + 1
+            return pc + 1
+        return push_fixed
+
+    def build_pop(self, op, segment, index):
+        ram = self.ram
+        if segment in self.POINTERS:
+            base = self.POINTERS[segment]
+
+            def pop_segment(pc):
+                address = ram[base] + index
+                if not 0 <= address < RAM_SIZE:
+                    raise VMError(f"address {address} out of range")
+                sp = ram[SP] - 1
+                ram[address] = ram[sp]
+                ram[SP] = sp
+                return pc + 1
+            return pop_segment
+        address = self.fixed_address(segment, index)
+
+        def pop_fixed(pc):
+            sp = ram[SP] - 1
+            ram[address] = ram[sp]
+            ram[SP] = sp
+            return pc + 1
+        return pop_fixed
+
+    def build_binary(self, op, arg1, arg2):
+        ram = self.ram
+        # the most frequent operations skip the call through BINARY
+        if op == 'add':
+            def add(pc):
+                sp = ram[SP] - 1
+                ram[sp - 1] = ((ram[sp - 1] + ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+                ram[SP] = sp
+                return pc + 1
+            return add
+        if op == 'sub':
+            def sub(pc):
+                sp = ram[SP] - 1
+                ram[sp - 1] = ((ram[sp - 1] - ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+                ram[SP] = sp
+                return pc + 1
+            return sub
+        operation = self.BINARY[op]
+
+        def binary(pc):
+            sp = ram[SP] - 1
+            ram[sp - 1] = operation(ram[sp - 1], ram[sp])
+            ram[SP] = sp
+            return pc + 1
+        return binary
+
+    def build_unary(self, op, arg1, arg2):
+        ram = self.ram
+        if op == 'not':
+            def not_(pc):
+                ram[ram[SP] - 1] = ~ram[ram[SP] - 1]
+                return pc + 1
+            return not_
+
+        def neg(pc):
+            ram[ram[SP] - 1] = to_word(-ram[ram[SP] - 1])
+            return pc + 1
+        return neg
+
+    def build_goto(self, op, label, arg2):
+        target = self.label(label)
+
+        def goto(pc):
+            return target
+        return goto
+
+    def build_if_goto(self, op, label, arg2):
+        ram = self.ram
+        target = self.label(label)
+
+        def if_goto(pc):
+            sp = ram[SP] - 1
+            ram[SP] = sp
+            return target if ram[sp] else pc + 1
+        return if_goto
+
+    def build_function(self, op, name, local_count):
+        ram = self.ram
+        zeros = [0] * local_count
+
+        def function(pc):
+            sp = ram[SP]
+            ram[sp:sp + local_count] = zeros
+            ram[SP] = sp + local_count
+            return pc + 1
+        return function
+
+    def build_call(self, op, name, argument_count):
+        ram = self.ram
+        if name not in self.functions and name in self.NATIVES:
+            native = getattr(self, self.NATIVES[name])
+            natives = self.natives
+
+            def call_native(pc):
+                sp = ram[SP] - argument_count
+                natives[name] += 1
+                ram[sp] = to_word(native(*ram[sp:sp + argument_count]))
+                ram[SP] = sp + 1
+                return pc + 1
+            return call_native
+
+        if name not in self.functions:
+            def call_undefined(pc):
+                raise VMError(f"call to undefined function {name}")
+            return call_undefined
+        target = self.functions[name]
+
+        def call(pc):
+            sp = ram[SP]
+            ram[sp:sp + 5] = (pc + 1, ram[LCL], ram[ARG], ram[THIS], ram[THAT])
+            ram[ARG] = sp - argument_count
+            ram[LCL] = ram[SP] = sp + 5
+            return target
+        return call
+
+    def build_return(self, op, arg1, arg2):
+        ram = self.ram
+
+        def return_(pc):
+            frame = ram[LCL]
+            address = ram[frame - 5]
+            argument = ram[ARG]
+            ram[argument] = ram[ram[SP] - 1]
+            ram[SP] = argument + 1
+            ram[LCL], ram[ARG], ram[THIS], ram[THAT] = ram[frame - 4:frame]
+            return address
+        return return_
+
+    # sets up the bootstrap frame for entry, by default Sys.init or else Main.main
+    def start(self, entry=None):
+        if entry is None:
+            entry = 'Sys.init' if 'Sys.init' in self.functions else 'Main.main'
+        if entry not in self.functions:
+            raise VMError(f"no function {entry} to start from")
+        ram = self.ram
+        ram[SP] = STACK_BASE + 5
+        ram[STACK_BASE] = HALT
+        ram[LCL] = ram[SP]
+        ram[ARG] = STACK_BASE
+        return self.functions[entry]
+
+    def run(self, entry=None, limit=None):
+        handlers = self.handlers
+        counts = self.counts
+        pc = self.start(entry)
+        try:
+            if limit is None:
+                while pc >= 0:
+                    counts[pc] += 1
+                    pc = handlers[pc](pc)
+            else:
+                steps = 0
+                while pc >= 0:
+                    if steps == limit:
+                        raise VMError(f"stopped after {limit} instructions")
+                    steps += 1
+                    counts[pc] += 1
+                    pc = handlers[pc](pc)
+        except Halt:
+            pass
+        except IndexError:
+            raise VMError('stack or memory out of range') from None
+        finally:
+            self.executed = sum(counts)
+        return self.executed
+
+    def per_function(self):
+        executed = Counter()
+        starts = self.function_starts + [(len(self.counts), None)]
+        for (start, name), (end, _) in zip(starts, starts[1:]):
+            executed[name] = sum(self.counts[start:end])
+        return +executed
+
+    def per_opcode(self):
+        executed = Counter()
+        for op, count in zip(self.opcodes, self.counts):
+            executed[op] += count
+        return +executed
+
+    def text(self):
+        return ''.join(self.output)
+
+    # native OS subroutines
+    def ignore(self, *args):
+        return 0
+
+    def math_multiply(self, x, y):
+        return x * y
+
+    def math_divide(self, x, y):
+        if y == 0:
+            raise VMError('division by zero')
+        quotient = abs(x) // abs(y)
+        return -quotient if (x < 0) != (y < 0) else quotient
+
+    def math_abs(self, x):
+        return abs(x)
+
+    def math_min(self, x, y):
+        return min(x, y)
+
+    def math_max(self, x, y):
+        return max(x, y)
+
+    def math_sqrt(self, x):
+        if x < 0:
+            raise VMError('square root of a negative number')
+        return int(x ** 0.5)
+
+    # a block of size 0 still gets a word of its own, so that every block has a distinct address
+    def memory_alloc(self, size):
+        if size < 0:
+            raise VMError('allocated memory size must be non-negative')
+        address = self.heap
+        self.heap += max(size, 1)
+        if self.heap > HEAP_END:
+            raise VMError('heap overflow')
+        return address
+
+    def memory_peek(self, address):
+        return self.ram[check_address(address)]
+
+    def memory_poke(self, address, value):
+        self.ram[check_address(address)] = value
+        return 0
+
+    # a string is [max length, length, characters...]
+    def string_new(self, max_length):
+        if max_length < 0:
+            raise VMError('maximum string length must be non-negative')
+        string = self.memory_alloc(max_length + 2)
+        self.ram[string] = max_length
+        self.ram[string + 1] = 0
+        return string
+
+    def string_length(self, string):
+        return self.ram[check_address(string + 1)]
+
+    def string_char_at(self, string, index):
+        return self.ram[check_address(string + 2 + index)]
+
+    def string_set_char_at(self, string, index, char):
+        self.ram[check_address(string + 2 + index)] = char
+        return 0
+
+    def string_append_char(self, string, char):
+        length = self.ram[check_address(string + 1)]
+        if length >= self.ram[string]:
+            raise VMError('string is full')
+        self.ram[string + 2 + length] = char
+        self.ram[string + 1] = length + 1
+        return string
+
+    def string_erase_last_char(self, string):
+        if self.ram[check_address(string + 1)] == 0:
+            raise VMError('string is empty')
+        self.ram[string + 1] -= 1
+        return 0
+
+    def string_new_line(self):
+        return NEW_LINE
+
+    def string_backspace(self):
+        return BACKSPACE
+
+    def string_double_quote(self):
+        return ord('"')
+
+    def output_print_char(self, char):
+        self.output.append('\n' if char == NEW_LINE else chr(char))
+        return 0
+
+    def output_print_string(self, string):
+        for i in range(self.ram[check_address(string + 1)]):
+            self.output_print_char(self.ram[string + 2 + i])
+        return 0
+
+    def output_print_int(self, value):
+        self.output.append(str(value))
+        return 0
+
+    def output_println(self):
+        self.output.append('\n')
+        return 0
+
+    def output_backspace(self):
+        if self.output:
+            self.output.pop()
+        return 0
+
+    def sys_halt(self):
+        raise Halt()
+
+    def sys_error(self, code):
+        raise VMError(f"Sys.error({code})")
+
+    def report(self):
+        return {
+            'instructions': self.executed,
+            'functions': dict(self.per_function().most_common()),
+            'opcodes': dict(self.per_opcode().most_common()),
+            'native calls': dict(self.natives.most_common()),
+            'note': NATIVE_CALL_NOTE,
+        }
+
+
+def print_counts(title, counts, top):
+    print(f"{title}:")
+    width = max((len(name) for name, _ in counts.most_common(top)), default=0)
+    for name, count in counts.most_common(top):
+        print(f"  {name:<{width}}  {count}")
+
+
+def print_run(emulator, seconds, top=20):
+    sys.stdout.write(emulator.text())
+    if emulator.output and not emulator.output[-1].endswith('\n'):
+        print()
+    print(f"executed {emulator.executed} instructions in {seconds:.3f}s "
+          f"({emulator.executed / seconds / 1e6 if seconds else 0:.2f}M/s)")
+    print_counts('instructions by function', emulator.per_function(), top)
+    print_counts('instructions by opcode', emulator.per_opcode(), None)
+    if emulator.natives:
+        print_counts('native OS calls', emulator.natives, None)
+        print(f"  ({NATIVE_CALL_NOTE})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run VM code headlessly and count executed instructions.')
+    parser.add_argument('source', help='a .vm or .vmb file, or a directory of them')
+    parser.add_argument('--entry', help='function to start from (default: Sys.init, or Main.main without it)')
+    parser.add_argument('--limit', type=int, help='stop with an error after this many instructions')
+    parser.add_argument('--top', type=int, default=20, help='functions to list (default: 20)')
+    parser.add_argument('--json', metavar='FILE', help='write the counts as JSON to FILE')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        files = vm_files(args.source)
+    else:
+        files = [args.source]
+    emulator = VMEmulator(read_vm_files(files))
+    start = time.perf_counter()
+    try:
+        emulator.run(args.entry, args.limit)
+    except VMError as e:
+        sys.stdout.write(emulator.text())
+        print(f"\nerror: {e}", file=sys.stderr)
+        return 1
+    print_run(emulator, time.perf_counter() - start, args.top)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(emulator.report(), f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the compiler and its tools are top-level modules in the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
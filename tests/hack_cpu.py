@@ -0,0 +1,85 @@
+# a minimal Hack assembler and CPU, for running the output of HackBackend in tests
+
+BUILTIN = dict({'SP': 0, 'LCL': 1, 'ARG': 2, 'THIS': 3, 'THAT': 4, 'SCREEN': 16384, 'KBD': 24576},
+               **{f'R{i}': i for i in range(16)})
+
+JUMPS = {
+    '': lambda value: False,
+    'JGT': lambda value: value > 0,
+    'JEQ': lambda value: value == 0,
+    'JGE': lambda value: value >= 0,
+    'JLT': lambda value: value < 0,
+    'JNE': lambda value: value != 0,
+    'JLE': lambda value: value <= 0,
+    'JMP': lambda value: True,
+}
+
+
+def to_word(value):
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+def compute(comp, a, d, m):
+    registers = {'A': a, 'D': d, 'M': m, '0': 0, '1': 1}
+    if comp in ('0', '1', '-1'):
+        return int(comp)
+    if len(comp) == 1:
+        return registers[comp]
+    if len(comp) == 2:
+        return ~registers[comp[1]] if comp[0] == '!' else -registers[comp[1]]
+    x, operator, y = registers[comp[0]], comp[1], registers[comp[2]]
+    return {'+': x + y, '-': x - y, '&': x & y, '|': x | y}[operator]
+
+
+# returns the instructions and the symbol table; an A-instruction is an int, a C-instruction a (dest, comp, jump)
+def assemble(text):
+    lines = [line.split('//')[0].strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    symbols = dict(BUILTIN)
+    pc = 0
+    for line in lines:
+        if line.startswith('('):
+            symbols[line[1:-1]] = pc
+        else:
+            pc += 1
+    program = []
+    variable = 16
+    for line in lines:
+        if line.startswith('('):
+            continue
+        if line.startswith('@'):
+            value = line[1:]
+            if not value.isdigit() and value not in symbols:
+                symbols[value] = variable
+                variable += 1
+            program.append(int(value) if value.isdigit() else symbols[value])
+            continue
+        dest, comp = line.split('=', 1) if '=' in line else ('', line)
+        comp, jump = comp.split(';') if ';' in comp else (comp, '')
+        program.append((dest, comp, jump))
+    return program, symbols
+
+
+# runs until the program reaches halt; returns the RAM
+def run(program, halt, limit=1000000):
+    ram = [0] * 32768
+    a = d = pc = 0
+    for _ in range(limit):
+        if pc == halt:
+            return ram
+        instruction = program[pc]
+        if isinstance(instruction, int):
+            a = instruction
+            pc += 1
+            continue
+        dest, comp, jump = instruction
+        value = to_word(compute(comp, a, d, ram[a & 0x7FFF] if 'M' in comp else 0))
+        if 'M' in dest:
+            ram[a & 0x7FFF] = value
+        if 'D' in dest:
+            d = value
+        target = a
+        if 'A' in dest:
+            a = value & 0xFFFF
+        pc = target if JUMPS[jump](value) else pc + 1
+    raise RuntimeError(f"no halt after {limit} instructions")
@@ -0,0 +1,148 @@
+import os
+
+from JackCompiler import CompileOptions, compile_files, compile_source, write_whole_program
+from VMBytecode import parse_vm
+from VMEmulator import VMEmulator
+
+# a program using objects, arrays, strings, nested loops and small leaf subroutines, for checking that
+# optimizations do not change what it prints
+PROGRAM = {
+    'Main': '''class Main {
+    function void main() {
+        var Array a;
+        var Point p, q;
+        var int i, j, t, n, count;
+        let n = 12;
+        let a = Array.new(n);
+        let i = 0;
+        while (i < n) {
+            let a[i] = Main.scramble(i);
+            let i = i + 1;
+        }
+        let i = 0;
+        while (i < n) {
+            let j = 0;
+            while (j < (n - i - 1)) {
+                if (a[j] > a[j + 1]) {
+                    let t = a[j];
+                    let a[j] = a[j + 1];
+                    let a[j + 1] = t;
+                }
+                let j = j + 1;
+            }
+            let i = i + 1;
+        }
+        let i = 0;
+        while (i < n) {
+            do Output.printInt(a[i]);
+            do Output.printChar(32);
+            let i = i + 1;
+        }
+        do Output.println();
+        let p = Point.new(3, -4);
+        let q = Point.new(-32767, 9);
+        do p.add(q);
+        do Output.printString("point ");
+        do p.print();
+        do Output.println();
+        let count = 0;
+        let i = 2;
+        while (i < 60) {
+            if (Main.isPrime(i)) {
+                let count = count + 1;
+            }
+            let i = i + 1;
+        }
+        do Output.printString("primes ");
+        do Output.printInt(count);
+        do Output.println();
+        do a.dispose();
+        return;
+    }
+
+    function int scramble(int i) {
+        return (i * 37) & 63;
+    }
+
+    function boolean isPrime(int n) {
+        var int d;
+        let d = 2;
+        while ((d * d) < (n + 1)) {
+            if (Main.divides(d, n)) {
+                return false;
+            }
+            let d = d + 1;
+        }
+        return true;
+    }
+
+    function boolean divides(int d, int n) {
+        return ((n / d) * d) = n;
+    }
+}
+''',
+    'Point': '''class Point {
+    field int x, y;
+
+    constructor Point new(int ax, int ay) {
+        let x = ax;
+        let y = ay;
+        return this;
+    }
+
+    method int getX() {
+        return x;
+    }
+
+    method int getY() {
+        return y;
+    }
+
+    method void add(Point other) {
+        let x = x + other.getX();
+        let y = y + other.getY();
+        return;
+    }
+
+    method void print() {
+        do Output.printChar(40);
+        do Output.printInt(x);
+        do Output.printChar(44);
+        do Output.printInt(y);
+        do Output.printChar(41);
+        return;
+    }
+}
+''',
+}
+
+PROGRAM_OUTPUT = '0 3 10 13 20 23 30 37 40 47 50 57 \npoint (-32764,5)\nprimes 17\n'
+
+
+def compile_classes(sources, options=CompileOptions()):
+    return [(name, parse_vm(compile_source(source, options))) for name, source in sources.items()]
+
+
+# compiles each class, given by name, and runs the program in the emulator
+def emulate(sources, options=CompileOptions()):
+    emulator = VMEmulator(compile_classes(sources, options))
+    emulator.run(limit=1000000)
+    return emulator
+
+
+# what the program printed
+def run(sources, options=CompileOptions()):
+    return emulate(sources, options).text()
+
+
+# writes the classes to directory and compiles them as one program, the way --whole-program and
+# --inline do, without writing the output; returns the (name, commands) of each class
+def link(directory, sources, options=CompileOptions(), inliner=None, eliminator=None):
+    files = []
+    for name, source in sources.items():
+        files.append(os.path.join(directory, name + '.jack'))
+        with open(files[-1], 'w') as f:
+            f.write(source)
+    results = compile_files(files, options, write=False)
+    assert all(result.error is None for result in results)
+    return write_whole_program(files, results, options, inliner, eliminator, write=False)
@@ -0,0 +1,44 @@
+import os
+
+from JackCompiler import ASTCache, CompileOptions, compile_source, parse_source
+
+from support import PROGRAM, PROGRAM_OUTPUT, run
+
+
+def test_ast_generates_the_same_code():
+    for source in PROGRAM.values():
+        assert compile_source(source, CompileOptions(ast=True)) == compile_source(source)
+        assert compile_source(source, CompileOptions(ast=True, optimize=True)) == \
+            compile_source(source, CompileOptions(optimize=True))
+
+
+def test_ast_program_runs():
+    assert run(PROGRAM, CompileOptions(ast=True)) == PROGRAM_OUTPUT
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ASTCache(str(tmp_path))
+    source = PROGRAM['Point']
+    assert cache.load(source) is None
+    node = parse_source(source, cache)
+    assert os.path.exists(cache.path(source))
+    assert cache.load(source) == node
+    assert parse_source(source, cache) == node
+
+
+def test_cached_tree_is_used(tmp_path):
+    cache = ASTCache(str(tmp_path))
+    main, point = PROGRAM['Main'], PROGRAM['Point']
+    # a cache entry is keyed by the source alone, so swapping entries shows which tree was used
+    cache.store(main, parse_source(point))
+    assert parse_source(main, cache) == parse_source(point)
+
+
+def test_damaged_cache_entry_is_reparsed(tmp_path):
+    cache = ASTCache(str(tmp_path))
+    source = PROGRAM['Point']
+    node = parse_source(source, cache)
+    with open(cache.path(source), 'wb') as f:
+        f.write(b'not a tree')
+    assert cache.load(source) is None
+    assert parse_source(source, cache) == node
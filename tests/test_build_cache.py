@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+MAIN = '''class Main {
+    function void main() {
+        do Foo.bar(1);
+        return;
+    }
+}
+'''
+
+FOO = '''class Foo {
+    function void bar(int x) {
+        return;
+    }
+}
+'''
+
+
+def write(directory, name, source):
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write(source)
+
+
+def build(directory):
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'JackCompiler.py'), str(directory), '--cache-stats'],
+                            capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()[0]
+
+
+def test_unchanged_classes_are_hits(tmp_path):
+    write(tmp_path, 'Main.jack', MAIN)
+    write(tmp_path, 'Foo.jack', FOO)
+    assert build(tmp_path) == 'cache: 0 hits, 2 misses, 0 rechecked'
+    assert build(tmp_path) == 'cache: 2 hits, 0 misses, 0 rechecked'
+
+
+def test_rechecked_dependents_are_not_hits(tmp_path):
+    write(tmp_path, 'Main.jack', MAIN)
+    write(tmp_path, 'Foo.jack', FOO)
+    build(tmp_path)
+    write(tmp_path, 'Foo.jack', FOO.replace('int x', 'int x, int y'))
+    assert build(tmp_path) == 'cache: 0 hits, 1 misses, 1 rechecked'
@@ -0,0 +1,56 @@
+import pytest
+
+from HackBackend import read_vm_files, vm_files
+from JackCompiler import CompileOptions, compile_file
+from VMBytecode import Bytecode, convert, encode, parse_vm, read_bytecode, text
+from VMEmulator import VMEmulator
+
+from support import PROGRAM, PROGRAM_OUTPUT, compile_classes
+
+
+def test_round_trip():
+    for name, commands in compile_classes(PROGRAM, CompileOptions(optimize=True)):
+        assert Bytecode(encode(commands)).commands() == commands
+
+
+def test_text_round_trip():
+    for name, commands in compile_classes(PROGRAM):
+        assert parse_vm(text(commands)) == commands
+
+
+def test_wide_string_table():
+    commands = [('function', f'Main.f{i}', 0) for i in range(0x10001)]
+    data = encode(commands)
+    assert Bytecode(data).first.typecode == 'I'
+    assert Bytecode(data).commands() == commands
+    assert Bytecode(encode(commands[:10])).first.typecode == 'H'
+
+
+def test_damaged_files_are_rejected():
+    data = encode(compile_classes(PROGRAM)[0][1])
+    with pytest.raises(ValueError, match='not a VM bytecode file'):
+        Bytecode(b'JVM')
+    with pytest.raises(ValueError, match='not a VM bytecode file'):
+        Bytecode(b'XXXX' + data[4:])
+    with pytest.raises(ValueError, match='truncated'):
+        Bytecode(data[:-1])
+
+
+def test_binary_format_compiles_and_converts(tmp_path):
+    for name, source in PROGRAM.items():
+        (tmp_path / f'{name}.jack').write_text(source)
+        compile_file(str(tmp_path / f'{name}.jack'), CompileOptions(binary=True))
+    assert sorted(path.name for path in tmp_path.glob('*.vm*')) == ['Main.vmb', 'Point.vmb']
+    binary = read_vm_files(vm_files(str(tmp_path)))
+    assert binary == compile_classes(PROGRAM)
+
+    converted = convert(str(tmp_path / 'Main.vmb'))
+    assert converted == str(tmp_path / 'Main.vm')
+    assert parse_vm((tmp_path / 'Main.vm').read_text()) == read_bytecode(str(tmp_path / 'Main.vmb')).commands()
+
+
+def test_binary_program_runs():
+    programs = [(name, Bytecode(encode(commands)).commands()) for name, commands in compile_classes(PROGRAM)]
+    emulator = VMEmulator(programs)
+    emulator.run()
+    assert emulator.text() == PROGRAM_OUTPUT
@@ -0,0 +1,39 @@
+from JackCompiler import CompileOptions, FlowOptimizer, VMCommand
+
+from support import PROGRAM, PROGRAM_OUTPUT, emulate, run
+from test_peephole import CONDITIONS
+
+CFG = CompileOptions(cfg=True)
+
+
+def test_cfg_program_prints_the_same():
+    assert run(PROGRAM, CFG) == PROGRAM_OUTPUT
+    assert run(PROGRAM, CompileOptions(optimize=True, cfg=True)) == PROGRAM_OUTPUT
+
+
+def test_non_boolean_conditions():
+    assert run(CONDITIONS, CFG) == run(CONDITIONS)
+    assert run(CONDITIONS, CompileOptions(optimize=True, cfg=True)) == run(CONDITIONS)
+
+
+def test_cfg_executes_fewer_jumps():
+    plain = emulate(PROGRAM, CompileOptions(optimize=True))
+    flow = emulate(PROGRAM, CompileOptions(optimize=True, cfg=True))
+    jumps = ('goto', 'if-goto')
+    assert sum(flow.per_opcode()[op] for op in jumps) < sum(plain.per_opcode()[op] for op in jumps)
+    assert flow.executed < plain.executed
+
+
+def test_only_comparisons_are_negated():
+    commands = [VMCommand('function', 'Main.f', 0), VMCommand('push', 'argument', 0), VMCommand('if-goto', 'A'),
+                VMCommand('goto', 'B'), VMCommand('label', 'A'), VMCommand('push', 'constant', 1),
+                VMCommand('return'), VMCommand('label', 'B'), VMCommand('push', 'constant', 2), VMCommand('return')]
+    optimized = FlowOptimizer().optimize(commands)
+    assert VMCommand('not') not in optimized
+    assert optimized.count(VMCommand('return')) == 2
+
+
+def test_unreachable_code_is_dropped():
+    commands = [VMCommand('function', 'Main.f', 0), VMCommand('push', 'constant', 0), VMCommand('return'),
+                VMCommand('push', 'constant', 1), VMCommand('return')]
+    assert FlowOptimizer().optimize(commands) == commands[:3]
@@ -0,0 +1,71 @@
+import io
+import json
+
+from JackCompiler import CompileOptions, CompileServer, compile_source
+
+SOURCE = '''class Main {
+    function int one() {
+        return 1;
+    }
+}
+'''
+
+
+def request(server, line):
+    return server.handle_line(line if isinstance(line, str) else json.dumps(line))
+
+
+def test_source_request():
+    response = request(CompileServer('.'), {'id': 1, 'source': SOURCE})
+    assert response == {'id': 1, 'vm': compile_source(SOURCE), 'ok': True}
+
+
+def test_path_request_does_not_write(tmp_path):
+    path = tmp_path / 'Main.jack'
+    path.write_text(SOURCE)
+    response = request(CompileServer(str(tmp_path)), {'id': 2, 'path': str(path)})
+    assert response['ok'] and response['vm'] == compile_source(SOURCE)
+    assert sorted(file.name for file in tmp_path.iterdir()) == ['Main.jack']
+
+
+def test_path_must_be_jack_source(tmp_path):
+    notes = tmp_path / 'notes.txt'
+    notes.write_text(SOURCE)
+    response = request(CompileServer(str(tmp_path)), {'id': 3, 'path': str(notes)})
+    assert response == {'id': 3, 'ok': False, 'error': {'kind': 'request', 'message': '"path" must name a .jack file'}}
+    assert notes.read_text() == SOURCE
+
+
+def test_bad_requests_get_diagnostics(tmp_path):
+    server = CompileServer(str(tmp_path))
+    assert request(server, 'not json')['error']['kind'] == 'request'
+    assert request(server, '[1]')['error'] == {'kind': 'request', 'message': 'expected a JSON object'}
+    assert request(server, {'id': 4})['error']['kind'] == 'request'
+    assert request(server, {'id': 5, 'source': 7})['error']['kind'] == 'request'
+    assert request(server, {'id': 6, 'path': str(tmp_path / 'Missing.jack')})['error']['kind'] == 'io'
+    response = request(server, {'id': 7, 'source': 'class Main {\n function void f() {\n let x = 1;\n return; } }'})
+    assert response == {'id': 7, 'ok': False, 'error': {'kind': 'compile', 'message': "line 3: undefined variable 'x'"}}
+
+
+def test_undefined_variables_are_compile_errors():
+    server = CompileServer('.')
+    for expression, line in (('y', 3), ('\n y[0]', 4), ('1 +\n\n y', 5)):
+        source = f"class Main {{\n function int f() {{\n return {expression}; }} }}"
+        error = request(server, {'source': source})['error']
+        assert error == {'kind': 'compile', 'message': f"line {line}: undefined variable 'y'"}
+
+
+def test_serve_stream_until_shutdown():
+    lines = [json.dumps({'id': 1, 'source': SOURCE}), json.dumps({'id': 2, 'command': 'shutdown'}),
+             json.dumps({'id': 3, 'source': SOURCE})]
+    output = io.StringIO()
+    CompileServer('.').serve_stream(io.StringIO('\n'.join(lines) + '\n'), output)
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [response['id'] for response in responses] == [1, 2]
+    assert all(response['ok'] for response in responses)
+
+
+def test_undefined_variables_from_the_tree():
+    server = CompileServer('.', CompileOptions(ast=True))
+    error = request(server, {'source': 'class Main { function void f() { let x = 1; return; } }'})['error']
+    assert error == {'kind': 'compile', 'message': "undefined variable 'x'"}
@@ -0,0 +1,45 @@
+from JackCompiler import CompileOptions, compile_source, fold_binary
+
+from support import run
+
+OPTIMIZE = CompileOptions(optimize=True)
+
+ARITHMETIC = {'Main': '''class Main {
+    function void main() {
+        var int x;
+        let x = 7;
+        do Output.printInt(2 * 3 + 4);
+        do Output.printChar(32);
+        do Output.printInt(32767 + 1);
+        do Output.printChar(32);
+        do Output.printInt(-7 / 2);
+        do Output.printChar(32);
+        do Output.printInt((1 < 2) & (3 > 4));
+        do Output.printChar(32);
+        do Output.printInt(x * 8);
+        do Output.printChar(32);
+        do Output.printInt(x * 0 + (x * 1));
+        do Output.printChar(32);
+        do Output.printInt(x * -4);
+        return;
+    }
+}
+'''}
+
+
+def test_folded_results_match_runtime():
+    assert run(ARITHMETIC) == '10 -32768 -3 0 56 7 -28'
+    assert run(ARITHMETIC, OPTIMIZE) == '10 -32768 -3 0 56 7 -28'
+
+
+def test_constants_and_powers_of_two_need_no_multiply():
+    assert 'Math.multiply' in compile_source(ARITHMETIC['Main'])
+    assert 'Math.multiply' not in compile_source(ARITHMETIC['Main'], OPTIMIZE)
+
+
+def test_fold_binary_wraps_to_16_bits():
+    assert fold_binary('+', 32767, 1) == -32768
+    assert fold_binary('*', 300, 300) == 24464
+    assert fold_binary('/', -32768, -1) == -32768
+    assert fold_binary('/', 1, 0) is None
+    assert fold_binary('<', -32768, 5) == -1
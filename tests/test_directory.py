@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+from support import PROGRAM
+
+BROKEN = '''class Broken {
+    function void main() {
+        let missing = 1;
+        return;
+    }
+}
+'''
+
+
+def compile_directory(directory, *args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'JackCompiler.py'), str(directory)] + list(args),
+                          capture_output=True, text=True)
+
+
+def write_program(directory, broken=True):
+    for name, source in PROGRAM.items():
+        (directory / f'{name}.jack').write_text(source)
+    if broken:
+        (directory / 'Broken.jack').write_text(BROKEN)
+
+
+def test_errors_are_collected_with_jobs(tmp_path):
+    write_program(tmp_path)
+    result = compile_directory(tmp_path, '-j', '2')
+    assert result.returncode == 1
+    errors = result.stderr.splitlines()
+    assert errors == [f"{tmp_path}/Broken.jack: line 3: undefined variable 'missing'"]
+    assert sorted(path.name for path in tmp_path.glob('*.vm')) == ['Main.vm', 'Point.vm']
+
+
+def test_parallel_output_matches_serial(tmp_path):
+    serial = tmp_path / 'serial'
+    parallel = tmp_path / 'parallel'
+    for directory in (serial, parallel):
+        directory.mkdir()
+        write_program(directory, broken=False)
+    assert compile_directory(serial, '-j', '1', '--report').returncode == 0
+    assert compile_directory(parallel, '-j', '2', '--report').returncode == 0
+    for name in PROGRAM:
+        assert (serial / f'{name}.vm').read_text() == (parallel / f'{name}.vm').read_text()
+    assert compile_directory(serial, '-j', '1', '--force', '--report').stdout == \
+        compile_directory(parallel, '-j', '2', '--force', '--report').stdout
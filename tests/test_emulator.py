@@ -0,0 +1,57 @@
+import pytest
+
+from VMEmulator import NATIVE_CALL_NOTE, VMEmulator, VMError
+
+from support import PROGRAM, PROGRAM_OUTPUT, compile_classes, emulate
+
+
+def program(*commands):
+    return [('Main', [('function', 'Main.main', 0)] + list(commands) + [('push', 'constant', 0), ('return', None, None)])]
+
+
+def test_program_output_and_counts():
+    emulator = emulate(PROGRAM)
+    assert emulator.text() == PROGRAM_OUTPUT
+    assert sum(emulator.per_function().values()) == emulator.executed
+    assert sum(emulator.per_opcode().values()) == emulator.executed
+    assert emulator.natives['Memory.alloc'] == 2
+
+
+def test_report_documents_native_calls():
+    report = emulate(PROGRAM).report()
+    assert report['instructions'] == sum(report['functions'].values())
+    assert report['note'] == NATIVE_CALL_NOTE
+    assert report['native calls']['Array.new'] == 1
+
+
+@pytest.mark.parametrize('address', [-1, -32768, 32767 + 1])
+def test_out_of_range_address(address):
+    # point that at address - 1 and read that 1
+    if address < 0:
+        setup = [('push', 'constant', -address), ('neg', None, None)]
+    else:
+        setup = [('push', 'constant', 32767), ('push', 'constant', 1), ('add', None, None)]
+    emulator = VMEmulator(program(*setup, ('push', 'constant', 1), ('sub', None, None), ('pop', 'pointer', 1),
+                                  ('push', 'that', 1), ('pop', 'temp', 0)))
+    with pytest.raises(VMError, match='out of range'):
+        emulator.run()
+
+
+def test_out_of_range_poke():
+    emulator = VMEmulator(program(('push', 'constant', 1), ('neg', None, None), ('push', 'constant', 7),
+                                  ('call', 'Memory.poke', 2), ('pop', 'temp', 0)))
+    with pytest.raises(VMError, match='address -1 out of range'):
+        emulator.run()
+
+
+def test_empty_allocations_are_distinct():
+    emulator = VMEmulator(program(('push', 'constant', 0), ('call', 'Memory.alloc', 1), ('pop', 'temp', 0),
+                                  ('push', 'constant', 0), ('call', 'Array.new', 1), ('pop', 'temp', 1)))
+    emulator.run()
+    assert 0 < emulator.ram[5] < emulator.ram[6]
+
+
+def test_instruction_limit():
+    emulator = VMEmulator(compile_classes(PROGRAM))
+    with pytest.raises(VMError, match='stopped after 100 instructions'):
+        emulator.run(limit=100)
@@ -0,0 +1,63 @@
+import pytest
+
+from HackBackend import translate
+from VMEmulator import VMEmulator
+
+import hack_cpu
+
+# operands at and around the 16-bit limits, where x - y overflows
+VALUES = (-32768, -32767, -30000, -1, 0, 1, 5, 30000, 32766, 32767)
+
+
+def push(value):
+    if value == -32768:
+        return [('push', 'constant', 32767), ('neg', None, None), ('push', 'constant', 1), ('sub', None, None)]
+    if value < 0:
+        return [('push', 'constant', -value), ('neg', None, None)]
+    return [('push', 'constant', value)]
+
+
+# x op y for every pair of values, stored to static k; each form leads the backend to a different
+# assembly sequence for the comparison
+def comparisons(op, form):
+    commands = [('function', 'Main.main', 0)]
+    pairs = [(x, y) for x in VALUES for y in VALUES if form != 'push-compare' or y >= 0]
+    for k, (x, y) in enumerate(pairs):
+        commands += push(x)
+        if form == 'push-compare':
+            commands += push(y)
+        else:
+            commands += push(y) + [('push', 'constant', 0), ('add', None, None)]
+        if form in ('plain', 'push-compare'):
+            commands += [(op, None, None), ('pop', 'static', k)]
+            continue
+        commands.append((op, None, None))
+        if form == 'not-branch':
+            commands.append(('not', None, None))
+        commands += [('if-goto', f'TRUE{k}', None), ('push', 'constant', 0), ('pop', 'static', k),
+                     ('goto', f'END{k}', None), ('label', f'TRUE{k}', None), ('push', 'constant', 1),
+                     ('neg', None, None), ('pop', 'static', k), ('label', f'END{k}', None)]
+    commands += [('push', 'constant', 0), ('return', None, None)]
+    return [('Main', commands)], len(pairs)
+
+
+@pytest.mark.parametrize('form', ['plain', 'push-compare', 'branch', 'not-branch'])
+@pytest.mark.parametrize('op', ['eq', 'gt', 'lt'])
+def test_comparisons_match_the_emulator(op, form):
+    programs, count = comparisons(op, form)
+    emulator = VMEmulator(programs)
+    emulator.run()
+    expected = [emulator.ram[emulator.statics['Main', k]] for k in range(count)]
+
+    program, symbols = hack_cpu.assemble(translate(programs).text())
+    ram = hack_cpu.run(program, symbols['$HALT'])
+    assert [ram[symbols[f'Main.{k}']] for k in range(count)] == expected
+
+
+def test_overflowing_comparisons():
+    programs = [('Main', [('function', 'Main.main', 0)] + push(-32768) + push(5) + [('lt', None, None),
+                ('pop', 'static', 0)] + push(30000) + push(-30000) + [('gt', None, None), ('pop', 'static', 1),
+                ('push', 'constant', 0), ('return', None, None)])]
+    program, symbols = hack_cpu.assemble(translate(programs).text())
+    ram = hack_cpu.run(program, symbols['$HALT'])
+    assert (ram[symbols['Main.0']], ram[symbols['Main.1']]) == (-1, -1)
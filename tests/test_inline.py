@@ -0,0 +1,35 @@
+from JackCompiler import CompileOptions, Inliner
+from VMEmulator import VMEmulator
+
+from support import PROGRAM, PROGRAM_OUTPUT, link
+
+
+def execute(programs):
+    emulator = VMEmulator(programs)
+    emulator.run(limit=1000000)
+    return emulator
+
+
+def test_inlined_program_prints_the_same(tmp_path):
+    inliner = Inliner()
+    emulator = execute(link(str(tmp_path), PROGRAM, inliner=inliner))
+    assert emulator.text() == PROGRAM_OUTPUT
+    assert inliner.sites
+
+
+def test_inlining_saves_calls(tmp_path):
+    plain = execute(link(str(tmp_path), PROGRAM))
+    inlined = execute(link(str(tmp_path), PROGRAM, inliner=Inliner()))
+    assert inlined.per_opcode()['call'] < plain.per_opcode()['call']
+    assert inlined.executed < plain.executed
+
+
+def test_inlining_with_other_passes(tmp_path):
+    options = CompileOptions(optimize=True, cfg=True, pack_locals=True)
+    assert execute(link(str(tmp_path), PROGRAM, options, Inliner(threshold=16))).text() == PROGRAM_OUTPUT
+
+
+def test_threshold_limits_inlining(tmp_path):
+    inliner = Inliner(threshold=0)
+    link(str(tmp_path), PROGRAM, inliner=inliner)
+    assert not inliner.sites
@@ -0,0 +1,46 @@
+from JackCompiler import CompileOptions, compile_source
+
+from support import PROGRAM, PROGRAM_OUTPUT, run
+
+PACK = CompileOptions(pack_locals=True)
+
+# a and b are dead once c and d are written; i and total live across the loop; unset is read but never written
+LOCALS = {'Main': '''class Main {
+    function void main() {
+        var int a, b, c, d, i, total, unset;
+        let a = 6;
+        let b = a * 7;
+        do Output.printInt(b);
+        let c = 1;
+        let d = c + 2;
+        do Output.printInt(d);
+        let i = 0;
+        let total = 0;
+        while (i < 4) {
+            let total = total + i;
+            let i = i + 1;
+        }
+        do Output.printInt(total);
+        do Output.printInt(unset);
+        return;
+    }
+}
+'''}
+
+
+def frame_size(vm, name):
+    return next(int(line.split()[2]) for line in vm.splitlines() if line.startswith(f"function {name} "))
+
+
+def test_packed_locals_print_the_same():
+    assert run(LOCALS) == run(LOCALS, PACK) == '42360'
+    assert run(PROGRAM, PACK) == PROGRAM_OUTPUT
+
+
+def test_frame_shrinks():
+    assert frame_size(compile_source(LOCALS['Main']), 'Main.main') == 7
+    assert frame_size(compile_source(LOCALS['Main'], PACK), 'Main.main') == 3
+
+
+def test_single_local_is_left_alone():
+    assert frame_size(compile_source(PROGRAM['Main'], PACK), 'Main.isPrime') == 1
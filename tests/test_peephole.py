@@ -0,0 +1,55 @@
+from JackCompiler import CompileOptions, PeepholeOptimizer, VMCommand, compile_source
+
+from support import run
+
+# branches on values that are neither true (-1) nor false (0)
+CONDITIONS = {'Main': '''class Main {
+    function void main() {
+        var int x, k;
+        let x = 0;
+        while (x < 4) {
+            if (x & 1) {
+                do Output.printInt(x);
+            }
+            if (x) {
+                do Output.printChar(42);
+            }
+            let x = x + 1;
+        }
+        let k = 3;
+        while (k) {
+            let k = k - 1;
+            do Output.printInt(k);
+        }
+        if (~(x = 4)) {
+            do Output.printInt(99);
+        }
+        return;
+    }
+}
+'''}
+
+
+# as with the standard compiler, the loop leaves on ~k, which is nonzero for k = 3, so its body never runs
+def test_non_boolean_conditions():
+    assert run(CONDITIONS) == '1**3*'
+    assert run(CONDITIONS, CompileOptions(optimize=True)) == '1**3*'
+
+
+def test_if_fallthrough_after_comparison():
+    commands = [VMCommand('lt'), VMCommand('if-goto', 'A'), VMCommand('goto', 'B'), VMCommand('label', 'A'),
+                VMCommand('return'), VMCommand('label', 'B')]
+    optimized = PeepholeOptimizer().optimize_function(commands)
+    assert optimized[:3] == [VMCommand('lt'), VMCommand('not'), VMCommand('if-goto', 'B')]
+
+
+def test_if_fallthrough_keeps_other_conditions():
+    commands = [VMCommand('and'), VMCommand('if-goto', 'A'), VMCommand('goto', 'B'), VMCommand('label', 'A'),
+                VMCommand('return'), VMCommand('label', 'B')]
+    assert PeepholeOptimizer().optimize_function(commands) == commands
+
+
+def test_optimize_shrinks_output():
+    plain = compile_source(CONDITIONS['Main'])
+    optimized = compile_source(CONDITIONS['Main'], CompileOptions(optimize=True))
+    assert len(optimized.splitlines()) < len(plain.splitlines())
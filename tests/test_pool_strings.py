@@ -0,0 +1,32 @@
+from JackCompiler import CompileOptions
+
+from support import emulate
+
+GREETINGS = {'Main': '''class Main {
+    function void main() {
+        var int i;
+        let i = 0;
+        while (i < 3) {
+            do Output.printString("ab");
+            let i = i + 1;
+        }
+        do Output.printString("ab");
+        do Output.printString("cd");
+        return;
+    }
+}
+'''}
+
+
+def test_pooled_strings_print_the_same():
+    plain = emulate(GREETINGS)
+    pooled = emulate(GREETINGS, CompileOptions(pool_strings=True))
+    assert plain.text() == pooled.text() == 'ababababcd'
+
+
+def test_each_literal_is_built_once():
+    plain = emulate(GREETINGS)
+    pooled = emulate(GREETINGS, CompileOptions(pool_strings=True))
+    assert plain.natives['String.new'] == 5
+    assert pooled.natives['String.new'] == 2
+    assert pooled.natives['String.appendChar'] == 4
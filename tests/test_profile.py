@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+from JackCompiler import CompileOptions, Profile, try_compile_file
+
+from conftest import ROOT
+from support import PROGRAM
+
+
+def write_program(directory):
+    for name, source in PROGRAM.items():
+        (directory / f'{name}.jack').write_text(source)
+
+
+def test_profile_counters(tmp_path):
+    write_program(tmp_path)
+    result = try_compile_file(str(tmp_path / 'Main.jack'), CompileOptions(profile=True))
+    profile = result.profile
+    assert set(profile.stages) == set(Profile.STAGES)
+    for counter in ('tokens', 'token reads', 'peeks', 'symbol lookups'):
+        assert profile.counters[counter] > 0
+    assert profile.opcodes['function'] == 4
+
+
+def test_profile_json_report(tmp_path):
+    write_program(tmp_path)
+    report = tmp_path / 'profile.json'
+    subprocess.run([sys.executable, os.path.join(ROOT, 'JackCompiler.py'), str(tmp_path), '-j', '1',
+                    '--profile-json', str(report)], check=True, capture_output=True)
+    profiles = json.loads(report.read_text())
+    assert sorted(os.path.basename(profile['file']) for profile in profiles) == ['Main.jack', 'Point.jack']
+    for profile in profiles:
+        assert set(profile['seconds']) == set(Profile.STAGES) | {'total'}
+        assert profile['counters']['tokens'] > 0 and profile['counters']['peeks'] > 0
+        assert profile['opcodes']['return'] > 0
+
+
+def test_profile_is_printed(tmp_path):
+    write_program(tmp_path)
+    output = subprocess.run([sys.executable, os.path.join(ROOT, 'JackCompiler.py'), str(tmp_path), '-j', '1',
+                             '--profile'], check=True, capture_output=True, text=True).stdout
+    assert 'tokenize ms' in output and 'Main.jack' in output
@@ -0,0 +1,143 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+from JackCompiler import ProjectIndex, VMCommand
+
+MAIN = '''class Main {
+    function void main() {
+        do Foo.bar(1);
+        do Output.printInt(Foo.baz());
+        return;
+    }
+}
+'''
+
+FOO = '''class Foo {
+    function void bar(int x) {
+        return;
+    }
+
+    function int baz() {
+        return Foo.qux(2);
+    }
+
+    function int qux(int y) {
+        return y;
+    }
+}
+'''
+
+MAIN_ENTRY = ProjectIndex.entry({'main': ('function', 0)}, [
+    VMCommand('function', 'Main.main', 0), VMCommand('push', 'constant', 1), VMCommand('call', 'Foo.bar', 1),
+    VMCommand('call', 'Foo.baz', 0), VMCommand('call', 'Output.printInt', 1)])
+
+FOO_ENTRY = ProjectIndex.entry({'bar': ('function', 1), 'baz': ('method', 0)}, [
+    VMCommand('function', 'Foo.bar', 0), VMCommand('return'),
+    VMCommand('function', 'Foo.baz', 0), VMCommand('call', 'Foo.bar', 1)])
+
+
+def project_index(tmp_path):
+    index = ProjectIndex(str(tmp_path))
+    index.update({'Main': MAIN_ENTRY, 'Foo': FOO_ENTRY}, ['Main', 'Foo'])
+    return index
+
+
+def jack_compiler(directory, *args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'JackCompiler.py'), str(directory)] + list(args),
+                          capture_output=True, text=True)
+
+
+def write_project(directory):
+    (directory / 'Main.jack').write_text(MAIN)
+    (directory / 'Foo.jack').write_text(FOO)
+
+
+def test_update_returns_changed_signatures(tmp_path):
+    index = ProjectIndex(str(tmp_path))
+    assert index.update({'Main': MAIN_ENTRY, 'Foo': FOO_ENTRY}, ['Main', 'Foo']) == {'Main.main', 'Foo.bar',
+                                                                                    'Foo.baz'}
+    assert index.update({'Foo': FOO_ENTRY}, ['Main', 'Foo']) == set()
+    changed = ProjectIndex.entry({'bar': ('function', 2), 'baz': ('method', 0)}, [])
+    assert index.update({'Foo': changed}, ['Main', 'Foo']) == {'Foo.bar'}
+    assert index.update({}, ['Main']) == {'Foo.bar', 'Foo.baz'}
+    assert set(index.classes) == {'Main'}
+
+
+def test_dependents(tmp_path):
+    index = project_index(tmp_path)
+    assert index.dependents({'Foo.bar'}) == {'Main', 'Foo'}
+    assert index.dependents({'Foo.baz'}) == {'Main'}
+    assert index.dependents({'Main.main'}) == set()
+
+
+def test_callers_and_callees(tmp_path):
+    index = project_index(tmp_path)
+    assert index.callers('Foo.bar') == [('Foo.baz', 'Foo.bar', 1), ('Main.main', 'Foo.bar', 1)]
+    assert index.callers('Foo') == [('Foo.baz', 'Foo.bar', 1), ('Main.main', 'Foo.bar', 1),
+                                    ('Main.main', 'Foo.baz', 0)]
+    assert index.callees('Main.main') == [('Main.main', 'Foo.bar', 1), ('Main.main', 'Foo.baz', 0),
+                                          ('Main.main', 'Output.printInt', 1)]
+    assert index.callees('Foo.bar') == []
+    assert index.callees('Missing') == []
+
+
+def test_check(tmp_path):
+    index = project_index(tmp_path)
+    assert index.check('Main') == ['Main.main calls Foo.baz with 0 arguments, but method Foo.baz takes 1 '
+                                   'counting this']
+    assert index.check('Foo') == []
+    index.classes['Foo']['subroutines'].pop('bar')
+    assert index.check('Foo') == ['Foo.baz calls Foo.bar, which is not defined']
+
+
+def test_save_and_load(tmp_path):
+    project_index(tmp_path).save()
+    index = ProjectIndex(str(tmp_path))
+    assert index.exists
+    assert index.callers('Foo.bar') == project_index(tmp_path).callers('Foo.bar')
+
+
+def test_who_calls_and_calls(tmp_path):
+    write_project(tmp_path)
+    assert jack_compiler(tmp_path).returncode == 0
+    result = jack_compiler(tmp_path, '--who-calls', 'Foo.qux')
+    assert result.returncode == 0
+    assert result.stdout == 'Foo.baz -> Foo.qux (1 arguments)\n'
+    result = jack_compiler(tmp_path, '--calls', 'Main')
+    assert result.stdout.splitlines() == ['Main.main -> Foo.bar (1 arguments)', 'Main.main -> Foo.baz (0 arguments)',
+                                          'Main.main -> Output.printInt (1 arguments)']
+
+
+def test_calls_need_an_index(tmp_path):
+    write_project(tmp_path)
+    result = jack_compiler(tmp_path, '--calls', 'Main')
+    assert result.returncode == 1
+    assert result.stdout == ''
+    assert result.stderr == f"{tmp_path}: no project index yet, compile the directory first\n"
+
+
+def test_lost_index_is_rebuilt_from_cached_classes(tmp_path):
+    write_project(tmp_path)
+    jack_compiler(tmp_path)
+    for contents in (None, 'not json'):
+        os.remove(tmp_path / '.jackindex.json')
+        if contents is not None:
+            (tmp_path / '.jackindex.json').write_text(contents)
+        result = jack_compiler(tmp_path, '--cache-stats')
+        assert result.stdout.splitlines()[0] == 'cache: 0 hits, 2 misses, 0 rechecked'
+        assert jack_compiler(tmp_path, '--who-calls', 'Foo.bar').stdout == 'Main.main -> Foo.bar (1 arguments)\n'
+    assert jack_compiler(tmp_path, '--cache-stats').stdout.splitlines()[0] == 'cache: 2 hits, 0 misses, 0 rechecked'
+
+
+def test_warnings_repeat_until_fixed(tmp_path):
+    write_project(tmp_path)
+    (tmp_path / 'Main.jack').write_text(MAIN.replace('Foo.bar(1)', 'Foo.bar(1, 2)'))
+    warning = (f"{tmp_path}/Main.jack: warning: Main.main calls Foo.bar with 2 arguments, but function Foo.bar "
+               f"takes 1\n")
+    assert jack_compiler(tmp_path).stderr == warning
+    assert jack_compiler(tmp_path).stderr == warning
+    (tmp_path / 'Main.jack').write_text(MAIN)
+    assert jack_compiler(tmp_path).stderr == ''
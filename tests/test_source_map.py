@@ -0,0 +1,87 @@
+import json
+
+from JackCompiler import CompileOptions, compile_file
+
+SOURCE = '''class Main {
+    function void main() {
+        var int i;
+        var int total;
+        let i = 0;
+        while (i < 3) {
+            if (i = 1) {
+                let total = total + i;
+            } else {
+                let total = total - 1;
+            }
+            let i = i + 1;
+        }
+        return;
+    }
+
+    constructor Main new()
+    {
+        var int unused;
+        return this;
+    }
+}
+'''
+
+
+def source_map(tmp_path, options):
+    path = tmp_path / 'Main.jack'
+    path.write_text(SOURCE)
+    compile_file(str(path), options)
+    with open(str(path).replace('.jack', '.vm.map')) as f:
+        lines = json.load(f)['lines']
+    return list(zip((tmp_path / 'Main.vm').read_text().splitlines(), lines))
+
+
+def line_of(mapped, command):
+    return next(line for vm, line in mapped if vm == command)
+
+
+def test_declarations_map_to_their_first_line(tmp_path):
+    mapped = source_map(tmp_path, CompileOptions(source_map=True))
+    assert line_of(mapped, 'function Main.main 2') == 2
+    assert line_of(mapped, 'function Main.new 1') == 17
+    assert line_of(mapped, 'call Memory.alloc 1') == 17
+    assert line_of(mapped, 'push pointer 0') == 20
+
+
+def test_labels_map_to_their_statement(tmp_path):
+    mapped = source_map(tmp_path, CompileOptions(source_map=True))
+    for command in ('label START0', 'if-goto END0', 'goto START0', 'label END0'):
+        assert line_of(mapped, command) == 6
+    for command in ('if-goto IF_TRUE0', 'goto IF_FALSE0', 'label IF_TRUE0', 'goto IF_END0', 'label IF_FALSE0',
+                    'label IF_END0'):
+        assert line_of(mapped, command) == 7
+    assert line_of(mapped, 'sub') == 10
+    assert line_of(mapped, 'return') == 14
+
+
+def test_optimized_map_keeps_lines(tmp_path):
+    mapped = source_map(tmp_path, CompileOptions(source_map=True, optimize=True, cfg=True))
+    assert line_of(mapped, 'function Main.main 2') == 2
+    assert all(line is not None for vm, line in mapped)
+
+
+def test_held_back_constants_keep_their_line(tmp_path):
+    path = tmp_path / 'Main.jack'
+    path.write_text('''class Main {
+    function void main() {
+        var int x, y;
+        let x = 3
+            + y;
+        let y = -3
+            - x;
+        return;
+    }
+}
+''')
+    compile_file(str(path), CompileOptions(source_map=True, optimize=True))
+    with open(str(path).replace('.jack', '.vm.map')) as f:
+        lines = json.load(f)['lines']
+    mapped = list(zip((tmp_path / 'Main.vm').read_text().splitlines(), lines))
+    assert mapped[1:11] == [('push constant 3', 4), ('push local 1', 5), ('add', 5), ('pop local 0', 5),
+                            ('push constant 2', 6), ('not', 6), ('push local 0', 7), ('sub', 7),
+                            ('pop local 1', 7), ('push constant 0', 8)]
@@ -0,0 +1,53 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+from JackCompiler import CompileOptions, compile_source, compile_stream
+
+from support import PROGRAM
+
+
+def jack_compiler(*args, **kwargs):
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'JackCompiler.py')] + list(args),
+                          capture_output=True, text=True, **kwargs)
+
+
+@pytest.mark.parametrize('options', [CompileOptions(), CompileOptions(optimize=True, pool_strings=True)])
+def test_stream_matches_compile_source(options):
+    for source in PROGRAM.values():
+        outfile = io.StringIO()
+        compile_stream(io.StringIO(source), outfile, options)
+        assert outfile.getvalue() == compile_source(source, options)
+
+
+def test_stdin_compiles_to_stdout():
+    result = jack_compiler('-', '-O', input=PROGRAM['Point'])
+    assert result.returncode == 0
+    assert result.stdout == compile_source(PROGRAM['Point'], CompileOptions(optimize=True))
+
+
+def test_stream_writes_the_vm_file(tmp_path):
+    source = tmp_path / 'Point.jack'
+    source.write_text(PROGRAM['Point'])
+    assert jack_compiler(str(source), '--stream').returncode == 0
+    assert (tmp_path / 'Point.vm').read_text() == compile_source(PROGRAM['Point'])
+
+
+@pytest.mark.parametrize('flags', [['--profile'], ['--profile-json', 'profile.json'], ['--whole-program'],
+                                   ['--inline']])
+def test_stream_rejects_whole_file_flags(flags):
+    result = jack_compiler('-', *flags, input=PROGRAM['Point'])
+    assert result.returncode == 2
+    assert '--profile, --whole-program and --inline need a .jack file or a directory' in result.stderr
+    assert result.stdout == ''
+
+
+def test_stream_rejects_directories(tmp_path):
+    result = jack_compiler(str(tmp_path), '--stream')
+    assert result.returncode == 2
+    assert '--stream needs a .jack file' in result.stderr
@@ -0,0 +1,44 @@
+from JackCompiler import SymbolTable, compile_source
+
+SHADOWED = '''class Counter {
+    field int count, step;
+    static int total;
+
+    method void tick(int step) {
+        var int count;
+        let count = step;
+        let total = count;
+        return;
+    }
+
+    method int get() {
+        return count;
+    }
+}
+'''
+
+
+def function(vm, name):
+    lines = vm.splitlines()
+    start = lines.index(next(line for line in lines if line.startswith(f"function {name} ")))
+    end = next((i for i in range(start + 1, len(lines)) if lines[i].startswith('function ')), len(lines))
+    return lines[start + 1:end]
+
+
+def test_locals_and_arguments_shadow_fields():
+    body = function(compile_source(SHADOWED), 'Counter.tick')
+    assert body[2:6] == ['push argument 1', 'pop local 0', 'push local 0', 'pop static 0']
+
+
+def test_fields_are_visible_when_not_shadowed():
+    assert function(compile_source(SHADOWED), 'Counter.get')[2:] == ['push this 0', 'return']
+
+
+def test_symbol_table_counts_each_kind():
+    table = SymbolTable()
+    table.define('a', 'int', 'ARG')
+    table.define('b', 'int', 'VAR')
+    table.define('c', 'int', 'VAR')
+    assert (table.get('c').kind, table.get('c').index) == ('VAR', 1)
+    assert table.var_count('VAR') == 2
+    assert table.get('missing') is None
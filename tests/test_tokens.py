@@ -0,0 +1,46 @@
+import io
+
+from JackCompiler import (DOT, IDENTIFIER, KEYWORD, LEFT_PAREN, LEXEME_IDS, NO_LEXEME, SEMICOLON, STRING_CONSTANT,
+                          StreamingAgent, Tokenizer, VMWriter, VM_agent)
+
+from support import PROGRAM
+
+SOURCE = 'class Main { function void main() { do Output.printString("a;b"); return; } }'
+
+
+def peeks(agent):
+    seen = []
+    while agent.peek_next_token_type() is not None:
+        seen.append((agent.peek_next_token(), agent.peek_next_token(1)))
+        agent.get_token()
+    return seen
+
+
+def test_keywords_and_symbols_are_interned():
+    tokens = Tokenizer.scan(SOURCE)
+    assert tokens[0] == (KEYWORD, 'class')
+    assert tokens.ids[0] == LEXEME_IDS['class']
+    assert tokens[1] == (IDENTIFIER, 'Main')
+    assert tokens.ids[1] == NO_LEXEME
+    string = next(i for i in range(len(tokens)) if tokens.kinds[i] == STRING_CONSTANT)
+    assert tokens[string] == (STRING_CONSTANT, 'a;b')
+    assert tokens.ids[string] == NO_LEXEME
+
+
+def test_peeks_return_ids():
+    agent = VM_agent(Tokenizer.scan(SOURCE), VMWriter())
+    agent.position = 10
+    assert agent.get_token() == 'Output'
+    assert agent.peek_next_token() == DOT
+    assert agent.peek_next_token(2) == LEFT_PAREN
+    assert agent.peek_next_token(3) == NO_LEXEME
+    assert agent.peek_next_token(5) == SEMICOLON
+    agent.position = len(agent.tokens)
+    assert agent.peek_next_token() == NO_LEXEME
+
+
+def test_streaming_peeks_match():
+    for source in [SOURCE] + list(PROGRAM.values()):
+        scanned = VM_agent(Tokenizer.scan(source), VMWriter())
+        streamed = StreamingAgent(Tokenizer.stream(io.StringIO(source), chunk_size=16), VMWriter())
+        assert peeks(streamed) == peeks(scanned)
@@ -0,0 +1,41 @@
+from JackCompiler import DeadCodeEliminator, compile_text
+
+MAIN = '''class Main {
+    function void main() {
+        do Output.printInt(Util.used());
+        return;
+    }
+}
+'''
+
+UTIL = '''class Util {
+    function int used() {
+        return Util.helper();
+    }
+    function int helper() {
+        return 1;
+    }
+    function int unused() {
+        return Util.helper();
+    }
+}
+'''
+
+
+def functions(programs):
+    return [command.arg1 for commands in programs for command in commands if command.op == 'function']
+
+
+def test_unreachable_subroutines_are_removed():
+    eliminator = DeadCodeEliminator()
+    programs = eliminator.eliminate([compile_text(source)[0].commands for source in (MAIN, UTIL)])
+    assert functions(programs) == ['Main.main', 'Util.used', 'Util.helper']
+    assert eliminator.removed == ['Util.unused']
+
+
+def test_library_without_entry_point_is_kept():
+    eliminator = DeadCodeEliminator()
+    programs = eliminator.eliminate([compile_text(UTIL)[0].commands])
+    assert functions(programs) == ['Util.used', 'Util.helper', 'Util.unused']
+    assert eliminator.skipped
+    assert eliminator.removed == []